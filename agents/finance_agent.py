@@ -5,19 +5,26 @@ import datetime
 
 from flask import Flask, request, jsonify
 
-from finance_insights import collect_finance_insights
+from finance_insights import collect_finance_insights, insights_cache_key, cached_advice, remember_advice
 from finance_llm_client import call_llm
 import sys
 import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from db.finance_db import init_db, upsert_daily_financial, add_product_financial
+from db.finance_db import init_db, upsert_daily_financial, add_to_daily_financial, add_product_financial
 from db.finance_functions import get_daily_profit
+import metrics
+import tracing
 
 
 app = Flask(__name__)
+tracing.instrument_flask(app, "finance")
+metrics.instrument_flask(app, "finance")
 
+# LLM cache TTL (seconds): same insights + same question -> same answer.
+# auto_check advice is cached with the insights instead (finance_insights).
+MESSAGE_CACHE_TTL = 10 * 60
 
 FINANCE_SYSTEM_PROMPT = """
 You are a senior restaurant business consultant.
@@ -62,7 +69,7 @@ def generate_advice_from_insights(insights: List[Dict]) -> Dict:
     llm_response = call_llm(
         system_prompt=FINANCE_SYSTEM_PROMPT,
         user_message=user_message,
-        response_format="json"
+        response_format="json",
     )
     return llm_response
 
@@ -75,8 +82,14 @@ def auto_check_and_advise(today: datetime.date | None = None) -> Dict:
     if today is None:
         today = datetime.date.today()
 
-    insights = collect_finance_insights(today)
-    advice = generate_advice_from_insights(insights)
+    # same day + same data version -> same insights, so the advice is reused too
+    key = insights_cache_key(today)
+    with tracing.span("db collect_finance_insights", kind="db"):
+        insights = collect_finance_insights(today, key=key)
+    advice = cached_advice(key)
+    if advice is None:
+        advice = generate_advice_from_insights(insights)
+        remember_advice(key, advice)
 
     return {
         "date": today.isoformat(),
@@ -94,7 +107,8 @@ def handle_finance_message(user_text: str,
     if today is None:
         today = datetime.date.today()
 
-    insights = collect_finance_insights(today)
+    with tracing.span("db collect_finance_insights", kind="db"):
+        insights = collect_finance_insights(today)
 
     user_prompt = (
         "The restaurant owner asked: "
@@ -107,7 +121,8 @@ def handle_finance_message(user_text: str,
     llm_response = call_llm(
         system_prompt=FINANCE_SYSTEM_PROMPT,
         user_message=user_prompt,
-        response_format="json"
+        response_format="json",
+        cache_ttl=MESSAGE_CACHE_TTL,
     )
 
     return {
@@ -208,17 +223,10 @@ def api_record_purchase():
         cost=total_cost,
     )
 
-    # 2) update daily cost + recompute profit
-    existing = get_daily_profit(today, today)
-    if existing:
-        prev = existing[0]
-        revenue = prev["revenue"]
-        cost = prev["cost"] + total_cost
-    else:
-        revenue = 0.0
-        cost = total_cost
-
-    upsert_daily_financial(today, revenue=revenue, cost=cost)
+    # 2) add to the daily cost (atomic upsert) + get the new totals
+    totals = add_to_daily_financial(today, cost=total_cost)
+    revenue = totals["revenue"]
+    cost = totals["cost"]
 
     return jsonify({
         "status": "ok",
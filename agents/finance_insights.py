@@ -1,12 +1,18 @@
 # /agents/finance_insights.py
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+import copy
 import datetime
+import threading
 import sys
 import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from db import finance_db
 from db.finance_functions import get_daily_profit, get_profit_by_product_delta
+from agents.finance_trends import trend_insights
+import metrics
 # from db.mockDB import get_daily_profit, get_profit_by_product_delta
 
 def compute_trend(series: List[Dict]) -> Dict:
@@ -108,10 +114,85 @@ def detect_product_drivers_insight(
         },
     }
 
-def collect_finance_insights(today: datetime.date) -> List[Dict]:
+# ---------- cache: (db file, today, data version) -> insights + advice ----------
+# Every finance_db write bumps the data version, so an entry is reused only
+# while nothing was written; the detectors and the auto-check advice built on
+# them are skipped for repeated auto-checks over unchanged data. This is the
+# only advice cache: the key is computed once per request and passed down.
+
+INSIGHTS_CACHE_ITEMS = int(os.getenv("FINANCE_INSIGHTS_CACHE_ITEMS", "32"))
+
+_insights_cache: "OrderedDict[Tuple, Dict]" = OrderedDict()  # key -> {"insights", "advice"}
+_insights_cache_lock = threading.Lock()
+insights_cache_stats = {"hits": 0, "misses": 0}
+
+metrics.counter("finance_insights_cache_events_total", "collect_finance_insights cache lookups", ["event"],
+                fn=lambda: {(k,): v for k, v in insights_cache_stats.items()})
+
+_COMPUTE = object()  # collect_finance_insights(key=...) default: compute the key
+
+
+def insights_cache_key(today: datetime.date) -> Tuple | None:
+    """None when the database has no data version yet (not migrated): no caching."""
+    version = finance_db.get_data_version()
+    if version is None:
+        return None
+    return (str(finance_db.DB_PATH), today.isoformat(), version)
+
+
+def clear_insights_cache() -> None:
+    with _insights_cache_lock:
+        _insights_cache.clear()
+
+
+def collect_finance_insights(today: datetime.date, key=_COMPUTE) -> List[Dict]:
     """
     This is called by FinanceAgent and by monitor.
+    Cached per insights_cache_key(today) (pass `key` if the caller already
+    has it); callers get their own copy.
     """
+    if key is _COMPUTE:
+        key = insights_cache_key(today)
+    if key is not None:
+        with _insights_cache_lock:
+            entry = _insights_cache.get(key)
+            if entry is not None:
+                _insights_cache.move_to_end(key)
+                insights_cache_stats["hits"] += 1
+                return copy.deepcopy(entry["insights"])
+            insights_cache_stats["misses"] += 1
+
+    insights = _run_detectors(today)
+
+    if key is not None:
+        with _insights_cache_lock:
+            _insights_cache[key] = {"insights": copy.deepcopy(insights), "advice": None}
+            while len(_insights_cache) > INSIGHTS_CACHE_ITEMS:
+                _insights_cache.popitem(last=False)
+    return insights
+
+
+def cached_advice(key) -> Dict | None:
+    """Advice stored with the insights of `key`, if any."""
+    if key is None:
+        return None
+    with _insights_cache_lock:
+        entry = _insights_cache.get(key)
+        advice = entry and entry["advice"]
+    return copy.deepcopy(advice) if advice is not None else None
+
+
+def remember_advice(key, advice: Dict) -> None:
+    """Attaches advice to the cached insights of `key` (dropped with them)."""
+    if key is None:
+        return
+    with _insights_cache_lock:
+        entry = _insights_cache.get(key)
+        if entry is not None:
+            entry["advice"] = copy.deepcopy(advice)
+
+
+def _run_detectors(today: datetime.date) -> List[Dict]:
     insights: List[Dict] = []
 
     overall = detect_profit_decline_insight(today)
@@ -122,6 +203,9 @@ def collect_finance_insights(today: datetime.date) -> List[Dict]:
     if drivers:
         insights.append(drivers)
 
+    # slope / EWMA / weekday-adjusted z-scores, every product at once (numpy; [] without it)
+    insights.extend(trend_insights(today))
+
     # You can add more detectors:
     # - cost increase on an ingredient
     # - drop in average ticket size
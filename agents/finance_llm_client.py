@@ -1,25 +1,25 @@
 # agents/finance_llm_client.py
 
 import os
+import sys
 import json
 from typing import Any, Dict, Optional
 
-import requests
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from llm_gateway import complete
+from llm_cache import make_key, cache_get, cache_set
+from log import get_logger
 
 # Use the same env var you already use for OpenRouter
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 DEFAULT_MODEL = "openai/gpt-4.1-mini"
 
-# Toggle verbose logging with env var; default ON
-DEBUG_FINANCE_LLM = os.getenv("DEBUG_FINANCE_LLM", "1") == "1"
+# DEBUG_FINANCE_LLM=1 logs prompts and raw answers (truncated) for this module
+# even when LOG_LEVEL is higher; off by default, prompts contain business data
+DEBUG_FINANCE_LLM = os.getenv("DEBUG_FINANCE_LLM", "0") == "1"
 
-
-def _print_llm_debug_header():
-    print("\n" + "=" * 80)
-    print("[FINANCE LLM] call_llm() via OpenRouter")
-    print("=" * 80)
+log = get_logger("finance_llm", level="DEBUG" if DEBUG_FINANCE_LLM else None)
 
 
 def _openrouter_call(
@@ -38,33 +38,16 @@ def _openrouter_call(
             "to your sk-or-v1-... key."
         )
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-        # Optional for OpenRouter analytics
-        "HTTP-Referer": "http://localhost:5004",
-        "X-Title": "BizzGenie Finance Agent",
-    }
-
-    payload = {
-        "model": model,
-        "temperature": temperature,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message},
-        ],
-    }
-
-    print("🧠 Finance sending request to OpenRouter...")
-    resp = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=60)
-
-    if resp.status_code != 200:
-        print(f"🔴 OpenRouter API Error (finance): {resp.status_code}")
-        print(f"🔴 Response Body: {resp.text}")
-        resp.raise_for_status()
-
-    data = resp.json()
-    content = data["choices"][0]["message"]["content"]
+    log.info("sending request to OpenRouter", model=model)
+    # Pooled session, timeouts and retries live in llm_gateway
+    content = complete(
+        system_prompt,
+        user_message,
+        model=model,
+        temperature=temperature,
+        title="BizzGenie Finance Agent",
+        referer="http://localhost:5004",
+    )
 
     return content
 
@@ -74,6 +57,7 @@ def call_llm(
     user_message: str,
     response_format: str = "json",
     model: Optional[str] = None,
+    cache_ttl: Optional[float] = None,
 ) -> Dict[str, Any]:
     """
     High-level wrapper used by finance_agent.
@@ -83,20 +67,15 @@ def call_llm(
         then json.loads() it and return the python dict.
     - Otherwise:
         we return {"text": "<raw text>"}.
+
+    cache_ttl (seconds) opts the call into llm_cache. JSON answers are only
+    cached once they parse.
     """
     if model is None:
         model = DEFAULT_MODEL
 
-    if DEBUG_FINANCE_LLM:
-        _print_llm_debug_header()
-        print(f"[FINANCE LLM] model          : {model}")
-        print(f"[FINANCE LLM] response_format: {response_format}")
-        print("[FINANCE LLM] --- SYSTEM PROMPT (first 400 chars) ---")
-        print(system_prompt[:400])
-        print("[FINANCE LLM] --- USER MESSAGE (first 400 chars) ---")
-        print(user_message[:400])
-        if len(user_message) > 400:
-            print("... (truncated)")
+    log.debug("call_llm", model=model, response_format=response_format,
+              system_prompt=system_prompt, user_message=user_message)
 
     if response_format == "json":
         # Strengthen the system prompt with strict JSON instructions
@@ -109,17 +88,19 @@ def call_llm(
               "- NO extra commentary.\n"
         )
 
-        raw = _openrouter_call(
-            strict_system_prompt,
-            user_message,
-            model=model,
-            temperature=0.1,  # low temperature for more deterministic JSON
-        )
+        cache_key = make_key(model, strict_system_prompt, user_message, 0.1)
+        raw = cache_get(cache_key, cache_ttl)
+        if raw is not None:
+            log.debug("cache hit", model=model)
+        else:
+            raw = _openrouter_call(
+                strict_system_prompt,
+                user_message,
+                model=model,
+                temperature=0.1,  # low temperature for more deterministic JSON
+            )
 
-        if DEBUG_FINANCE_LLM:
-            print("[FINANCE LLM] --- RAW JSON TEXT (from OpenRouter) ---")
-            print(raw)
-            print("[FINANCE LLM] ---------------------------------------")
+        log.debug("raw json answer", raw=raw)
 
         # In case the model still wraps in ```json ``` or ``` ```
         if "```" in raw:
@@ -138,26 +119,25 @@ def call_llm(
         try:
             parsed = json.loads(raw)
         except json.JSONDecodeError as e:
-            print("[FINANCE LLM] !!! JSON DECODE ERROR !!!")
-            print(f"Error: {e}")
-            print("Offending text:")
-            print(raw)
+            log.error("json decode error", error=str(e), raw=raw)
             raise
 
+        cache_set(cache_key, raw, cache_ttl)
         return parsed
 
     else:
         # Plain text mode – e.g. if you ever want a natural-language answer
-        raw = _openrouter_call(
-            system_prompt,
-            user_message,
-            model=model,
-            temperature=0.7,
-        )
-
-        if DEBUG_FINANCE_LLM:
-            print("[FINANCE LLM] --- RAW TEXT RESPONSE (from OpenRouter) ---")
-            print(raw)
-            print("[FINANCE LLM] -----------------------------------------")
+        cache_key = make_key(model, system_prompt, user_message, 0.7)
+        raw = cache_get(cache_key, cache_ttl)
+        if raw is None:
+            raw = _openrouter_call(
+                system_prompt,
+                user_message,
+                model=model,
+                temperature=0.7,
+            )
+            cache_set(cache_key, raw, cache_ttl)
+
+        log.debug("raw text answer", raw=raw)
 
         return {"text": raw}
@@ -0,0 +1,234 @@
+# agents/finance_trends.py
+"""
+Vectorized trend / anomaly engine for finance insights (NumPy).
+
+The daily totals and every product's daily profit over the last
+LOOKBACK_DAYS are loaded with one query each into a (series x days)
+matrix; all statistics are then computed for every series at once:
+
+- least-squares slope (profit per day; days flagged by the z-score are
+  replaced by their expected value first) and mean level
+- EWMA of profit (recent level, last days weighted most)
+- day-of-week seasonality: per-series weekday means, residual = profit - weekday mean
+- rolling z-score of each day's residual against the previous Z_WINDOW residuals
+
+trend_insights(today) turns the last day's numbers into insights in the
+collect_finance_insights format. Products are only scored when they have
+profit rows on at least MIN_ACTIVE_SHARE of the days (sparse series, e.g.
+a purchase every few days, would flag every purchase).
+
+numpy is optional: without it trend_insights() returns [] and the
+plain detectors in finance_insights still run.
+
+Env: FINANCE_TRENDS_LOOKBACK_DAYS (56), FINANCE_TRENDS_Z_WINDOW (28), FINANCE_TRENDS_Z (3.0).
+"""
+import datetime
+import os
+from typing import Dict, List
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:  # optional dependency
+    np = None
+
+from db.finance_functions import get_daily_profit, get_product_profit_series
+from log import get_logger
+
+log = get_logger("finance_trends")
+
+LOOKBACK_DAYS = int(os.getenv("FINANCE_TRENDS_LOOKBACK_DAYS", "56"))
+Z_WINDOW = int(os.getenv("FINANCE_TRENDS_Z_WINDOW", "28"))
+Z_THRESHOLD = float(os.getenv("FINANCE_TRENDS_Z", "3.0"))
+EWMA_ALPHA = 0.3
+MIN_DAYS = 14               # total series: days with a daily_financials row
+MIN_ACTIVE_SHARE = 0.5      # products: share of days with a row
+TREND_DROP = 0.2            # fitted change over the window, as a share of the mean level
+TOP_N = 10
+
+_warned = False
+
+
+def available() -> bool:
+    global _warned
+    if np is None and not _warned:
+        _warned = True
+        log.info("numpy not installed, trend engine disabled")
+    return np is not None
+
+
+# ---------- arrays ----------
+
+def to_matrix(start: datetime.date, n_days: int, dates: List[str], keys: List, values: List[float]):
+    """
+    (keys, matrix): one row per distinct key, one column per day from start;
+    days without a row are 0, several rows for one (key, day) are summed.
+    """
+    if not keys:
+        return np.array([]), np.zeros((0, n_days))
+    day = (np.array(dates, dtype="datetime64[D]") - np.datetime64(start.isoformat(), "D")).astype(int)
+    uniq, row = np.unique(np.asarray(keys), return_inverse=True)
+    matrix = np.zeros((len(uniq), n_days))
+    np.add.at(matrix, (row, day), np.asarray(values, dtype=float))
+    return uniq, matrix
+
+
+def series_stats(matrix, start: datetime.date, z_window: int = Z_WINDOW,
+                 z_threshold: float = Z_THRESHOLD, alpha: float = EWMA_ALPHA) -> Dict:
+    """
+    Statistics per row of `matrix` (series x days, first column = start);
+    every value is an array with one entry per series (z: series x scored days).
+    """
+    n_series, n_days = matrix.shape
+    z_window = min(z_window, n_days - 1)
+
+    # weekday means from every day but the last one (the day being judged)
+    weekday = (np.arange(n_days) + start.weekday()) % 7
+    onehot = np.eye(7)[weekday]
+    counts = onehot[:-1].sum(axis=0)
+    weekday_mean = matrix[:, :-1] @ onehot[:-1] / np.maximum(counts, 1)
+    resid = matrix - weekday_mean[:, weekday]
+
+    # window k covers days k .. k+z_window-1 and scores day k+z_window
+    windows = sliding_window_view(resid, z_window, axis=1)[:, :-1]
+    mu = windows.mean(axis=2)
+    sd = windows.std(axis=2)
+    flat = sd < 1e-9  # no variation to compare against
+    z = np.where(flat, 0.0, (resid[:, z_window:] - mu) / np.where(flat, 1.0, sd))
+    expected = weekday_mean[:, weekday[z_window:]] + mu
+
+    # the trend is fitted with anomalous days replaced by their expected value,
+    # so a single outlier (already reported by its z-score) does not tilt the slope
+    cleaned = matrix.copy()
+    cleaned[:, z_window:] = np.where(np.abs(z) >= z_threshold, expected, matrix[:, z_window:])
+    x = np.arange(n_days, dtype=float)
+    xc = x - x.mean()
+    level = matrix.mean(axis=1)
+    slope = (cleaned - cleaned.mean(axis=1, keepdims=True)) @ xc / (xc @ xc)
+
+    weights = (1 - alpha) ** np.arange(n_days)[::-1]  # 1 for the last day
+    ewma = matrix @ weights / weights.sum()
+
+    return {
+        "level": level,
+        "slope": slope,
+        "ewma": ewma,
+        "expected_last": expected[:, -1],
+        "resid": resid,
+        "z": z,
+        "z_last": z[:, -1],
+        "active_share": (matrix != 0).mean(axis=1),
+        "fitted_change": slope * (n_days - 1),
+    }
+
+
+# ---------- insights ----------
+
+def _r(value) -> float:
+    return round(float(value), 2)
+
+
+def _product_row(i: int, ids, names: Dict, matrix, stats: Dict) -> Dict:
+    pid = str(ids[i])
+    return {
+        "product_id": pid,
+        "product_name": names.get(pid, pid),
+        "profit_last_day": _r(matrix[i, -1]),
+        "expected": _r(stats["expected_last"][i]),
+        "z_score": _r(stats["z_last"][i]),
+        "ewma": _r(stats["ewma"][i]),
+        "slope_per_day": _r(stats["slope"][i]),
+        "mean_profit": _r(stats["level"][i]),
+    }
+
+
+def trend_insights(today: datetime.date) -> List[Dict]:
+    if not available():
+        return []
+    start = today - datetime.timedelta(days=LOOKBACK_DAYS)
+    n_days = LOOKBACK_DAYS + 1
+    window = {"start": start.isoformat(), "end": today.isoformat()}
+    insights: List[Dict] = []
+
+    # ---- store total ----
+    daily = get_daily_profit(start, today)
+    if len(daily) >= MIN_DAYS:
+        _, total = to_matrix(start, n_days, [d["date"].isoformat() for d in daily],
+                             [0] * len(daily), [d["profit"] for d in daily])
+        st = series_stats(total, start)
+        z_last = st["z_last"][0]
+        if z_last <= -Z_THRESHOLD:
+            insights.append({
+                "type": "profit_anomaly",
+                "severity": "high" if z_last <= -(Z_THRESHOLD + 1) else "medium",
+                "metric": "profit",
+                "time_window": window,
+                "evidence": {
+                    "profit_last_day": _r(total[0, -1]),
+                    "expected": _r(st["expected_last"][0]),
+                    "z_score": _r(z_last),
+                    "ewma": _r(st["ewma"][0]),
+                },
+            })
+        level = abs(st["level"][0])
+        if level > 0 and st["fitted_change"][0] <= -TREND_DROP * level:
+            insights.append({
+                "type": "overall_profit_trend",
+                "severity": "high" if st["fitted_change"][0] <= -2 * TREND_DROP * level else "medium",
+                "metric": "profit",
+                "time_window": window,
+                "evidence": {
+                    "slope_per_day": _r(st["slope"][0]),
+                    "fitted_change": _r(st["fitted_change"][0]),
+                    "mean_profit": _r(st["level"][0]),
+                    "ewma": _r(st["ewma"][0]),
+                },
+            })
+
+    # ---- every product, one pass ----
+    series = get_product_profit_series(start, today)
+    ids, matrix = to_matrix(start, n_days, series["date"], series["product_id"], series["profit"])
+    if not len(ids):
+        return insights
+    names = dict(zip(series["product_id"], series["product_name"]))
+    st = series_stats(matrix, start)
+    dense = st["active_share"] >= MIN_ACTIVE_SHARE
+    z_last = st["z_last"]
+
+    drops = np.flatnonzero(dense & (z_last <= -Z_THRESHOLD))
+    if len(drops):
+        spikes = np.flatnonzero(dense & (z_last >= Z_THRESHOLD))
+        drops = drops[np.argsort(z_last[drops])][:TOP_N]
+        spikes = spikes[np.argsort(-z_last[spikes])][:TOP_N]
+        insights.append({
+            "type": "product_profit_anomalies",
+            "severity": "high" if z_last[drops[0]] <= -(Z_THRESHOLD + 1) else "medium",
+            "metric": "profit",
+            "time_window": window,
+            "evidence": {
+                "z_threshold": Z_THRESHOLD,
+                "products_scored": int(dense.sum()),
+                "drops": [_product_row(i, ids, names, matrix, st) for i in drops],
+                "spikes": [_product_row(i, ids, names, matrix, st) for i in spikes],
+            },
+        })
+
+    level = np.abs(st["level"])
+    declining = np.flatnonzero(dense & (level > 0) & (st["fitted_change"] <= -TREND_DROP * level))
+    if len(declining):
+        relative = st["fitted_change"][declining] / level[declining]
+        declining = declining[np.argsort(relative)][:TOP_N]
+        insights.append({
+            "type": "product_profit_trends",
+            "severity": "medium",
+            "metric": "profit",
+            "time_window": window,
+            "evidence": {
+                "declining_products": [
+                    {**_product_row(i, ids, names, matrix, st),
+                     "fitted_change": _r(st["fitted_change"][i])}
+                    for i in declining
+                ],
+            },
+        })
+    return insights
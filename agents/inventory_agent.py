@@ -1,24 +1,40 @@
 import os
 import json
-import requests
-from flask import Flask, request, jsonify
+import base64
+import zlib
+import math
+import sqlite3
+from flask import Flask, request, jsonify, make_response
 from datetime import datetime, timedelta
 import sys
 
 # Ensure database folder is visible
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from db.inventory_functions import init_db, add_product, consume_product, get_alerts, get_all_inventory
+from llm_gateway import complete
+from llm_cache import make_key, cache_get, cache_set
+import metrics
+import tracing
+from log import get_logger
+from db import inventory_functions
+from db.inventory_db import get_manager
+from db.inventory_functions import (
+    init_db, apply_batch, get_alerts, get_all_inventory, get_product_names,
+    get_consumption, get_movements, get_inventory_version, get_inventory_changes,
+    query_inventory, get_product_totals, LOT_FIELDS
+)
 
 app = Flask(__name__)
+tracing.instrument_flask(app, "inventory")
+metrics.instrument_flask(app, "inventory")
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+INVENTORY_MODEL = "openai/gpt-4o-mini"
+# Prompts embed today's date, so cached parses never outlive the day anyway
+PARSE_CACHE_TTL = 6 * 60 * 60
 
 
-# -------------- COLOR LOGGING HELPERS --------------
-def green(msg): print(f"\033[92m{msg}\033[0m")
-def yellow(msg): print(f"\033[93m{msg}\033[0m")
-def red(msg): print(f"\033[91m{msg}\033[0m")
-def cyan(msg): print(f"\033[96m{msg}\033[0m")
+# -------------- LOGGING --------------
+# leveled JSON logs (log.py); LOG_LEVEL=DEBUG shows per-item details and full responses
+log = get_logger("inventory")
 
 
 # ---------------------------------------------------
@@ -28,7 +44,7 @@ def cyan(msg): print(f"\033[96m{msg}\033[0m")
 def query_llm(user_text):
     current_date = datetime.now().strftime("%Y-%m-%d")
 
-    cyan(f"\n🧠 LLM REQUEST → Processing user message: '{user_text}'")
+    log.info("llm parse request", message=user_text)
 
     prompt = f"""
     You are an Intelligent Inventory System. Today is {current_date}.
@@ -51,31 +67,15 @@ def query_llm(user_text):
     }}
     """
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    data = {
-        "model": "openai/gpt-4o-mini",
-        "messages": [{"role": "user", "content": prompt}]
-    }
-
+    cache_key = make_key(INVENTORY_MODEL, None, prompt, None)
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers, json=data
-        )
+        raw_content = cache_get(cache_key, PARSE_CACHE_TTL)
+        if raw_content is None:
+            raw_content = complete(None, prompt, model=INVENTORY_MODEL, title="BizzGenie Inventory Agent")
+        else:
+            log.debug("llm cache hit", kind="parse")
 
-        if response.status_code != 200:
-            red(f"❌ LLM API Error: {response.status_code}")
-            red(response.text)
-            return None
-
-        raw_content = response.json()['choices'][0]['message']['content']
-
-        cyan("🔍 RAW LLM RESPONSE:")
-        print(raw_content)
+        log.debug("llm raw response", raw=raw_content)
 
         # Strip markdown fences if present
         if "```json" in raw_content:
@@ -83,132 +83,611 @@ def query_llm(user_text):
 
         parsed = json.loads(raw_content.strip())
 
-        green(f"✅ PARSED LLM JSON: {parsed}")
+        log.debug("llm parsed", parsed=parsed)
+        cache_set(cache_key, raw_content, PARSE_CACHE_TTL)
         return parsed
 
     except Exception as e:
-        red(f"❌ CRITICAL ERROR talking to LLM: {e}")
+        log.error("llm parse failed", error=str(e))
         return None
 
 
 
+# ---------------------------------------------------
+# -------------- LLM ENRICH FUNCTION ----------------
+# ---------------------------------------------------
+
+def query_llm_enrich(items, known_names):
+    """
+    Single batched LLM call for structured actions that still miss
+    something (unknown product name or shelf life). Returns a list aligned
+    with `items` or None on failure.
+    """
+    current_date = datetime.now().strftime("%Y-%m-%d")
+
+    log.info("llm enrich request", items=len(items))
+
+    prompt = f"""
+    You are an Intelligent Inventory System. Today is {current_date}.
+    Known products in stock: {json.dumps(known_names, ensure_ascii=False)}
+    Items: {json.dumps(items, ensure_ascii=False)}
+
+    Tasks, for EACH item, in the same order:
+    1. Normalize the name (e.g. "tomatoes" -> "tomato"). If it refers to a known product, reuse that exact name.
+    2. Fill category, auto_buy and estimated_shelf_life_days when missing.
+    3. Return JSON ONLY.
+
+    Output Format:
+    {{
+      "items": [
+        {{ "normalized_name": "string", "category": "string", "auto_buy": boolean,
+           "estimated_shelf_life_days": number }}
+      ]
+    }}
+    """
+
+    cache_key = make_key(INVENTORY_MODEL, None, prompt, None)
+    try:
+        raw_content = cache_get(cache_key, PARSE_CACHE_TTL)
+        if raw_content is None:
+            raw_content = complete(None, prompt, model=INVENTORY_MODEL, title="BizzGenie Inventory Agent")
+        else:
+            log.debug("llm cache hit", kind="enrich")
+
+        if "```json" in raw_content:
+            raw_content = raw_content.split("```json")[1].split("```")[0]
+
+        enriched = json.loads(raw_content.strip()).get("items", [])
+        if len(enriched) != len(items):
+            log.error("llm enrich size mismatch", returned=len(enriched), expected=len(items))
+            return None
+
+        log.debug("llm enriched", items=enriched)
+        cache_set(cache_key, raw_content, PARSE_CACHE_TTL)
+        return enriched
+
+    except Exception as e:
+        log.error("llm enrich failed", error=str(e))
+        return None
+
+
+# ---------------------------------------------------
+# -------------- ITEM PROCESSING --------------------
+# ---------------------------------------------------
+
+ACTION_ALIASES = {
+    "add": "add",
+    "add stock": "add",
+    "consume": "consume",
+    "remove": "consume",
+    "remove stock": "consume",
+}
+
+
+def normalize_name(name):
+    return " ".join(str(name).strip().lower().split())
+
+
+DEFAULT_SHELF_LIFE_DAYS = 7
+MAX_SHELF_LIFE_DAYS = 36500  # 100 years; far beyond that the expiry date overflows
+
+
+def parse_shelf_life_days(value):
+    """
+    7, 7.0 or "7" -> 7; raises ValueError for anything else, a negative
+    number, or more than MAX_SHELF_LIFE_DAYS ("1e999", "Infinity", 5000000).
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"invalid estimated_shelf_life_days '{value}'")
+    try:
+        days = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"invalid estimated_shelf_life_days '{value}'") from None
+    if not 0 <= days <= MAX_SHELF_LIFE_DAYS:
+        raise ValueError(f"invalid estimated_shelf_life_days '{value}'")
+    return days
+
+
+def parse_quantity(value):
+    """Finite, positive number; raises ValueError otherwise (NaN, inf, 0, negative, text)."""
+    if isinstance(value, bool):
+        raise ValueError(f"invalid quantity '{value}'")
+    try:
+        qty = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"invalid quantity '{value}'") from None
+    if not math.isfinite(qty) or qty <= 0:
+        raise ValueError(f"invalid quantity '{value}'")
+    return qty
+
+
+def item_to_op(action, item):
+    """
+    Convert one parsed item ({normalized_name, quantity, unit, ...}) to an
+    apply_batch op. Shared by the free-text and the structured endpoints.
+    """
+    name = item["normalized_name"]
+    qty = float(item["quantity"])
+    unit = item.get("unit", "pcs")
+
+    if action == "add":
+        # Expiration date
+        if item.get("user_specified_date"):
+            expiry = item["user_specified_date"]
+        else:
+            try:
+                days = parse_shelf_life_days(item.get("estimated_shelf_life_days", DEFAULT_SHELF_LIFE_DAYS))
+            except ValueError:
+                # free-text path: the LLM's estimate is unusable, keep the default
+                log.warning("bad shelf life estimate", name=name, value=item.get("estimated_shelf_life_days"))
+                days = DEFAULT_SHELF_LIFE_DAYS
+            expiry = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+
+        return {"action": "add", "name": name, "category": item.get("category", "general"),
+                "quantity": qty, "unit": unit, "expiry": expiry,
+                "auto_buy": 1 if item.get("auto_buy") else 0}
+
+    elif action == "consume":
+        return {"action": "consume", "name": name, "quantity": qty, "unit": unit}
+
+    log.warning("unknown action", action=action, name=name)
+    return None
+
+
+def apply_items(pairs, idempotency_keys=()):
+    """
+    Apply [(action, item), ...] as one transaction (db apply_batch).
+    Returns one result per pair (None for unknown actions), or None when an
+    idempotency key was already applied (nothing done).
+    """
+    ops = [item_to_op(action, item) for action, item in pairs]
+    valid = [op for op in ops if op is not None]
+    with tracing.span("db apply batch", kind="db", ops=len(valid)):
+        applied = apply_batch(valid, idempotency_keys)
+    if applied is None:
+        return None
+    applied = iter(applied)
+    results = [next(applied) if op is not None else None for op in ops]
+    for op, result in zip(ops, results):
+        if op is not None:
+            log.debug("item applied", result=result, **op)
+    return results
+
+
+def build_final_response(logs):
+    # ---------------------------------------------------
+    # CHECK ALERTS
+    # ---------------------------------------------------
+    alerts = get_alerts()
+
+    # ---------------------------------------------------
+    # Assemble Response
+    # ---------------------------------------------------
+    response_text = "; ".join(logs)
+
+    if alerts["restock_needed"]:
+        response_text += "\n🛒 Auto-buy triggered for: " + ", ".join(alerts["restock_needed"])
+        log.info("auto buy needed", products=alerts["restock_needed"])
+
+    return {
+        "agent": "Inventory",
+        "response_text": response_text,
+        "alerts": alerts
+    }
+
+
+def match_known_name(name, known_names):
+    """Cheap plural fallback ("tomatoes" -> "tomato") before asking the LLM."""
+    if name in known_names:
+        return name
+    for suffix in ("es", "s"):
+        if name.endswith(suffix) and name[: -len(suffix)] in known_names:
+            return name[: -len(suffix)]
+    return name
+
+
+def _needs_enrichment(action, item, known_names):
+    if action == "consume":
+        return item["normalized_name"] not in known_names
+    has_expiry = item.get("user_specified_date") or item.get("estimated_shelf_life_days") is not None
+    return not has_expiry or not item.get("category")
+
+
+def prepare_structured_actions(actions):
+    """
+    Validate a batch of typed actions and convert them to the item format
+    used by item_to_op. The LLM is called at most once, and only for the
+    items that miss a known name or a shelf-life estimate.
+    Returns (prepared, errors, llm_used).
+    """
+    prepared = []
+    errors = []
+
+    for idx, raw in enumerate(actions):
+        if not isinstance(raw, dict):
+            errors.append({"index": idx, "error": "each action must be an object"})
+            continue
+        action = ACTION_ALIASES.get(str(raw.get("action", "")).strip().lower())
+        name = raw.get("name") or raw.get("item_id")
+        qty = raw.get("quantity")
+
+        if not action or not name or qty is None:
+            errors.append({"index": idx, "error": "action, name and quantity are required"})
+            continue
+        try:
+            qty = parse_quantity(qty)
+        except ValueError as e:
+            errors.append({"index": idx, "error": str(e)})
+            continue
+
+        item = {
+            "normalized_name": normalize_name(name),
+            "quantity": qty,
+            "unit": raw.get("unit") or raw.get("quantity_unit") or "pcs",
+        }
+        for key in ("category", "auto_buy"):
+            if raw.get(key) is not None:
+                item[key] = raw[key]
+        if raw.get("estimated_shelf_life_days") is not None:
+            try:
+                item["estimated_shelf_life_days"] = parse_shelf_life_days(raw["estimated_shelf_life_days"])
+            except ValueError as e:
+                errors.append({"index": idx, "error": str(e)})
+                continue
+        if raw.get("expiration_date"):
+            item["user_specified_date"] = raw["expiration_date"]
+
+        prepared.append((idx, action, item))
+
+    # names added earlier in the same batch count as known for later consumes
+    known_names = set(get_product_names())
+    known_names.update(it["normalized_name"] for _, a, it in prepared if a == "add")
+    for _, _, item in prepared:
+        item["normalized_name"] = match_known_name(item["normalized_name"], known_names)
+
+    pending = [p for p in prepared if _needs_enrichment(p[1], p[2], known_names)]
+
+    llm_used = False
+    if pending:
+        llm_used = True
+        enriched = query_llm_enrich(
+            [{"action": a, **{k: v for k, v in it.items() if k != "quantity"}} for _, a, it in pending],
+            sorted(known_names),
+        )
+        if enriched is None:
+            log.warning("enrichment failed, falling back to raw names and defaults")
+        else:
+            for (_, _, item), extra in zip(pending, enriched):
+                if extra.get("normalized_name"):
+                    item["normalized_name"] = normalize_name(extra["normalized_name"])
+                for key in ("category", "auto_buy"):
+                    if item.get(key) is None and extra.get(key) is not None:
+                        item[key] = extra[key]
+                if item.get("estimated_shelf_life_days") is None and extra.get("estimated_shelf_life_days") is not None:
+                    try:
+                        item["estimated_shelf_life_days"] = parse_shelf_life_days(extra["estimated_shelf_life_days"])
+                    except ValueError:
+                        log.warning("bad shelf life estimate", name=item["normalized_name"],
+                                    value=extra["estimated_shelf_life_days"])
+
+    return prepared, errors, llm_used
+
+
 # ---------------------------------------------------
 # -------------- API ROUTES -------------------------
 # ---------------------------------------------------
 
+INVENTORY_FILTERS = ("category", "name", "expiring_before", "auto_buy", "fields", "limit", "cursor")
+MAX_PAGE_SIZE = 500
+
+
+def _inventory_etag(version):
+    # filtered views are different representations of the same version
+    if request.query_string:
+        return f"inv-{version}-{zlib.crc32(request.query_string):08x}"
+    return f"inv-{version}"
+
+
+def _encode_cursor(after):
+    return base64.urlsafe_b64encode(json.dumps(after).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    category, product_name, lot_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return category, product_name, int(lot_id)
+
+
+def _parse_inventory_filters(args):
+    """Query string -> query_inventory kwargs; raises ValueError with a message for the client."""
+    filters = {}
+    if args.get("category"):
+        filters["category"] = args["category"].strip()
+    if args.get("name"):
+        filters["name_prefix"] = normalize_name(args["name"])
+    if args.get("expiring_before"):
+        filters["expiring_before"] = datetime.strptime(args["expiring_before"], "%Y-%m-%d").strftime("%Y-%m-%d")
+    if args.get("auto_buy"):
+        value = args["auto_buy"].lower()
+        if value not in ("1", "0", "true", "false"):
+            raise ValueError("'auto_buy' must be true or false")
+        filters["auto_buy"] = value in ("1", "true")
+    return filters
+
+
 @app.route('/inventory', methods=['GET'])
 def get_inventory():
-    cyan("\n📦 GET /inventory called")
+    """
+    In-stock lots. Without parameters: the full snapshot. Optional filters:
+      category, name (prefix), expiring_before=YYYY-MM-DD, auto_buy=true|false,
+      fields=product_name,quantity,...  (projection)
+      limit=N & cursor=<next_cursor>    (keyset pages on category, product_name, id)
+    Honors If-None-Match with the data version as ETag (304 when unchanged).
+    """
     try:
-        inv = get_all_inventory()
-        green(f"Returned {len(inv)} inventory items")
-        return jsonify({"status": "success", "inventory": inv})
+        # read before the rows: at worst the rows are newer than the tag, and the
+        # client refetches (or re-receives those lots from /inventory/changes) next time
+        version = get_inventory_version()
+        if request.if_none_match.contains(_inventory_etag(version)):
+            response = make_response("", 304)
+            response.set_etag(_inventory_etag(version))
+            return response
+
+        body = {"status": "success", "version": version}
+        if any(k in request.args for k in INVENTORY_FILTERS):
+            try:
+                filters = _parse_inventory_filters(request.args)
+                fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+                unknown = sorted(set(fields) - set(LOT_FIELDS))
+                if unknown:
+                    raise ValueError(f"unknown fields: {', '.join(unknown)}")
+                limit = request.args.get("limit", type=int)
+                if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+                    raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+                after = _decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+            except (ValueError, TypeError) as e:
+                return jsonify({"error": f"bad query: {e}"}), 400
+            if after is not None and limit is None:
+                limit = MAX_PAGE_SIZE
+            with tracing.span("db query_inventory", kind="db", **filters):
+                inv, next_after = query_inventory(fields=fields or None, limit=limit, after=after, **filters)
+            body["next_cursor"] = _encode_cursor(next_after) if next_after else None
+        else:
+            with tracing.span("db get_all_inventory", kind="db"):
+                inv = get_all_inventory()
+        body["inventory"] = inv
+        log.debug("inventory listed", items=len(inv), version=version)
+        response = jsonify(body)
+        response.set_etag(_inventory_etag(version))
+        return response
     except Exception as e:
-        red(f"❌ Failed to fetch inventory: {e}")
+        log.error("inventory list failed", error=str(e))
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/inventory/products', methods=['GET'])
+def inventory_products():
+    """One row per product with its lots summed; same filters as GET /inventory (no paging)."""
+    try:
+        filters = _parse_inventory_filters(request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"bad query: {e}"}), 400
+    return jsonify({"status": "success", "products": get_product_totals(**filters)})
+
+
+@app.route('/inventory/changes', methods=['GET'])
+def inventory_changes():
+    """
+    Lots written after ?since=<version> (quantity 0 = removed), plus the
+    current version to pass next time. since=0 or an unknown version
+    returns a full snapshot with "full": true.
+    """
+    since = request.args.get("since", 0, type=int)
+    changes = get_inventory_changes(since)
+    return jsonify({"status": "success", **changes})
+
+
+@app.route('/inventory/alerts', methods=['GET'])
+def alerts():
+    """Low-stock products and lots expiring within INVENTORY_EXPIRY_DAYS (cached, updated on every write)."""
+    return jsonify({"status": "success", "alerts": get_alerts()})
+
+
+@app.route('/inventory/consumption', methods=['GET'])
+def consumption():
+    """Usage per product over the last ?days= days (default 7), optionally for one ?product=."""
+    try:
+        days = int(request.args.get("days", 7))
+    except ValueError:
+        return jsonify({"error": "'days' must be an integer"}), 400
+    if days < 1:
+        return jsonify({"error": "'days' must be at least 1"}), 400
+    product = request.args.get("product")
+    usage = get_consumption(normalize_name(product) if product else None, days)
+    return jsonify({"status": "success", "days": days, "consumption": usage})
+
+
+@app.route('/inventory/movements/<name>', methods=['GET'])
+def movements(name):
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    return jsonify({"status": "success", "movements": get_movements(normalize_name(name), limit)})
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({"service": "inventory", "status": "ok", "db": get_manager(inventory_functions.DB_PATH).stats()})
+
+
 
 @app.route('/inventory/message', methods=['POST'])
 def handle_message():
-    cyan("\n------------------------------------------------------")
-    cyan("📥 POST /inventory/message")
-    cyan("------------------------------------------------------")
-
     data = request.json
     user_message = data.get("message", "")
 
-    yellow(f"User message received: '{user_message}'")
+    log.info("message received", message=user_message)
 
     parsed = query_llm(user_message)
     if not parsed:
-        red("❌ Could not parse LLM output")
+        log.error("could not parse llm output")
         return jsonify({"error": "Parsing failed"}), 500
 
     action = parsed.get("action")
     items = parsed.get("items", [])
 
-    green(f"\n📝 ACTION = {action}")
-    green(f"📝 ITEMS  = {items}")
+    log.info("message parsed", action=action, items=len(items))
 
     logs = []
 
     # ---------------------------------------------------
-    # PROCESS EACH ITEM
+    # PROCESS ALL ITEMS (one transaction)
     # ---------------------------------------------------
-    for item in items:
-        name = item["normalized_name"]
-        qty = float(item["quantity"])
-        unit = item.get("unit", "pcs")
-
-        cyan(f"\n🔹 Processing item:")
-        print(f"      Name      = {name}")
-        print(f"      Quantity  = {qty} {unit}")
-        print(f"      Raw item  = {item}")
-
-        if action == "add":
-            category = item.get("category", "general")
-            auto_buy = 1 if item.get("auto_buy") else 0
-
-            # Expiration date
-            if item.get("user_specified_date"):
-                expiry = item["user_specified_date"]
-                yellow(f"📅 Using user-specified date: {expiry}")
-            else:
-                days = item.get("estimated_shelf_life_days", 7)
-                expiry = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
-                yellow(f"📅 Using estimated shelf life: {expiry}")
-
-            cyan("➕ ADDING PRODUCT TO DB:")
-            print(f"       - name={name}")
-            print(f"       - category={category}")
-            print(f"       - qty={qty}")
-            print(f"       - unit={unit}")
-            print(f"       - expiry={expiry}")
-            print(f"       - auto_buy={auto_buy}")
-
-            result = add_product(name, category, qty, unit, expiry, auto_buy)
-            green(f"   ✔ DB Result: {result}")
+    for result in apply_items([(action, item) for item in items]):
+        if result:
             logs.append(result)
 
-        elif action == "consume":
-            cyan("➖ CONSUMING PRODUCT FROM DB:")
-            print(f"       - name={name}")
-            print(f"       - qty={qty}")
+    final = build_final_response(logs)
+    final["processed_data"] = parsed
 
-            result = consume_product(name, qty)
-            green(f"   ✔ DB Result: {result}")
-            logs.append(result)
+    log.debug("final response", response=final)
 
+    return jsonify(final)
 
 
-    # ---------------------------------------------------
-    # CHECK ALERTS
-    # ---------------------------------------------------
-    cyan("\n🔔 Checking low-stock alerts...")
-    alerts = get_alerts()
-    yellow(f"Alerts: {alerts}")
+# errors a retry of the same batch would hit again
+NON_RETRYABLE_ERRORS = (ValueError, OverflowError, TypeError, KeyError, sqlite3.IntegrityError)
 
 
-    # ---------------------------------------------------
-    # Assemble Response
-    # ---------------------------------------------------
-    response_text = "; ".join(logs)
+def batch_error_status(error):
+    return "rejected" if isinstance(error, NON_RETRYABLE_ERRORS) else "failed"
 
-    if alerts["restock_needed"]:
-        response_text += "\n🛒 Auto-buy triggered for: " + ", ".join(alerts["restock_needed"])
-        yellow("AUTO BUY NEEDED!")
 
-    final = {
-        "agent": "Inventory",
-        "processed_data": parsed,
-        "response_text": response_text,
-        "alerts": alerts
+@app.route('/inventory/actions', methods=['POST'])
+def handle_actions():
+    """
+    Structured batch endpoint used by the orchestrator. Skips the free-text
+    LLM parse of /inventory/message.
+
+    Body:
+    {
+      "actions": [
+        {"action": "add", "name": "tomato", "quantity": 10, "unit": "kg",
+         "category": "vegetable", "estimated_shelf_life_days": 7,
+         "expiration_date": "YYYY-MM-DD", "auto_buy": false},   # last four optional
+        {"action": "consume", "name": "milk", "quantity": 2, "unit": "l"}
+      ]
     }
+    An optional Idempotency-Key header makes retries of the same body a no-op.
+
+    The orchestrator outbox sends several commands at once instead:
+    {"batches": [{"idempotency_key": "...", "actions": [...]}, ...]}
+    Each batch is applied in its own transaction and gets its own entry in
+    "batches": {"idempotency_key", "status", "results", "errors"} with status
+      applied    - committed (items with errors, listed in "errors", were skipped)
+      duplicate  - the key was already applied, nothing done
+      rejected   - malformed batch, or an error that would happen again
+                   (validation / integrity), rolled back (no retry)
+      failed     - transient error while applying (e.g. database is locked),
+                   rolled back (retry)
+    so one bad batch does not hold back the others.
+    """
+    data = request.get_json(silent=True) or {}
+    if "batches" in data:
+        batches = data.get("batches")
+        if not isinstance(batches, list) or not all(isinstance(b, dict) for b in batches):
+            log.warning("bad request", error="'batches' must be a list of objects")
+            return jsonify({"error": "'batches' must be a list of objects"}), 400
+    else:
+        actions = data.get("actions")
+        if not isinstance(actions, list) or not actions:
+            log.warning("bad request", error="missing or empty 'actions' list")
+            return jsonify({"error": "'actions' must be a non-empty list"}), 400
+        batches = [{"idempotency_key": request.headers.get("Idempotency-Key"), "actions": actions}]
+
+    # all batches are prepared together (at most one enrichment LLM call),
+    # then applied one transaction per batch
+    outcomes = []
+    flat, owners = [], []  # owners[i] = (batch number, index inside the batch)
+    for n, batch in enumerate(batches):
+        key = batch.get("idempotency_key")
+        outcome = {"idempotency_key": key, "status": None, "results": [], "errors": []}
+        actions = batch.get("actions")
+        if not isinstance(actions, list) or not actions:
+            outcome.update(status="rejected", error="'actions' must be a non-empty list")
+        else:
+            for i, raw in enumerate(actions):
+                flat.append(raw)
+                owners.append((n, i))
+        outcomes.append(outcome)
+
+    log.info("structured actions received", actions=len(flat), batches=len(batches))
 
-    green("\n📤 FINAL RESPONSE TO ORCHESTRATOR:")
-    print(json.dumps(final, indent=4))
+    try:
+        prepared, errors, llm_used = prepare_structured_actions(flat)
+    except Exception:
+        # something in one batch breaks the shared pass: redo it batch by batch,
+        # so only the batch that causes it fails
+        log.exception("batch preparation failed, preparing batches one by one")
+        prepared, errors, llm_used = [], [], False
+        for n, outcome in enumerate(outcomes):
+            if outcome["status"] is not None:
+                continue
+            idxs = [j for j, (m, _) in enumerate(owners) if m == n]
+            try:
+                own, own_errors, used = prepare_structured_actions([flat[j] for j in idxs])
+            except Exception as e:
+                log.exception("batch preparation failed", idempotency_key=outcome["idempotency_key"])
+                outcome.update(status=batch_error_status(e), error=str(e))
+                continue
+            llm_used |= used
+            prepared += [(idxs[k], action, item) for k, action, item in own]
+            errors += [{**err, "index": idxs[err["index"]]} for err in own_errors]
+
+    per_batch = [[] for _ in batches]
+    for idx, action, item in prepared:
+        n, i = owners[idx]
+        per_batch[n].append((i, action, item))
+    for err in errors:
+        n, i = owners[err["index"]]
+        outcomes[n]["errors"].append({**err, "index": i})
 
+    logs = []
+    for n, outcome in enumerate(outcomes):
+        if outcome["status"] is not None:
+            continue
+        key = outcome["idempotency_key"]
+        try:
+            applied = apply_items([(action, item) for _, action, item in per_batch[n]], [key] if key else [])
+        except Exception as e:
+            log.exception("batch failed", idempotency_key=key)
+            outcome.update(status=batch_error_status(e), error=str(e))
+            continue
+        if applied is None:
+            # claimed by an earlier delivery, checked inside the write transaction
+            outcome["status"] = "duplicate"
+            continue
+        outcome["status"] = "applied"
+        for (i, action, item), result in zip(per_batch[n], applied):
+            if result:
+                logs.append(result)
+            outcome["results"].append({"index": i, "action": action, "name": item["normalized_name"],
+                                       "result": result})
+
+    final = build_final_response(logs)
+    final["results"] = [r for o in outcomes for r in o["results"]]
+    final["errors"] = [e for o in outcomes for e in o["errors"]]
+    final["llm_used"] = llm_used
+    duplicates = [o["idempotency_key"] for o in outcomes if o["status"] == "duplicate"]
+    if duplicates:
+        log.info("skipped already processed batches", batches=len(duplicates))
+    final["duplicates"] = sorted(duplicates)
+    final["batches"] = outcomes
+
+    log.info("actions applied", applied=len(final["results"]), errors=len(final["errors"]), llm_used=llm_used,
+             failed=sum(o["status"] == "failed" for o in outcomes))
+    log.debug("final response", response=final)
+
+    if "batches" not in data and outcomes[0]["status"] in ("failed", "rejected"):
+        final["error"] = outcomes[0]["error"]
+        return jsonify(final), 500 if outcomes[0]["status"] == "failed" else 400
     return jsonify(final)
 
 
@@ -218,5 +697,5 @@ def handle_message():
 
 if __name__ == '__main__':
     init_db()
-    cyan("🍅 Inventory Agent running on port 5002")
+    log.info("inventory agent running", port=5002)
     app.run(port=5002, debug=True)
@@ -1,15 +1,18 @@
 # ai_wrapper.py
 import os
-import requests
 
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-DEFAULT_MODEL = "openai/gpt-4.1-mini"
+from llm_gateway import complete, complete_stream, DEFAULT_MODEL
+from llm_cache import make_key, cache_get, cache_set
+from log import get_logger
+
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 256
 
 # Read env var once at import
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+log = get_logger("ai_wrapper")
+
 
 def generate_reply(
     system_prompt: str,
@@ -17,41 +20,76 @@ def generate_reply(
     model: str = DEFAULT_MODEL,
     temperature: float = DEFAULT_TEMPERATURE,
     max_tokens: int = DEFAULT_MAX_TOKENS,
+    cache_ttl: float | None = None,
 ):
+    """
+    cache_ttl (seconds) opts this call into llm_cache; identical
+    (model, prompts, temperature, max_tokens) calls within the TTL are
+    answered from the cache without hitting OpenRouter.
+    """
     if not OPENAI_API_KEY:
         raise RuntimeError(
             "OPENAI_API_KEY not set or empty. "
         )
 
-    # DEBUG: show that we have a key and model
-    print("[DEBUG] Using model:", model)
-    print("[DEBUG] OPENAI_API_KEY starts with:", OPENAI_API_KEY[:10])
-
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-        # Optional:
-        "HTTP-Referer": "http://localhost",
-        "X-Title": "Simple Test Script",
-    }
-
-    payload = {
-        "model": model,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-    }
-
-    resp = requests.post(OPENROUTER_URL, json=payload, headers=headers, timeout=60)
-
-    # Extra debug if not 2xx
-    if not resp.ok:
-        print("[DEBUG] Status code:", resp.status_code)
-        print("[DEBUG] Response body:", resp.text)
-        resp.raise_for_status()
-
-    data = resp.json()
-    return data["choices"][0]["message"]["content"]
\ No newline at end of file
+    cache_key = make_key(model, system_prompt, user_prompt, temperature, max_tokens=max_tokens)
+    cached = cache_get(cache_key, cache_ttl)
+    if cached is not None:
+        log.debug("llm cache hit", model=model)
+        return cached
+
+    log.debug("llm request", model=model, max_tokens=max_tokens)
+
+    # Pooled session, timeouts and retries live in llm_gateway
+    reply = complete(
+        system_prompt,
+        user_prompt,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        title="Simple Test Script",
+    )
+    cache_set(cache_key, reply, cache_ttl)
+    return reply
+
+
+
+def generate_reply_stream(
+    system_prompt: str,
+    user_prompt: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    cache_ttl: float | None = None,
+):
+    """
+    Streaming variant of generate_reply: yields text chunks as the model
+    produces them. A cache hit is yielded as a single chunk.
+    """
+    if not OPENAI_API_KEY:
+        raise RuntimeError(
+            "OPENAI_API_KEY not set or empty. "
+        )
+
+    cache_key = make_key(model, system_prompt, user_prompt, temperature, max_tokens=max_tokens)
+    cached = cache_get(cache_key, cache_ttl)
+    if cached is not None:
+        log.debug("llm cache hit", model=model)
+        yield cached
+        return
+
+    log.debug("llm stream request", model=model, max_tokens=max_tokens)
+
+    chunks = []
+    for chunk in complete_stream(
+        system_prompt,
+        user_prompt,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        title="Simple Test Script",
+    ):
+        chunks.append(chunk)
+        yield chunk
+
+    cache_set(cache_key, "".join(chunks), cache_ttl)
@@ -1,11 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from pydantic import BaseModel
 from typing import Optional
 
 # Import your finance agent
 from agents.finance_agent import auto_check_and_advise, handle_finance_message
+from db.finance_db import init_db
+import metrics
+import tracing
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # creates / migrates finance.db (unique days, indexes) before the first request
+    init_db()
+    yield
+
 
-app = FastAPI(title="BizzGenie Backend")
+app = FastAPI(title="BizzGenie Backend", lifespan=lifespan)
+tracing.instrument_fastapi(app, "finance")
+metrics.instrument_fastapi(app, "finance")
 
 # ---------- Request/response models ----------
 
@@ -1,29 +1,292 @@
 import requests
 import os
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+import tracing
+from log import get_logger
+
+log = get_logger("comms")
 
 # DEFINING THE PORTS CLEARLY
 SERVICE_URLS = {
     "orchestrator": "http://127.0.0.1:5001",
     "legal": "http://127.0.0.1:5006",
     "predictor": "http://127.0.0.1:5003",
-    "financial": "http://127.0.0.1:5004",
+    "finance": "http://127.0.0.1:5004",
     "frontend": "http://127.0.0.1:5005",
     "inventory": "http://127.0.0.1:5002",
 }
 
-def send_json_to_service(service_name: str, path: str, payload: dict, timeout: int = 30):
-    base = SERVICE_URLS.get(service_name)
-    if not base:
-        print(f"🔴 Service {service_name} not defined in SERVICE_URLS")
-        return {"error": f"Unknown service '{service_name}'"}
+# older callers use "financial"; the orchestrator plan uses "finance"
+SERVICE_ALIASES = {
+    "financial": "finance",
+}
+
+# --- inter-service client tuning ---
+CONNECT_TIMEOUT = float(os.getenv("COMMS_CONNECT_TIMEOUT", "2"))
+POOL_SIZE = int(os.getenv("COMMS_POOL_SIZE", "10"))
+FAILURE_THRESHOLD = int(os.getenv("COMMS_FAILURE_THRESHOLD", "3"))   # consecutive failures -> open
+RESET_TIMEOUT = float(os.getenv("COMMS_RESET_TIMEOUT", "10"))        # seconds open before a trial call
+HEALTH_INTERVAL = float(os.getenv("COMMS_HEALTH_INTERVAL", "5"))     # 0 disables the probe thread
+HEALTH_TIMEOUT = 1.0
+LATENCY_WINDOW = 200
+MAX_RETRY_AFTER = float(os.getenv("COMMS_MAX_RETRY_AFTER", "300"))   # cap on a service's Retry-After
 
-    url = base + path
-    print(f"📡 Sending to {service_name} [{url}] Payload keys: {list(payload.keys())}")
 
+class CircuitOpen(Exception):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+class Busy(CircuitOpen):
+    """The service answered 503 + Retry-After (queue full); nothing was done, try again after retry_after seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str, default: float = RESET_TIMEOUT) -> float:
+    """Retry-After is either delay-seconds or an HTTP date; clamped to [0, MAX_RETRY_AFTER]."""
     try:
-        resp = requests.post(url, json=payload, timeout=timeout)
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return default
+    if seconds != seconds:      # NaN
+        return default
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def resolve_service(service_name: str) -> str:
+    return SERVICE_ALIASES.get(service_name, service_name)
+
+
+class ServiceClient:
+    """
+    One per target service:
+    - a keep-alive requests.Session (pooled connections)
+    - short connect timeout, per-call read timeout
+    - circuit breaker: after FAILURE_THRESHOLD consecutive failures (or a
+      failed /health probe) calls fail fast with CircuitOpen; after
+      RESET_TIMEOUT one trial call is let through (half-open) and its
+      outcome closes or re-opens the circuit
+    - backpressure: a 503 with Retry-After (e.g. legal's full research queue)
+      is not a breaker failure; calls fail fast with Busy until the delay passes
+    - latency / error counters for stats()
+    """
+
+    def __init__(self, name: str, base_url: str,
+                 failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self.state = "closed"           # closed | open | half_open
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.healthy = None             # last /health probe result (None = not probed yet)
+        self._trial_in_flight = False
+        self.busy_until = 0.0           # monotonic deadline from the last Retry-After
+
+        self.counters = {"calls": 0, "errors": 0, "rejected": 0, "busy": 0}
+        self.last_error = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    # ---------- circuit breaker ----------
+
+    def _before_call(self) -> None:
+        with self._lock:
+            wait = self.busy_until - time.monotonic()
+            if wait > 0:
+                self.counters["busy"] += 1
+                raise Busy(f"{self.name} is busy, retry in {wait:.1f}s", wait)
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.counters["rejected"] += 1
+                    raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    self.counters["rejected"] += 1
+                    raise CircuitOpen(f"{self.name} is unavailable (trial call in flight)")
+                self._trial_in_flight = True
+            self.counters["calls"] += 1
+
+    def _record(self, ok: bool, elapsed: float, error: Exception = None) -> None:
+        with self._lock:
+            self._trial_in_flight = False
+            self._latencies.append(elapsed)
+            if ok:
+                if self.state != "closed":
+                    log.info("service is back, closing circuit", service=self.name)
+                self.state = "closed"
+                self.consecutive_failures = 0
+                return
+            self.counters["errors"] += 1
+            self.last_error = str(error)
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self) -> None:
+        # caller holds self._lock
+        if self.state != "open":
+            log.warning("opening circuit", service=self.name, seconds=self.reset_timeout, error=self.last_error)
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    # ---------- calls ----------
+
+    def request(self, method: str, path: str, timeout: float = 30, **kwargs) -> requests.Response:
+        """Raises CircuitOpen, Busy (503 + Retry-After), requests exceptions, or HTTPError for 5xx."""
+        self._before_call()
+        with tracing.span(f"{method} {self.name}{path}", kind="http") as sp:
+            kwargs["headers"] = tracing.inject_headers(kwargs.get("headers"))
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(method, self.base_url + path,
+                                            timeout=(CONNECT_TIMEOUT, timeout), **kwargs)
+            except Exception as e:
+                self._record(False, time.perf_counter() - start, e)
+                raise
+            sp.set(status_code=resp.status_code)
+
+            # 503 + Retry-After is the service shedding load, not failing: it answered,
+            # so the breaker sees a success, and callers hold off for the given delay
+            if resp.status_code == 503 and "Retry-After" in resp.headers:
+                delay = parse_retry_after(resp.headers["Retry-After"], self.reset_timeout)
+                self._record(True, time.perf_counter() - start)
+                with self._lock:
+                    self.busy_until = max(self.busy_until, time.monotonic() + delay)
+                    self.counters["busy"] += 1
+                log.info("service busy, backing off", service=self.name, seconds=round(delay, 2))
+                raise Busy(f"{self.name} is busy (503), retry in {delay:.1f}s", delay)
+
+            # 4xx means the service is up and answered; only 5xx counts against the breaker
+            if resp.status_code >= 500:
+                error = requests.HTTPError(f"{resp.status_code} Server Error for {resp.url}", response=resp)
+                self._record(False, time.perf_counter() - start, error)
+                raise error
+            self._record(True, time.perf_counter() - start)
+            return resp
+
+    def post(self, path: str, payload: dict, timeout: float = 30, headers: dict = None):
+        resp = self.request("POST", path, timeout=timeout, json=payload, headers=headers)
         resp.raise_for_status()
         return resp.json()
+
+    def get(self, path: str, timeout: float = 30, params: dict = None):
+        resp = self.request("GET", path, timeout=timeout, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    def probe(self) -> bool:
+        """GET /health; a failed probe opens the circuit, a good one allows a trial call."""
+        error = None
+        try:
+            resp = self.session.get(self.base_url + "/health", timeout=(CONNECT_TIMEOUT, HEALTH_TIMEOUT))
+            ok = resp.status_code < 500
+        except requests.RequestException as e:
+            ok = False
+            error = f"health probe: {e}"
+
+        with self._lock:
+            self.healthy = ok
+            if error:
+                self.last_error = error
+            if not ok:
+                self._open()
+            elif self.state == "open":
+                # skip the rest of the reset timeout
+                self.state = "half_open"
+        return ok
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            out = dict(self.counters)
+            out.update({
+                "state": self.state,
+                "healthy": self.healthy,
+                "last_error": self.last_error,
+            })
+        if latencies:
+            out["latency_ms_avg"] = round(1000 * sum(latencies) / len(latencies), 1)
+            out["latency_ms_p95"] = round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1)
+        return out
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_probe_thread = None
+
+
+def get_client(service_name: str) -> ServiceClient:
+    name = resolve_service(service_name)
+    client = _clients.get(name)
+    if client is not None:
+        return client
+
+    base = SERVICE_URLS.get(name)
+    if not base:
+        raise ValueError(f"Unknown service '{service_name}'")
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = ServiceClient(name, base)
+        _start_health_probe()
+    return client
+
+
+def _start_health_probe():
+    # caller holds _clients_lock; probes only services this process talks to
+    global _probe_thread
+    if _probe_thread is not None or HEALTH_INTERVAL <= 0:
+        return
+
+    def _loop():
+        while True:
+            time.sleep(HEALTH_INTERVAL)
+            for client in list(_clients.values()):
+                client.probe()
+
+    _probe_thread = threading.Thread(target=_loop, name="comms-health", daemon=True)
+    _probe_thread.start()
+
+
+def service_stats() -> dict:
+    return {name: client.stats() for name, client in list(_clients.items())}
+
+
+def post_json(service_name: str, path: str, payload: dict, timeout: int = 30, headers: dict = None):
+    """
+    Like send_json_to_service, but raises on unknown services, open circuits,
+    network errors and non-2xx responses (used by callers that retry, e.g. the outbox).
+    """
+    client = get_client(service_name)
+    log.debug("sending", service=client.name, url=client.base_url + path, payload_keys=list(payload.keys()))
+    return client.post(path, payload, timeout=timeout, headers=headers)
+
+def send_json_to_service(service_name: str, path: str, payload: dict, timeout: int = 30):
+    if resolve_service(service_name) not in SERVICE_URLS:
+        log.error("service not defined in SERVICE_URLS", service=service_name)
+        return {"error": f"Unknown service '{service_name}'"}
+
+    try:
+        return post_json(service_name, path, payload, timeout=timeout)
     except Exception as e:
-        print(f"🔴 Error contacting {service_name}: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        log.error("error contacting service", service=service_name, error=str(e))
+        return {"error": str(e)}
@@ -2,8 +2,14 @@
 import os
 import sqlite3
 import datetime
-from typing import Dict, Any, Iterable
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, Iterator, Optional
 from pathlib import Path
+from log import get_logger
+from metrics import timed_query
+
+log = get_logger("finance_db")
 
 # DB_PATH = os.getenv("FINANCE_DB_PATH", "finance.db")
 # Put the DB file next to this module by default
@@ -20,15 +26,12 @@ def get_connection() -> sqlite3.Connection:
     return conn
 
 
-def init_db() -> None:
-    """
-    Create tables if they don't exist.
-    Call this once at finance service startup.
-    """
-    conn = get_connection()
-    cur = conn.cursor()
+# ---------- SCHEMA (versioned migrations) ----------
+# The schema version lives in PRAGMA user_version; each migration runs in its own
+# transaction together with the version bump. Append new steps, never edit applied ones.
 
-    # One row per day (can also aggregate multiple docs per day if you want)
+def _create_base_tables(cur: sqlite3.Cursor) -> None:
+    # One row per day
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS daily_financials (
@@ -56,12 +59,265 @@ def init_db() -> None:
         """
     )
 
-    conn.commit()
-    conn.close()
+
+def _unique_daily(cur: sqlite3.Cursor) -> None:
+    # Readers used to SUM duplicate days together, so merging them by summing keeps every report the same
+    cur.execute(
+        """
+        UPDATE daily_financials SET
+            revenue = (SELECT SUM(d.revenue) FROM daily_financials d WHERE d.date = daily_financials.date),
+            cost    = (SELECT SUM(d.cost)    FROM daily_financials d WHERE d.date = daily_financials.date),
+            profit  = (SELECT SUM(d.profit)  FROM daily_financials d WHERE d.date = daily_financials.date)
+        WHERE id IN (SELECT MIN(id) FROM daily_financials GROUP BY date HAVING COUNT(*) > 1)
+        """
+    )
+    cur.execute("DELETE FROM daily_financials WHERE id NOT IN (SELECT MIN(id) FROM daily_financials GROUP BY date)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_financials_date ON daily_financials(date)")
+
+
+def _unique_product_day(cur: sqlite3.Cursor) -> None:
+    # Same for several purchases of one product on one day: they become one accumulated row
+    cur.execute(
+        """
+        UPDATE product_financials SET
+            revenue = (SELECT SUM(p.revenue) FROM product_financials p
+                       WHERE p.date = product_financials.date AND p.product_id = product_financials.product_id),
+            cost    = (SELECT SUM(p.cost) FROM product_financials p
+                       WHERE p.date = product_financials.date AND p.product_id = product_financials.product_id),
+            profit  = (SELECT SUM(p.profit) FROM product_financials p
+                       WHERE p.date = product_financials.date AND p.product_id = product_financials.product_id)
+        WHERE id IN (SELECT MIN(id) FROM product_financials GROUP BY date, product_id HAVING COUNT(*) > 1)
+        """
+    )
+    cur.execute(
+        "DELETE FROM product_financials WHERE id NOT IN "
+        "(SELECT MIN(id) FROM product_financials GROUP BY date, product_id)"
+    )
+    # Date-range scans of the insight detectors, and the upsert key
+    cur.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_product_financials_date_product "
+        "ON product_financials(date, product_id)"
+    )
+
+
+def _rollup_tables(cur: sqlite3.Cursor) -> None:
+    # Pre-aggregated buckets (period = 'week' starting Monday, or 'month'), kept in step by the
+    # write helpers below; finance_functions reads whole buckets from here instead of raw rows
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS product_rollup (
+            period        TEXT NOT NULL,    -- 'week' | 'month'
+            bucket_start  TEXT NOT NULL,    -- 'YYYY-MM-DD' (Monday / 1st of month)
+            product_id    TEXT NOT NULL,
+            product_name  TEXT NOT NULL,
+            revenue       REAL NOT NULL,
+            cost          REAL NOT NULL,
+            profit        REAL NOT NULL,
+            PRIMARY KEY (period, bucket_start, product_id)
+        ) WITHOUT ROWID;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            period        TEXT NOT NULL,
+            bucket_start  TEXT NOT NULL,
+            revenue       REAL NOT NULL,
+            cost          REAL NOT NULL,
+            profit        REAL NOT NULL,
+            days          INTEGER NOT NULL, -- daily_financials rows in the bucket
+            PRIMARY KEY (period, bucket_start)
+        ) WITHOUT ROWID;
+        """
+    )
+    # Backfill from existing rows ('weekday 1' moves forward to Monday, so -6 days first)
+    for period, bucket in (("week", "date(date, '-6 days', 'weekday 1')"), ("month", "date(date, 'start of month')")):
+        cur.execute(
+            f"""
+            INSERT OR REPLACE INTO product_rollup
+            SELECT '{period}', {bucket} AS bucket_start, product_id, MAX(product_name),
+                   SUM(revenue), SUM(cost), SUM(profit)
+            FROM product_financials GROUP BY bucket_start, product_id
+            """
+        )
+        cur.execute(
+            f"""
+            INSERT OR REPLACE INTO daily_rollup
+            SELECT '{period}', {bucket} AS bucket_start, SUM(revenue), SUM(cost), SUM(profit), COUNT(*)
+            FROM daily_financials GROUP BY bucket_start
+            """
+        )
+
+
+def _data_version(cur: sqlite3.Cursor) -> None:
+    # bumped by every write transaction; caches of derived results key on it
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id       INTEGER PRIMARY KEY CHECK (id = 1),
+            version  INTEGER NOT NULL
+        );
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+
+MIGRATIONS = [
+    (1, "base tables", _create_base_tables),
+    (2, "one daily_financials row per date", _unique_daily),
+    (3, "one product_financials row per (date, product_id)", _unique_product_day),
+    (4, "weekly / monthly rollups", _rollup_tables),
+    (5, "data version", _data_version),
+]
+
+
+_migrated = set()  # DB files init_db has brought up to date in this process
+_migrate_lock = threading.Lock()
+
+
+def init_db() -> None:
+    """
+    Create / upgrade the schema (MIGRATIONS).
+    Call this once at finance service startup; write_transaction() also runs
+    it before the first write of a process, so the write helpers never see
+    an old schema (e.g. the v0 db/finance.db).
+    """
+    conn = get_connection()
+    conn.isolation_level = None  # explicit transactions below
+    try:
+        for version, description, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                step(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            log.info("migrated", version=version, description=description)
+    finally:
+        conn.close()
+    _migrated.add(str(DB_PATH))
+
+
+def ensure_schema() -> None:
+    """init_db() once per process and database file."""
+    if str(DB_PATH) in _migrated:
+        return
+    with _migrate_lock:
+        if str(DB_PATH) not in _migrated:
+            init_db()
+
+
+# ---------- ROLLUPS ----------
+
+ROLLUP_PERIODS = ("week", "month")
+ROLLUP_VERSION = 4
+
+
+def has_rollups(conn: sqlite3.Connection) -> bool:
+    """False on a database not yet migrated by init_db (readers then use the raw tables)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0] >= ROLLUP_VERSION
+
+
+def bucket_start(date: datetime.date, period: str) -> datetime.date:
+    """First day of the rollup bucket holding `date` (weeks start on Monday)."""
+    if period == "week":
+        return date - datetime.timedelta(days=date.weekday())
+    return date.replace(day=1)
+
+
+_BUMP_PRODUCT_ROLLUP = """
+    INSERT INTO product_rollup (period, bucket_start, product_id, product_name, revenue, cost, profit)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(period, bucket_start, product_id) DO UPDATE SET
+        product_name = excluded.product_name,
+        revenue      = revenue + excluded.revenue,
+        cost         = cost + excluded.cost,
+        profit       = profit + excluded.profit
+"""
+
+_BUMP_DAILY_ROLLUP = """
+    INSERT INTO daily_rollup (period, bucket_start, revenue, cost, profit, days)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(period, bucket_start) DO UPDATE SET
+        revenue = revenue + excluded.revenue,
+        cost    = cost + excluded.cost,
+        profit  = profit + excluded.profit,
+        days    = days + excluded.days
+"""
+
+
+def _bump_product_rollups(conn: sqlite3.Connection, rows: Iterable[tuple]) -> None:
+    """rows: (date, product_id, product_name, revenue, cost, profit) deltas, merged per bucket first."""
+    buckets: Dict[tuple, list] = {}
+    for date, product_id, product_name, revenue, cost, profit in rows:
+        for period in ROLLUP_PERIODS:
+            key = (period, bucket_start(date, period).isoformat(), product_id)
+            acc = buckets.setdefault(key, [product_name, 0.0, 0.0, 0.0])
+            acc[0] = product_name
+            acc[1] += revenue
+            acc[2] += cost
+            acc[3] += profit
+    conn.executemany(_BUMP_PRODUCT_ROLLUP, [(*key, *acc) for key, acc in buckets.items()])
+
+
+def _bump_daily_rollups(conn: sqlite3.Connection, date: datetime.date,
+                        revenue: float, cost: float, profit: float, new_day: bool) -> None:
+    conn.executemany(
+        _BUMP_DAILY_ROLLUP,
+        [(period, bucket_start(date, period).isoformat(), revenue, cost, profit, 1 if new_day else 0)
+         for period in ROLLUP_PERIODS],
+    )
+
+
+@contextmanager
+def write_transaction() -> Iterator[sqlite3.Connection]:
+    """
+    One BEGIN IMMEDIATE transaction: a row and its rollup buckets are
+    written together (and the read of the old row cannot race another writer).
+    Bumps the data version on commit.
+    """
+    ensure_schema()
+    conn = get_connection()
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("UPDATE data_version SET version = version + 1")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def get_data_version() -> Optional[int]:
+    """
+    Counter bumped by every write helper (in any process using this file);
+    None on a database not yet migrated by init_db.
+    """
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return row["version"] if row else None
+
+
+def _old_day(conn: sqlite3.Connection, ds: str):
+    return conn.execute("SELECT revenue, cost, profit FROM daily_financials WHERE date = ?", (ds,)).fetchone()
 
 
 # ---------- WRITE HELPERS (insert / update) ----------
 
+@timed_query("finance")
 def upsert_daily_financial(
     date: datetime.date,
     revenue: float,
@@ -74,35 +330,66 @@ def upsert_daily_financial(
     profit = revenue - cost
     ds = date.isoformat()
 
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Check if exists
-    cur.execute("SELECT id FROM daily_financials WHERE date = ?", (ds,))
-    row = cur.fetchone()
-
-    if row:
-        cur.execute(
+    with write_transaction() as conn:
+        old = _old_day(conn, ds)
+        conn.execute(
             """
-            UPDATE daily_financials
-            SET revenue = ?, cost = ?, profit = ?
-            WHERE date = ?
+            INSERT INTO daily_financials (date, revenue, cost, profit)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET
+                revenue = excluded.revenue, cost = excluded.cost, profit = excluded.profit
             """,
-            (revenue, cost, profit, ds),
+            (ds, revenue, cost, profit),
         )
-    else:
-        cur.execute(
+        if old is None:
+            _bump_daily_rollups(conn, date, revenue, cost, profit, new_day=True)
+        else:
+            _bump_daily_rollups(conn, date, revenue - old["revenue"], cost - old["cost"],
+                                profit - old["profit"], new_day=False)
+
+
+@timed_query("finance")
+def add_to_daily_financial(
+    date: datetime.date,
+    revenue: float = 0.0,
+    cost: float = 0.0,
+) -> Dict[str, float]:
+    """
+    Add revenue / cost to the day's totals in one statement (no read-modify-write
+    race between concurrent purchases). Returns the new day totals.
+    """
+    ds = date.isoformat()
+    with write_transaction() as conn:
+        new_day = _old_day(conn, ds) is None
+        row = conn.execute(
             """
             INSERT INTO daily_financials (date, revenue, cost, profit)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET
+                revenue = revenue + excluded.revenue,
+                cost    = cost + excluded.cost,
+                profit  = profit + excluded.profit
+            RETURNING revenue, cost, profit
             """,
-            (ds, revenue, cost, profit),
-        )
+            (ds, revenue, cost, revenue - cost),
+        ).fetchone()
+        _bump_daily_rollups(conn, date, revenue, cost, revenue - cost, new_day=new_day)
+    return {"revenue": float(row["revenue"]), "cost": float(row["cost"]), "profit": float(row["profit"])}
 
-    conn.commit()
-    conn.close()
 
+_ADD_PRODUCT_ROW = """
+    INSERT INTO product_financials
+        (date, product_id, product_name, revenue, cost, profit)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(date, product_id) DO UPDATE SET
+        product_name = excluded.product_name,
+        revenue      = revenue + excluded.revenue,
+        cost         = cost + excluded.cost,
+        profit       = profit + excluded.profit
+"""
 
+
+@timed_query("finance")
 def add_product_financial(
     date: datetime.date,
     product_id: str,
@@ -111,21 +398,25 @@ def add_product_financial(
     cost: float,
 ) -> None:
     """
-    Insert a new row into product_financials.
-    If you want upsert per (date, product_id) you can adapt it.
+    Add revenue / cost to the product's row for that day
+    (one row per (date, product_id); amounts accumulate).
     """
-    profit = revenue - cost
-    ds = date.isoformat()
+    _add_product_rows([(date, product_id, product_name, revenue, cost)])
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO product_financials
-            (date, product_id, product_name, revenue, cost, profit)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (ds, product_id, product_name, revenue, cost, profit),
-    )
-    conn.commit()
-    conn.close()
+
+@timed_query("finance")
+def import_product_financials(rows: Iterable[tuple]) -> int:
+    """
+    Bulk version of add_product_financial: rows of
+    (date, product_id, product_name, revenue, cost), all applied in one
+    transaction together with their rollups. Returns the number of rows.
+    """
+    return _add_product_rows(rows)
+
+
+def _add_product_rows(rows: Iterable[tuple]) -> int:
+    prepared = [(date, pid, name, revenue, cost, revenue - cost) for date, pid, name, revenue, cost in rows]
+    with write_transaction() as conn:
+        conn.executemany(_ADD_PRODUCT_ROW, [(d.isoformat(), *rest) for d, *rest in prepared])
+        _bump_product_rollups(conn, prepared)
+    return len(prepared)
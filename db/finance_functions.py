@@ -7,14 +7,79 @@ that finance_insights.py expects:
 - get_daily_profit
 - get_profit_by_product
 - get_profit_by_product_delta
+plus iter_profit_by_product_delta (all products, streamed),
+get_period_totals and get_product_profit_series (columns for the trend engine).
+
+Product aggregates read whole weeks / months from the rollup tables kept by
+finance_db and only the leftover days from product_financials, so a
+90-day comparison touches ~15 rollup rows per product instead of 90.
 """
 
 import datetime
-from typing import List, Dict
+from typing import Dict, Iterator, List, Tuple
+
+from db.finance_db import bucket_start, get_connection, has_rollups
+from metrics import timed_query
+
+
+# ---------- range -> rollup buckets ----------
+
+def _month_end(day: datetime.date) -> datetime.date:
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+
+
+def _segments(start: datetime.date, end: datetime.date,
+              rollups: bool = True) -> List[Tuple[str, datetime.date, datetime.date]]:
+    """
+    Splits [start, end] into (kind, first, last) runs: 'month' / 'week' runs
+    give the bucket_start range of whole buckets inside the range, 'day'
+    runs the leftover dates. Greedy: a whole month, else a whole week that
+    does not straddle a whole month coming up, else a day.
+    """
+    if not rollups:
+        return [("day", start, end)] if start <= end else []
+    out: List[List] = []
+    day = start
+    while day <= end:
+        month_end = _month_end(day)
+        next_month = month_end + datetime.timedelta(days=1)
+        next_month_fits = _month_end(next_month) <= end
+        week_end = day + datetime.timedelta(days=6)
+        if day == bucket_start(day, "month") and month_end <= end:
+            kind, last = "month", month_end
+        elif (day == bucket_start(day, "week") and week_end <= end
+              and (week_end < next_month or not next_month_fits)):
+            kind, last = "week", week_end
+        else:
+            kind, last = "day", day
+        if out and out[-1][0] == kind:
+            out[-1][2] = day if kind != "day" else last  # months / weeks: range of bucket starts
+        else:
+            out.append([kind, day, day])
+        day = last + datetime.timedelta(days=1)
+    return [tuple(seg) for seg in out]
 
-from db.finance_db import get_connection
 
+def _product_source(conn, start: datetime.date, end: datetime.date, tag: int = 0) -> Tuple[str, List]:
+    """UNION ALL of rollup buckets and raw days covering [start, end]; rows carry `tag` as p."""
+    parts, params = [], []
+    for kind, first, last in _segments(start, end, has_rollups(conn)):
+        if kind == "day":
+            parts.append(
+                f"SELECT {tag} AS p, product_id, product_name, revenue, cost, profit "
+                "FROM product_financials WHERE date BETWEEN ? AND ?"
+            )
+            params += [first.isoformat(), last.isoformat()]
+        else:
+            parts.append(
+                f"SELECT {tag} AS p, product_id, product_name, revenue, cost, profit "
+                "FROM product_rollup WHERE period = ? AND bucket_start BETWEEN ? AND ?"
+            )
+            params += [kind, first.isoformat(), last.isoformat()]
+    return " UNION ALL ".join(parts), params
 
+
+@timed_query("finance")
 def get_daily_profit(
     start_date: datetime.date,
     end_date: datetime.date,
@@ -34,12 +99,9 @@ def get_daily_profit(
 
     cur.execute(
         """
-        SELECT date, SUM(revenue) AS revenue,
-               SUM(cost)    AS cost,
-               SUM(profit)  AS profit
+        SELECT date, revenue, cost, profit
         FROM daily_financials
-        WHERE date BETWEEN ? AND ?
-        GROUP BY date
+        WHERE date BETWEEN ? AND ?   -- one row per date (unique index)
         ORDER BY date ASC
         """,
         (start_s, end_s),
@@ -62,6 +124,7 @@ def get_daily_profit(
     return result
 
 
+@timed_query("finance")
 def get_profit_by_product(
     start_date: datetime.date,
     end_date: datetime.date,
@@ -80,27 +143,26 @@ def get_profit_by_product(
       ...
     ]
     """
-    start_s = start_date.isoformat()
-    end_s = end_date.isoformat()
-
+    if start_date > end_date:
+        return []
     conn = get_connection()
+    source, params = _product_source(conn, start_date, end_date)
     cur = conn.cursor()
 
     cur.execute(
-        """
+        f"""
         SELECT
             product_id,
-            product_name,
+            MAX(product_name) AS product_name,
             SUM(revenue) AS revenue,
             SUM(cost)    AS cost,
             SUM(profit)  AS profit
-        FROM product_financials
-        WHERE date BETWEEN ? AND ?
-        GROUP BY product_id, product_name
+        FROM ({source})
+        GROUP BY product_id
         ORDER BY profit DESC
         LIMIT ?
         """,
-        (start_s, end_s, top_n),
+        (*params, top_n),
     )
 
     rows = cur.fetchall()
@@ -120,45 +182,47 @@ def get_profit_by_product(
     return result
 
 
-def _aggregate_product_profit(
-    start_date: datetime.date, end_date: datetime.date
-) -> Dict[str, Dict]:
-    """
-    Helper: returns dict[product_id] -> {product_id, product_name, profit}
-    for the given period.
-    """
-    start_s = start_date.isoformat()
-    end_s = end_date.isoformat()
+# Both periods in one pass: each period's rollup buckets and leftover days
+# are tagged p = 1 / 2 and summed by CASE (a day in both periods is read
+# once per period, so overlaps count in both, like two separate aggregates).
+_PRODUCT_DELTA_SQL = """
+    SELECT
+        product_id,
+        MAX(product_name) AS product_name,
+        SUM(CASE WHEN p = 1 THEN profit ELSE 0 END) AS profit_period1,
+        SUM(CASE WHEN p = 2 THEN profit ELSE 0 END) AS profit_period2
+    FROM ({source})
+    GROUP BY product_id
+    ORDER BY profit_period2 - profit_period1 ASC, product_id
+"""
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            product_id,
-            product_name,
-            SUM(profit) AS profit
-        FROM product_financials
-        WHERE date BETWEEN ? AND ?
-        GROUP BY product_id, product_name
-        """,
-        (start_s, end_s),
-    )
 
-    rows = cur.fetchall()
-    conn.close()
+def _delta_query(conn, start_start, start_end, end_start, end_end) -> Tuple[str, List]:
+    sources, params = [], []
+    for tag, (lo, hi) in enumerate(((start_start, start_end), (end_start, end_end)), start=1):
+        if lo > hi:
+            continue
+        source, source_params = _product_source(conn, lo, hi, tag)
+        sources.append(source)
+        params += source_params
+    if not sources:
+        sources.append("SELECT 0 AS p, product_id, product_name, revenue, cost, profit FROM product_financials WHERE 0")
+    return _PRODUCT_DELTA_SQL.format(source=" UNION ALL ".join(sources)), params
 
-    out: Dict[str, Dict] = {}
-    for r in rows:
-        pid = r["product_id"]
-        out[pid] = {
-            "product_id": pid,
-            "product_name": r["product_name"],
-            "profit": float(r["profit"] or 0.0),
-        }
-    return out
+
+def _delta_row(r) -> Dict:
+    profit1 = float(r["profit_period1"] or 0.0)
+    profit2 = float(r["profit_period2"] or 0.0)
+    return {
+        "product_id": r["product_id"],
+        "product_name": r["product_name"],
+        "profit_period1": profit1,
+        "profit_period2": profit2,
+        "profit_delta": profit2 - profit1,
+    }
 
 
+@timed_query("finance")
 def get_profit_by_product_delta(
     start_start: datetime.date,
     start_end: datetime.date,
@@ -178,28 +242,104 @@ def get_profit_by_product_delta(
       },
       ...
     ]
+    One query; ordering and LIMIT run in SQLite.
     """
-    p1 = _aggregate_product_profit(start_start, start_end)
-    p2 = _aggregate_product_profit(end_start, end_end)
+    conn = get_connection()
+    try:
+        sql, params = _delta_query(conn, start_start, start_end, end_start, end_end)
+        rows = conn.execute(sql + " LIMIT ?", (*params, top_n)).fetchall()
+    finally:
+        conn.close()
+    return [_delta_row(r) for r in rows]
 
-    all_ids = set(p1.keys()) | set(p2.keys())
-    rows: List[Dict] = []
 
-    for pid in all_ids:
-        name = (p2.get(pid) or p1.get(pid))["product_name"]
-        profit1 = p1.get(pid, {}).get("profit", 0.0)
-        profit2 = p2.get(pid, {}).get("profit", 0.0)
-        delta = profit2 - profit1
+def iter_profit_by_product_delta(
+    start_start: datetime.date,
+    start_end: datetime.date,
+    end_start: datetime.date,
+    end_end: datetime.date,
+) -> Iterator[Dict]:
+    """
+    Every product's delta, most negative first, streamed from the cursor
+    (rows are not loaded into a list). The connection is closed when the
+    iterator is exhausted or closed.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.execute(*_delta_query(conn, start_start, start_end, end_start, end_end))
+        for r in cur:
+            yield _delta_row(r)
+    finally:
+        conn.close()
 
-        rows.append(
-            {
-                "product_id": pid,
-                "product_name": name,
-                "profit_period1": float(profit1),
-                "profit_period2": float(profit2),
-                "profit_delta": float(delta),
-            }
-        )
 
-    rows.sort(key=lambda r: r["profit_delta"])  # most negative first
-    return rows[:top_n]
+@timed_query("finance")
+def get_period_totals(
+    start_date: datetime.date,
+    end_date: datetime.date,
+) -> Dict:
+    """
+    Store totals over [start_date, end_date]:
+    {"revenue": float, "cost": float, "profit": float, "days": int}
+    (days = dates with a daily_financials row). Whole weeks / months come
+    from daily_rollup.
+    """
+    if start_date > end_date:
+        return {"revenue": 0.0, "cost": 0.0, "profit": 0.0, "days": 0}
+    conn = get_connection()
+    try:
+        parts, params = [], []
+        for kind, first, last in _segments(start_date, end_date, has_rollups(conn)):
+            if kind == "day":
+                parts.append("SELECT revenue, cost, profit, 1 AS days FROM daily_financials WHERE date BETWEEN ? AND ?")
+                params += [first.isoformat(), last.isoformat()]
+            else:
+                parts.append(
+                    "SELECT revenue, cost, profit, days FROM daily_rollup "
+                    "WHERE period = ? AND bucket_start BETWEEN ? AND ?"
+                )
+                params += [kind, first.isoformat(), last.isoformat()]
+        r = conn.execute(
+            "SELECT SUM(revenue) AS revenue, SUM(cost) AS cost, SUM(profit) AS profit, SUM(days) AS days "
+            f"FROM ({' UNION ALL '.join(parts)})",
+            params,
+        ).fetchone()
+    finally:
+        conn.close()
+    return {
+        "revenue": float(r["revenue"] or 0.0),
+        "cost": float(r["cost"] or 0.0),
+        "profit": float(r["profit"] or 0.0),
+        "days": int(r["days"] or 0),
+    }
+
+
+@timed_query("finance")
+def get_product_profit_series(
+    start_date: datetime.date,
+    end_date: datetime.date,
+) -> Dict[str, List]:
+    """
+    Every (date, product) profit row in [start_date, end_date], one query,
+    as columns (ready for numpy arrays):
+    {"date": ["YYYY-MM-DD", ...], "product_id": [...], "product_name": [...], "profit": [...]}
+    """
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT date, product_id, product_name, profit
+            FROM product_financials
+            WHERE date BETWEEN ? AND ?
+            """,
+            (start_date.isoformat(), end_date.isoformat()),
+        ).fetchall()
+    finally:
+        conn.close()
+    columns = list(zip(*rows)) or [(), (), (), ()]
+    return {
+        "date": list(columns[0]),
+        "product_id": list(columns[1]),
+        "product_name": list(columns[2]),
+        "profit": [float(p or 0.0) for p in columns[3]],
+    }
@@ -0,0 +1,166 @@
+# db/inventory_alerts.py
+"""
+Incremental stock alerts for inventory.db.
+
+- low stock: a product whose lots sum below its min_threshold
+  (restock_needed lists the ones with auto_buy)
+- expiring soon: lots with stock that expire within EXPIRY_DAYS
+  (already expired lots included)
+
+The first call loads both with one indexed query each. After that the
+write helpers report which products they touched, and only those are
+re-read, inside the same transaction, through the (product_name,
+expiration_date) lot index. The cache is updated when the transaction
+commits. When the date changes, only the expiring list is reloaded, via
+the partial expiration_date index. An alert check after every message is
+therefore O(changed products), not O(inventory).
+
+Env: INVENTORY_EXPIRY_DAYS (3).
+"""
+import datetime
+import os
+import threading
+import weakref
+from typing import Dict, Iterable, List
+
+EXPIRY_DAYS = int(os.getenv("INVENTORY_EXPIRY_DAYS", "3"))
+
+_TOTALS = (
+    "SELECT product_name, SUM(quantity) AS quantity, MAX(min_threshold) AS min_threshold, "
+    "MAX(auto_buy) AS auto_buy, MAX(unit) AS unit FROM inventory {where} GROUP BY product_name"
+)
+_EXPIRING = (
+    "SELECT product_name, quantity, unit, expiration_date FROM inventory "
+    "WHERE quantity > 0 AND expiration_date <= ? {where} ORDER BY expiration_date, product_name"
+)
+
+
+def _days_left(expiration_date, today: datetime.date):
+    try:
+        return (datetime.date.fromisoformat(str(expiration_date)) - today).days
+    except ValueError:
+        return None  # free-form date typed by a user
+
+
+def _in(names: List[str]) -> str:
+    return "product_name IN (" + ",".join("?" * len(names)) + ")"
+
+
+class AlertEngine:
+    def __init__(self, manager, expiry_days: int = EXPIRY_DAYS):
+        self.manager = manager
+        self.expiry_days = expiry_days
+        self._lock = threading.Lock()
+        self._low: Dict[str, dict] = None        # product -> totals, only products below threshold
+        self._expiring: Dict[str, list] = None   # product -> lots within the horizon
+        self._horizon = None                     # last expiration_date counted as "soon"
+        self.counters = {"full_loads": 0, "expiry_reloads": 0, "incremental_updates": 0}
+
+    def _current_horizon(self) -> str:
+        return (datetime.date.today() + datetime.timedelta(days=self.expiry_days)).isoformat()
+
+    # ---------- queries ----------
+
+    @staticmethod
+    def _low_rows(conn, names=None) -> Dict[str, dict]:
+        if names is None:
+            rows = conn.execute(_TOTALS.format(where="")).fetchall()
+        else:
+            rows = conn.execute(_TOTALS.format(where="WHERE " + _in(names)), names).fetchall()
+        return {
+            r["product_name"]: {"name": r["product_name"], "quantity": r["quantity"], "unit": r["unit"],
+                                "min_threshold": r["min_threshold"], "auto_buy": bool(r["auto_buy"])}
+            for r in rows
+            if r["min_threshold"] is not None and r["quantity"] < r["min_threshold"]
+        }
+
+    @staticmethod
+    def _expiring_rows(conn, horizon: str, names=None) -> Dict[str, list]:
+        if names is None:
+            rows = conn.execute(_EXPIRING.format(where=""), (horizon,)).fetchall()
+        else:
+            rows = conn.execute(_EXPIRING.format(where="AND " + _in(names)), [horizon, *names]).fetchall()
+        out: Dict[str, list] = {}
+        for r in rows:
+            out.setdefault(r["product_name"], []).append(
+                {"name": r["product_name"], "quantity": r["quantity"], "unit": r["unit"],
+                 "expiration_date": r["expiration_date"]})
+        return out
+
+    # ---------- cache maintenance ----------
+
+    def products_changed(self, conn, names: Iterable[str]) -> None:
+        """
+        Called by the write helpers inside their transaction: re-reads the
+        touched products (conn sees the uncommitted changes) and applies
+        the result to the cache on commit.
+        """
+        names = sorted(set(names))
+        if not names or self._low is None:
+            return  # nothing cached yet; the first alerts() call does a full load
+        horizon = self._horizon
+        low = self._low_rows(conn, names)
+        expiring = self._expiring_rows(conn, horizon, names)
+
+        def apply():
+            with self._lock:
+                if self._low is None or self._horizon != horizon:
+                    return
+                for name in names:
+                    self._low.pop(name, None)
+                    self._expiring.pop(name, None)
+                self._low.update(low)
+                self._expiring.update(expiring)
+                self.counters["incremental_updates"] += 1
+
+        self.manager.on_commit(apply)
+
+    def _ensure_loaded(self) -> None:
+        horizon = self._current_horizon()
+        if self._low is not None and self._horizon == horizon:
+            return
+        # under the write lock so no transaction commits between the load and the cache swap
+        with self.manager.write() as conn:
+            with self._lock:
+                if self._low is None:
+                    self._low = self._low_rows(conn)
+                    self.counters["full_loads"] += 1
+                elif self._horizon == horizon:
+                    return
+                else:
+                    self.counters["expiry_reloads"] += 1
+                self._expiring = self._expiring_rows(conn, horizon)
+                self._horizon = horizon
+
+    # ---------- read ----------
+
+    def alerts(self) -> dict:
+        self._ensure_loaded()
+        with self._lock:
+            low = sorted(self._low.values(), key=lambda x: x["name"])
+            expiring = sorted((lot for lots in self._expiring.values() for lot in lots),
+                              key=lambda x: (x["expiration_date"], x["name"]))
+        today = datetime.date.today()
+        return {
+            "restock_needed": [p["name"] for p in low if p["auto_buy"]],
+            "low_stock": low,
+            "expiring_soon": [
+                {**lot, "days_left": _days_left(lot["expiration_date"], today)} for lot in expiring
+            ],
+            "expiry_days": self.expiry_days,
+        }
+
+
+_engines: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_engines_lock = threading.Lock()
+
+
+def get_engine(manager) -> AlertEngine:
+    """One engine per ConnectionManager (i.e. per database file)."""
+    engine = _engines.get(manager)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(manager)
+            if engine is None:
+                engine = _engines[manager] = AlertEngine(manager)
+    return engine
@@ -0,0 +1,156 @@
+# db/inventory_db.py
+"""
+Connection manager for the inventory SQLite database.
+
+Opening a connection per helper call was a large share of inventory DB
+time, and with the default rollback journal the proxy's periodic reads
+waited on writers. Instead, per database file:
+
+- one long-lived write connection, shared under a lock; write() runs
+  the block in a BEGIN IMMEDIATE transaction (commit / rollback)
+- a small pool of read connections; read() borrows one. In WAL mode
+  readers see the last committed state and never wait on the writer
+- on_commit() callbacks keep in-memory caches in step with committed writes
+- WAL journal, synchronous=NORMAL (safe with WAL, no fsync per commit),
+  a larger page cache and memory-mapped reads
+
+    from db.inventory_db import get_manager
+    with get_manager(path).read() as conn:
+        rows = conn.execute("SELECT ...").fetchall()
+    with get_manager(path).write() as conn:
+        conn.execute("UPDATE ...")
+
+Env: INVENTORY_DB_PATH (db/inventory.db next to this module),
+INVENTORY_DB_READ_POOL (4), INVENTORY_DB_CACHE_KB (8192), INVENTORY_DB_MMAP_MB (64).
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = Path(os.getenv("INVENTORY_DB_PATH", BASE_DIR / "inventory.db"))
+
+READ_POOL_SIZE = int(os.getenv("INVENTORY_DB_READ_POOL", "4"))
+CACHE_KB = int(os.getenv("INVENTORY_DB_CACHE_KB", "8192"))
+MMAP_MB = int(os.getenv("INVENTORY_DB_MMAP_MB", "64"))
+BUSY_TIMEOUT_MS = 5000
+
+
+class ConnectionManager:
+    def __init__(self, path, read_pool_size: int = READ_POOL_SIZE):
+        self.path = Path(path)
+        self.read_pool_size = read_pool_size
+
+        self._write_lock = threading.RLock()
+        self._write_conn = None
+        self._on_commit = []
+        self._readers: "queue.LifoQueue" = queue.LifoQueue(maxsize=read_pool_size)
+        self.counters = {"writes": 0, "reads": 0, "read_connections_opened": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE in write())
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        return conn
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Serialized write transaction; nested write() blocks join the outer one."""
+        with self._write_lock:
+            if self._write_conn is None:
+                self._write_conn = self._connect()
+            conn = self._write_conn
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                self._on_commit.clear()
+                raise
+            conn.commit()
+            self.counters["writes"] += 1
+            callbacks, self._on_commit = self._on_commit, []
+            for fn in callbacks:
+                fn()
+
+    def on_commit(self, fn) -> None:
+        """
+        Inside write(): runs fn once the transaction commits (dropped on
+        rollback), still under the write lock so in-memory state derived
+        from the transaction is applied in commit order.
+        """
+        self._on_commit.append(fn)
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=1")
+            self.counters["read_connections_opened"] += 1
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.counters["reads"] += 1
+            try:
+                self._readers.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self) -> None:
+        with self._write_lock:
+            if self._write_conn is not None:
+                self._write_conn.close()
+                self._write_conn = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self) -> Dict:
+        out = dict(self.counters)
+        out.update({"path": str(self.path), "idle_readers": self._readers.qsize(),
+                    "read_pool_size": self.read_pool_size})
+        return out
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(path=DB_PATH) -> ConnectionManager:
+    """One manager per database file (tests point the helpers at a temp file)."""
+    key = str(Path(path).resolve())
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = _managers[key] = ConnectionManager(key)
+    return manager
+
+
+def close_all() -> None:
+    with _managers_lock:
+        for manager in _managers.values():
+            manager.close()
+        _managers.clear()
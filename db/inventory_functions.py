@@ -1,71 +1,302 @@
-import sqlite3
 import datetime
-import os
+from metrics import timed_query
+from db.inventory_db import DB_PATH, get_manager
+from db.inventory_migrations import migrate
+from db.inventory_alerts import get_engine
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = 'db/inventory.db'
+def _db():
+    # looked up per call so DB_PATH can be repointed (tests)
+    return get_manager(DB_PATH)
 
 def init_db():
-    db_dir = os.path.dirname(DB_PATH)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS inventory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, product_name TEXT NOT NULL, category TEXT DEFAULT 'general',
-            quantity REAL DEFAULT 0, unit TEXT DEFAULT 'pcs', expiration_date DATE,
-            auto_buy BOOLEAN DEFAULT 0, min_threshold REAL DEFAULT 2)''')
-    conn.commit()
-    conn.close()
+    """Creates / upgrades the schema (db/inventory_migrations.py)."""
+    migrate(_db())
 
-def add_product(name, category, qty, unit, expiry, auto_buy):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, quantity FROM inventory WHERE product_name = ? AND expiration_date = ?", (name, expiry))
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE inventory SET quantity = ?, category = ?, auto_buy = ? WHERE id = ?", 
-                  (row[1] + qty, category, auto_buy, row[0]))
-    else:
-        c.execute("INSERT INTO inventory (product_name, category, quantity, unit, expiration_date, auto_buy) VALUES (?, ?, ?, ?, ?, ?)", 
-                  (name, category, qty, unit, expiry, auto_buy))
-    conn.commit()
-    conn.close()
-    return f"Added {qty}{unit} of '{name}'"
+_UPSERT_LOT = (
+    "INSERT INTO inventory (product_name, category, quantity, unit, expiration_date, auto_buy, version) VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(product_name, expiration_date) DO UPDATE SET "
+    "quantity = quantity + excluded.quantity, category = excluded.category, auto_buy = excluded.auto_buy, "
+    "version = excluded.version"
+)
 
-def consume_product(name, qty):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, quantity, unit, expiration_date FROM inventory WHERE product_name = ? AND quantity > 0 ORDER BY expiration_date ASC", (name,))
-    rows = c.fetchall()
+_INSERT_MOVEMENT = (
+    "INSERT INTO stock_movements (product_name, kind, quantity, unit, expiration_date, day) VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+_BUMP_CONSUMPTION = (
+    "INSERT INTO daily_consumption (product_name, day, quantity, movements) VALUES (?, ?, ?, 1) "
+    "ON CONFLICT(product_name, day) DO UPDATE SET "
+    "quantity = quantity + excluded.quantity, movements = movements + 1"
+)
+
+def _bump_version(conn):
+    """Next data version; lots written in this step are stamped with it."""
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    return conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
+
+def _today():
+    return datetime.date.today().isoformat()
+
+def _add_rows(conn, rows):
+    # one statement per lot against the unique (product_name, expiration_date) index;
+    # category is never NULL (query_inventory's keyset cursor cannot step past NULLs)
+    rows = [(name, "" if category is None else category, *rest) for name, category, *rest in rows]
+    version = _bump_version(conn)
+    conn.executemany(_UPSERT_LOT, [(*row, version) for row in rows])
+    today = _today()
+    conn.executemany(_INSERT_MOVEMENT, [(name, "add", qty, unit, expiry, today)
+                                        for name, _, qty, unit, expiry, _ in rows])
+    get_engine(_db()).products_changed(conn, [row[0] for row in rows])
+    return [f"Added {qty}{unit} of '{name}'" for name, _, qty, unit, _, _ in rows]
+
+def _consume(conn, name, qty):
+    """FIFO by expiration date; the lot updates go out in one executemany."""
+    rows = conn.execute("SELECT id, quantity, unit, expiration_date FROM inventory WHERE product_name = ? AND quantity > 0 ORDER BY expiration_date ASC", (name,)).fetchall()
     if not rows:
-        conn.close()
         return f"Error: '{name}' not found."
-    
+
     remaining = qty
     consumed_log = []
-    for row in rows:
-        row_id, current_qty, unit, exp = row
+    updates = []
+    movements = []
+    today = _today()
+    for row_id, current_qty, unit, exp in rows:
         if remaining <= 0: break
-        
+
         take = min(current_qty, remaining)
-        new_qty = current_qty - take
-        c.execute("UPDATE inventory SET quantity = ? WHERE id = ?", (new_qty, row_id))
+        updates.append((current_qty - take, row_id))
+        movements.append((name, "consume", -take, unit, exp, today))
         consumed_log.append(f"{take}{unit} (Exp: {exp})")
         remaining -= take
-    conn.commit()
-    conn.close()
+    version = _bump_version(conn)
+    conn.executemany("UPDATE inventory SET quantity = ?, version = ? WHERE id = ?",
+                     [(new_qty, version, row_id) for new_qty, row_id in updates])
+    conn.executemany(_INSERT_MOVEMENT, movements)
+    conn.execute(_BUMP_CONSUMPTION, (name, today, qty - remaining))
+    get_engine(_db()).products_changed(conn, [name])
     return f"Consumed {name}: " + ", ".join(consumed_log)
 
+@timed_query("inventory")
+def add_product(name, category, qty, unit, expiry, auto_buy):
+    with _db().write() as conn:
+        return _add_rows(conn, [(name, category, qty, unit, expiry, auto_buy)])[0]
+
+@timed_query("inventory")
+def consume_product(name, qty):
+    with _db().write() as conn:
+        return _consume(conn, name, qty)
+
+@timed_query("inventory")
+def apply_batch(ops, idempotency_keys=()):
+    """
+    Applies a list of adds / consumes in one BEGIN IMMEDIATE transaction
+    (one commit for the whole order; any failure rolls all of it back).
+
+    ops: {"action": "add", "name", "category", "quantity", "unit", "expiry", "auto_buy"}
+         or {"action": "consume", "name", "quantity"}, applied in list order.
+    idempotency_keys are claimed first, inside the same transaction: if one
+    of them was already applied nothing is done and None is returned, so two
+    concurrent deliveries of the same batch cannot both apply it.
+    Otherwise returns one result string per op (None for unknown actions).
+    """
+    results = []
+    pending_adds = []
+
+    def flush_adds():
+        # consecutive adds go out as one executemany
+        if pending_adds:
+            results.extend(_add_rows(conn, pending_adds))
+            pending_adds.clear()
+
+    with _db().write() as conn:
+        if idempotency_keys and not _claim(conn, idempotency_keys):
+            return None
+        for op in ops:
+            if op["action"] == "add":
+                pending_adds.append((op["name"], op.get("category", "general"), op["quantity"],
+                                     op.get("unit", "pcs"), op.get("expiry"), op.get("auto_buy", 0)))
+                continue
+            flush_adds()
+            if op["action"] == "consume":
+                results.append(_consume(conn, op["name"], op["quantity"]))
+            else:
+                results.append(None)
+        flush_adds()
+    return results
+
+@timed_query("inventory")
 def get_all_inventory():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM inventory WHERE quantity > 0 ORDER BY category, product_name")
-    rows = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return rows
+    with _db().read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM inventory WHERE quantity > 0 ORDER BY category, product_name, id")
+        return [dict(row) for row in c.fetchall()]
+
+LOT_FIELDS = ("id", "product_name", "category", "quantity", "unit", "expiration_date",
+              "auto_buy", "min_threshold", "version")
+
+def _prefix_range(prefix):
+    # name LIKE 'pre%' as a range, so the (product_name, expiration_date) index is used
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _lot_filters(category=None, name_prefix=None, expiring_before=None, auto_buy=None):
+    where, params = ["quantity > 0"], []
+    if category is not None:
+        where.append("category = ?")
+        params.append(category)
+    if name_prefix:
+        where.append("product_name >= ? AND product_name < ?")
+        params.extend(_prefix_range(name_prefix))
+    if expiring_before is not None:
+        where.append("expiration_date <= ?")
+        params.append(expiring_before)
+    if auto_buy is not None:
+        where.append("auto_buy = ?")
+        params.append(1 if auto_buy else 0)
+    return where, params
+
+@timed_query("inventory")
+def query_inventory(category=None, name_prefix=None, expiring_before=None, auto_buy=None,
+                    fields=None, limit=None, after=None):
+    """
+    In-stock lots matching the filters, ordered by (category, product_name, id).
+
+    fields: subset of LOT_FIELDS to return (default all).
+    limit / after: keyset pagination; `after` is the (category, product_name, id)
+    of the last lot of the previous page. Returns (lots, next_after), next_after
+    None on the last page.
+    """
+    fields = [f for f in (fields or LOT_FIELDS) if f in LOT_FIELDS] or list(LOT_FIELDS)
+    where, params = _lot_filters(category, name_prefix, expiring_before, auto_buy)
+    if after is not None and after[0] is None:
+        after = ("", *after[1:])   # cursor issued before categories were normalized
+    # idx_inventory_in_stock is (category, product_name) + the implicit rowid (= id), so the
+    # cursor comparison is an index range; within one category it narrows to (product_name, id)
+    if after is not None and category is not None and after[0] == category:
+        where.append("(product_name, id) > (?, ?)")
+        params.extend(after[1:])
+    elif after is not None:
+        where.append("(category, product_name, id) > (?, ?, ?)")
+        params.extend(after)
+    # key columns are always read for the cursor, and dropped below if not asked for
+    columns = list(dict.fromkeys([*fields, "category", "product_name", "id"]))
+    sql = (f"SELECT {', '.join(columns)} FROM inventory WHERE {' AND '.join(where)} "
+           f"ORDER BY category, product_name, id")
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)  # one extra row tells whether another page exists
+    with _db().read() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_after = (last["category"], last["product_name"], last["id"])
+    return [{f: row[f] for f in fields} for row in rows], next_after
+
+@timed_query("inventory")
+def get_product_totals(category=None, name_prefix=None, expiring_before=None, auto_buy=None):
+    """One row per product: lots summed, lot count and the nearest expiry."""
+    where, params = _lot_filters(category, name_prefix, expiring_before, auto_buy)
+    with _db().read() as conn:
+        rows = conn.execute(
+            "SELECT product_name, MAX(category) AS category, SUM(quantity) AS quantity, MAX(unit) AS unit, "
+            "COUNT(*) AS lots, MIN(expiration_date) AS next_expiration, MAX(auto_buy) AS auto_buy "
+            f"FROM inventory WHERE {' AND '.join(where)} GROUP BY product_name ORDER BY product_name",
+            params,
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+@timed_query("inventory")
+def get_consumption(name=None, days=7):
+    """
+    Quantity consumed over the last `days` days (today included), from the
+    daily aggregates: {product_name: {"quantity", "days_active", "daily_average"}}.
+    """
+    since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+    query = ("SELECT product_name, SUM(quantity), COUNT(*) FROM daily_consumption "
+             "WHERE day >= ?{} GROUP BY product_name")
+    with _db().read() as conn:
+        if name is None:
+            rows = conn.execute(query.format(""), (since,)).fetchall()
+        else:
+            rows = conn.execute(query.format(" AND product_name = ?"), (since, name)).fetchall()
+    return {
+        product: {"quantity": total, "days_active": active, "daily_average": total / days}
+        for product, total, active in rows
+    }
+
+@timed_query("inventory")
+def get_movements(name, limit=50):
+    """Latest ledger entries for one product, newest first."""
+    with _db().read() as conn:
+        rows = conn.execute(
+            "SELECT * FROM stock_movements WHERE product_name = ? ORDER BY id DESC LIMIT ?", (name, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
 
 def get_alerts():
-    # Simplified alert logic for brevity
-    return {"restock_needed": []}
\ No newline at end of file
+    """Low stock / expiring lots (db/inventory_alerts.py); kept up to date by the write helpers."""
+    return get_engine(_db()).alerts()
+
+def _version(conn):
+    return conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
+
+@timed_query("inventory")
+def get_inventory_version():
+    """Current data version (primary key lookup); used for ETags."""
+    with _db().read() as conn:
+        return _version(conn)
+
+@timed_query("inventory")
+def get_inventory_changes(since):
+    """
+    Lots written after data version `since`, including emptied ones
+    (quantity 0: drop them client-side). since <= 0, or a version from a
+    newer / reset database, returns a full snapshot with full=True.
+    """
+    with _db().read() as conn:
+        conn.execute("BEGIN")
+        version = _version(conn)
+        full = since <= 0 or since > version
+        if full:
+            rows = conn.execute("SELECT * FROM inventory WHERE quantity > 0 ORDER BY category, product_name").fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM inventory WHERE version > ? ORDER BY version, id", (since,)).fetchall()
+        conn.execute("COMMIT")
+    return {"version": version, "full": full, "changes": [dict(row) for row in rows]}
+
+@timed_query("inventory")
+def get_product_names():
+    with _db().read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT DISTINCT product_name FROM inventory ORDER BY product_name")
+        return [row[0] for row in c.fetchall()]
+
+@timed_query("inventory")
+def get_processed_requests(keys):
+    """Returns the subset of idempotency keys that were already applied."""
+    if not keys:
+        return set()
+    with _db().read() as conn:
+        c = conn.cursor()
+        placeholders = ",".join("?" * len(keys))
+        c.execute(f"SELECT idempotency_key FROM processed_requests WHERE idempotency_key IN ({placeholders})", list(keys))
+        return {row[0] for row in c.fetchall()}
+
+@timed_query("inventory")
+def mark_requests_processed(keys):
+    with _db().write() as conn:
+        _mark_processed(conn, keys)
+
+def _claim(conn, keys):
+    """Marks keys processed; False (nothing marked) if one of them already was. Caller holds the write lock."""
+    placeholders = ",".join("?" * len(keys))
+    if conn.execute(f"SELECT 1 FROM processed_requests WHERE idempotency_key IN ({placeholders})",
+                    list(keys)).fetchone():
+        return False
+    _mark_processed(conn, keys)
+    return True
+
+def _mark_processed(conn, keys):
+    conn.executemany("INSERT OR IGNORE INTO processed_requests (idempotency_key) VALUES (?)", [(k,) for k in keys])
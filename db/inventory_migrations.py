@@ -0,0 +1,122 @@
+# db/inventory_migrations.py
+"""
+Versioned schema migrations for inventory.db.
+
+The schema version is kept in PRAGMA user_version. migrate() applies every
+migration newer than that, each in its own write transaction together
+with the version bump, so a failed step leaves the database at the last
+good version. Append new migrations to MIGRATIONS; never edit applied ones.
+
+Databases created before the runner existed are at version 0 and already
+have the tables; migration 1 uses IF NOT EXISTS for that reason.
+"""
+import sqlite3
+from typing import Callable, List, Tuple
+
+from log import get_logger
+
+log = get_logger("inventory_db")
+
+
+def _create_base_tables(conn: sqlite3.Connection) -> None:
+    conn.execute('''CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, product_name TEXT NOT NULL, category TEXT DEFAULT 'general',
+            quantity REAL DEFAULT 0, unit TEXT DEFAULT 'pcs', expiration_date DATE,
+            auto_buy BOOLEAN DEFAULT 0, min_threshold REAL DEFAULT 2)''')
+    # idempotency keys of orchestrator commands already applied (outbox retries)
+    conn.execute('''CREATE TABLE IF NOT EXISTS processed_requests (
+            idempotency_key TEXT PRIMARY KEY, processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+
+def _unique_lots(conn: sqlite3.Connection) -> None:
+    # concurrent adds could create the same lot twice; fold duplicates into the oldest row first
+    conn.execute('''UPDATE inventory SET quantity = (
+                SELECT SUM(d.quantity) FROM inventory d
+                WHERE d.product_name = inventory.product_name AND d.expiration_date = inventory.expiration_date)
+            WHERE id IN (
+                SELECT MIN(id) FROM inventory WHERE expiration_date IS NOT NULL
+                GROUP BY product_name, expiration_date HAVING COUNT(*) > 1)''')
+    conn.execute('''DELETE FROM inventory WHERE expiration_date IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM inventory WHERE expiration_date IS NOT NULL
+                GROUP BY product_name, expiration_date)''')
+    # lookup key of add_product and the (product_name =, ORDER BY expiration_date) scan of consume_product;
+    # lots without an expiry date stay separate rows (NULLs never conflict), as before
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_lot ON inventory(product_name, expiration_date)")
+
+
+def _in_stock_index(conn: sqlite3.Connection) -> None:
+    # get_all_inventory: WHERE quantity > 0 ORDER BY category, product_name, without the empty lots
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_inventory_in_stock
+            ON inventory(category, product_name) WHERE quantity > 0''')
+
+
+def _stock_ledger(conn: sqlite3.Connection) -> None:
+    # append-only history of every add / consume (signed quantity), one row per lot touched
+    conn.execute('''CREATE TABLE IF NOT EXISTS stock_movements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, product_name TEXT NOT NULL, kind TEXT NOT NULL,
+            quantity REAL NOT NULL, unit TEXT, expiration_date DATE, day DATE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_movements_product ON stock_movements(product_name, id)")
+    # maintained in the same transaction as the ledger; usage over a window is a primary key range scan
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_consumption (
+            product_name TEXT NOT NULL, day DATE NOT NULL, quantity REAL NOT NULL DEFAULT 0,
+            movements INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_name, day)) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_consumption_day ON daily_consumption(day)")
+
+
+def _expiring_index(conn: sqlite3.Connection) -> None:
+    # expiring-soon alerts: range scan on expiration_date over in-stock lots only
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_inventory_expiring
+            ON inventory(expiration_date) WHERE quantity > 0''')
+
+
+def _change_versions(conn: sqlite3.Connection) -> None:
+    # every write bumps the data version and stamps the lots it touched with it, so
+    # "changed since v" is a range scan; lots are never deleted (quantity 0 = gone)
+    conn.execute("ALTER TABLE inventory ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inventory_version ON inventory(version)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)''')
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+
+def _no_null_categories(conn: sqlite3.Connection) -> None:
+    # the (category, product_name, id) > (?, ?, ?) cursor of query_inventory is never true for a
+    # NULL category, so pagination stopped there; writes now store '' (sorts first, as NULL did)
+    if conn.execute("SELECT 1 FROM inventory WHERE category IS NULL LIMIT 1").fetchone() is None:
+        return
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    conn.execute('''UPDATE inventory SET category = '',
+            version = (SELECT version FROM data_version WHERE id = 1) WHERE category IS NULL''')
+
+
+# (version, description, step)
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "base tables", _create_base_tables),
+    (2, "unique (product_name, expiration_date) lots", _unique_lots),
+    (3, "partial index on in-stock lots", _in_stock_index),
+    (4, "stock movements ledger and daily consumption", _stock_ledger),
+    (5, "partial index on expiration date for alerts", _expiring_index),
+    (6, "data version and per-lot change stamps", _change_versions),
+    (7, "empty string instead of NULL category", _no_null_categories),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(manager, migrations=MIGRATIONS) -> List[int]:
+    """Applies pending migrations; returns the versions that were applied."""
+    applied = []
+    for version, description, step in migrations:
+        with manager.write() as conn:
+            # re-checked inside the write lock: another process may have migrated meanwhile
+            if current_version(conn) >= version:
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+        log.info("schema migrated", version=version, migration=description)
+        applied.append(version)
+    return applied
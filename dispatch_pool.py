@@ -0,0 +1,146 @@
+# dispatch_pool.py
+"""
+Bounded executor for background calls (orchestrator -> agents, legal
+research jobs), replacing one new Thread per call.
+
+- fixed number of worker threads
+- per-destination concurrency limits (a slow agent cannot occupy every worker)
+- max queue depth with an explicit overflow policy:
+    "reject"      - refuse the new task (submit returns False)
+    "drop_oldest" - drop the oldest queued task and accept the new one
+    "caller_runs" - run the task in the submitting thread (backpressure)
+- counters: queued, running, completed, failed, rejected, dropped
+"""
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+
+from log import get_logger
+
+log = get_logger("dispatch_pool")
+
+OVERFLOW_POLICIES = ("reject", "drop_oldest", "caller_runs")
+
+
+class BoundedExecutor:
+    def __init__(
+        self,
+        name: str,
+        workers: int = 8,
+        max_queue: int = 200,
+        limits: Optional[Dict[str, int]] = None,
+        default_limit: int = 4,
+        overflow: str = "reject",
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+
+        self.name = name
+        self.max_queue = max_queue
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.overflow = overflow
+
+        self._pending: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        self._running: Dict[str, int] = {}
+        self._cv = threading.Condition()
+
+        self.counters = {"completed": 0, "failed": 0, "rejected": 0, "dropped": 0}
+
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            t.start()
+
+    def _limit(self, destination: str) -> int:
+        return self.limits.get(destination, self.default_limit)
+
+    def submit(self, destination: str, fn: Callable, *args, **kwargs) -> bool:
+        """
+        Queue fn(*args, **kwargs) for `destination`.
+        Returns False when the task was rejected by the overflow policy.
+        """
+        task = (fn, args, kwargs)
+        with self._cv:
+            full = self._queued >= self.max_queue
+            if full and self.overflow == "reject":
+                self.counters["rejected"] += 1
+                log.warning("queue full, rejecting task", pool=self.name, max_queue=self.max_queue,
+                            destination=destination)
+                return False
+            if not (full and self.overflow == "caller_runs"):
+                if full:
+                    self._drop_oldest()
+                self._pending.setdefault(destination, deque()).append(task)
+                self._queued += 1
+                self._cv.notify()
+                return True
+
+        log.warning("queue full, running task in caller thread", pool=self.name, max_queue=self.max_queue,
+                    destination=destination)
+        self._run(destination, task, track=True)
+        return True
+
+    def _drop_oldest(self) -> None:
+        # caller holds self._cv; oldest = head of the first non-empty destination queue
+        for dest, tasks in self._pending.items():
+            if tasks:
+                tasks.popleft()
+                self._queued -= 1
+                self.counters["dropped"] += 1
+                log.warning("queue full, dropped oldest task", pool=self.name, max_queue=self.max_queue,
+                            destination=dest)
+                return
+
+    def _next_task(self):
+        # caller holds self._cv; round-robin over destinations with free capacity
+        for dest in list(self._pending.keys()):
+            tasks = self._pending[dest]
+            if tasks and self._running.get(dest, 0) < self._limit(dest):
+                task = tasks.popleft()
+                self._queued -= 1
+                self._pending.move_to_end(dest)
+                return dest, task
+        return None
+
+    def _run(self, destination: str, task, track: bool = False) -> None:
+        fn, args, kwargs = task
+        if track:
+            with self._cv:
+                self._running[destination] = self._running.get(destination, 0) + 1
+        try:
+            fn(*args, **kwargs)
+            outcome = "completed"
+        except Exception:
+            log.exception("task failed", pool=self.name, destination=destination)
+            outcome = "failed"
+        with self._cv:
+            self._running[destination] -= 1
+            self.counters[outcome] += 1
+            self._cv.notify_all()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cv:
+                picked = self._next_task()
+                while picked is None:
+                    self._cv.wait()
+                    picked = self._next_task()
+                dest, task = picked
+                self._running[dest] = self._running.get(dest, 0) + 1
+            self._run(dest, task)
+
+    def stats(self) -> Dict:
+        with self._cv:
+            out = dict(self.counters)
+            out["queued"] = self._queued
+            out["running"] = sum(self._running.values())
+            out["destinations"] = {
+                dest: {
+                    "queued": len(self._pending.get(dest, ())),
+                    "running": self._running.get(dest, 0),
+                    "limit": self._limit(dest),
+                }
+                for dest in set(self._pending) | set(self._running)
+            }
+        return out
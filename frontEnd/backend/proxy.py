@@ -1,12 +1,23 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import requests
-import json
+import os
+import sys
 import threading
 import time
 
+# tracing.py sta in radacina repo-ului
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import metrics
+import tracing
+from log import get_logger
+
+log = get_logger("proxy")
+
 app = Flask(__name__)
 CORS(app)
+tracing.instrument_flask(app, "proxy")
+metrics.instrument_flask(app, "proxy")
 
 # Porturile
 PROXY_PORT = 5000
@@ -14,52 +25,206 @@ PROXY_HOST = "0.0.0.0"
 
 # Trimitem către ORCHESTRATOR
 TARGET_URL = "http://localhost:5001/text"
+# Orchestratorul doar pune mesajul in coada (202 + job_id), deci raspunde repede
+ORCHESTRATOR_JOBS_URL = "http://localhost:5001/jobs"
+ORCHESTRATOR_TIMEOUT = 5
 
 # Endpointul serviciului de inventory (schimbă dacă e alt port / path)
 INVENTORY_URL = "http://localhost:5002/inventory"
 
-# Coada de mesaje pentru Frontend (Polling)
-PENDING_UPDATES = []
+# Cozile de mesaje pentru Frontend (Polling), cate una pe session_id (un tab).
+# Pachetele fara sesiune (sau cu "default") merg la toate sesiunile active.
+# Orice acces la PENDING_UPDATES / SESSION_SEEN se face sub PENDING_LOCK.
+DEFAULT_SESSION_ID = "default"
+PENDING_UPDATES = {}        # session_id -> [pachete]
+SESSION_SEEN = {}           # session_id -> ultimul poll (time.time())
+PENDING_LOCK = threading.Lock()
+SESSION_IDLE_SECONDS = 300  # sesiunile care nu mai fac poll sunt uitate
+MAX_PENDING_PER_SESSION = 500
+
+
+def _pending_count():
+    with PENDING_LOCK:
+        return sum(len(q) for q in PENDING_UPDATES.values())
+
+
+metrics.gauge("proxy_pending_updates", "Packets waiting for the UI to poll /api/updates",
+              fn=_pending_count)
+metrics.gauge("proxy_sessions", "UI sessions polling /api/updates", fn=lambda: len(SESSION_SEEN))
+
+
+def _session_queue(session_id):
+    # apelantul tine PENDING_LOCK
+    queue = PENDING_UPDATES.setdefault(session_id, [])
+    if len(queue) >= MAX_PENDING_PER_SESSION:
+        del queue[0]  # tab-ul nu mai face poll: pastram doar cele mai noi
+    return queue
+
+
+def enqueue_update(packet, session_id=None):
+    """Pune un pachet in coada sesiunii lui, sau in toate cozile daca nu are sesiune."""
+    with PENDING_LOCK:
+        if session_id and session_id != DEFAULT_SESSION_ID:
+            _session_queue(session_id).append(packet)
+            return
+        targets = set(SESSION_SEEN) | set(PENDING_UPDATES) | {DEFAULT_SESSION_ID}
+        for sid in targets:
+            _session_queue(sid).append(packet)
+
+
+def drain_updates(session_id):
+    """
+    Ia tot ce e in coada sesiunii si uita sesiunile inactive.
+    La primul poll al unei sesiuni (tab nou) pune in fata inventarul complet,
+    altfel UI-ul ar arata datele mock pana la urmatoarea schimbare.
+    """
+    now = time.time()
+    with PENDING_LOCK:
+        is_new = session_id not in SESSION_SEEN
+        SESSION_SEEN[session_id] = now
+        for sid, seen in list(SESSION_SEEN.items()):
+            if now - seen > SESSION_IDLE_SECONDS:
+                del SESSION_SEEN[sid]
+                PENDING_UPDATES.pop(sid, None)
+        updates = PENDING_UPDATES.pop(session_id, [])
+    if is_new:
+        snapshot = inventory_snapshot()
+        if snapshot is not None:
+            updates.insert(0, snapshot)
+    return updates
+
+
+def queue_chat_delta(data, sender):
+    """
+    chatbox_delta (stream de tokeni de la orchestrator) -> chat_message incremental.
+    Delta-urile aceluiasi stream care inca n-au fost livrate catre React
+    se lipesc in acelasi pachet, ca UI-ul sa nu primeasca zeci de bucati.
+
+    Payload catre UI:
+        {"text": "<delta>", "sender": "ai", "stream_id": "...", "is_delta": true,
+         "done": false, "final_text": "<doar cand done=true>"}
+    """
+    stream_id = data.get("stream_id")
+    session_id = data.get("session_id")
+    delta = data.get("delta", "")
+    done = bool(data.get("done"))
+    final_text = data.get("text")
+
+    payload = {
+        "text": delta,
+        "sender": sender,
+        "stream_id": stream_id,
+        "session_id": session_id,
+        "is_delta": True,
+        "done": done,
+    }
+    if final_text is not None:
+        payload["final_text"] = final_text
+
+    if not session_id or session_id == DEFAULT_SESSION_ID:
+        # fara sesiune merge la toate tab-urile, fiecare delta separat
+        enqueue_update({"type": "chat_message", "payload": payload})
+        return
+
+    with PENDING_LOCK:
+        queue = _session_queue(session_id)
+        for packet in reversed(queue):
+            pending = packet.get("payload", {})
+            if packet.get("type") == "chat_message" and pending.get("stream_id") == stream_id:
+                if not pending.get("done"):
+                    pending["text"] += delta
+                    pending["done"] = done
+                    if final_text is not None:
+                        pending["final_text"] = final_text
+                    return
+                break
+        queue.append({"type": "chat_message", "payload": payload})
 
 
 # --- THREAD: POLLER INVENTORY LA 10s ---
+# Oglinda locala a inventarului (lot id -> lot), actualizata doar cu delta-urile
+# de la /inventory/changes; UI-ul primeste lista completa cand ceva s-a schimbat
+# si la primul poll al fiecarei sesiuni. INVENTORY_LOCK: poller-ul scrie,
+# request-urile /api/updates citesc.
+INVENTORY_MIRROR = {}
+INVENTORY_VERSION = 0
+INVENTORY_STATUS = None
+INVENTORY_LOADED = False    # True dupa primul raspuns de la inventory
+INVENTORY_LOCK = threading.Lock()
+
+
+def apply_inventory_changes(data):
+    """
+    Aplica un raspuns /inventory/changes peste oglinda.
+    Loturile cu quantity 0 au fost golite si se scot. Intoarce True daca
+    lista vazuta de UI s-a schimbat.
+    """
+    global INVENTORY_VERSION, INVENTORY_STATUS, INVENTORY_LOADED
+    with INVENTORY_LOCK:
+        before = dict(INVENTORY_MIRROR) if data.get("full") else None
+        if data.get("full"):
+            INVENTORY_MIRROR.clear()
+
+        changed = False
+        for lot in data.get("changes", []):
+            if (lot.get("quantity") or 0) > 0:
+                changed |= INVENTORY_MIRROR.get(lot["id"]) != lot
+                INVENTORY_MIRROR[lot["id"]] = lot
+            elif INVENTORY_MIRROR.pop(lot["id"], None) is not None:
+                changed = True
+
+        INVENTORY_VERSION = data.get("version", INVENTORY_VERSION)
+        INVENTORY_STATUS = data.get("status", INVENTORY_STATUS)
+        INVENTORY_LOADED = True
+        if before is not None:
+            changed = before != INVENTORY_MIRROR
+        return changed
+
+
+def inventory_items():
+    # aceeasi ordine ca GET /inventory
+    with INVENTORY_LOCK:
+        lots = list(INVENTORY_MIRROR.values())
+    return sorted(lots, key=lambda lot: (lot.get("category") or "", lot.get("product_name") or ""))
+
+
+def inventory_snapshot():
+    """Pachetul data_update cu tot inventarul, sau None daca poller-ul n-a primit inca nimic."""
+    if not INVENTORY_LOADED:
+        return None
+    # Frontend-ul așteaptă type=data_update cu payload.category=inventory și items=[]
+    return {
+        "type": "data_update",
+        "payload": {
+            "category": "inventory",
+            "items": inventory_items(),
+            "status": INVENTORY_STATUS,
+        }
+    }
+
+
 def inventory_poller():
     """
     Rulează într-un thread separat.
     La fiecare 10 secunde:
-      - face request la serviciul de inventory
-      - pune rezultatul în PENDING_UPDATES, pe care UI îl ia prin /api/updates
+      - cere de la inventory doar loturile schimbate de la ultima versiune
+      - daca s-a schimbat ceva, pune lista completa în PENDING_UPDATES,
+        pe care UI îl ia prin /api/updates (sesiunile noi o primesc
+        oricum la primul poll, vezi drain_updates)
     """
     while True:
         try:
-            print("\n🕒 [InventoryPoller] Cer inventory...")
-            resp = requests.get(INVENTORY_URL, timeout=5)
-            print(f"   [InventoryPoller] HTTP {resp.status_code}")
-
-            # Încearcă să parsezi JSON
-            try:
-                inv_data = resp.json()
-            except Exception:
-                inv_data = {"raw": resp.text}
-                print("   [InventoryPoller] Răspuns non-JSON, salvez ca 'raw'.")
-
-            # Normalizăm într-un mesaj pe care UI îl poate afișa
-            # Frontend-ul așteaptă type=data_update cu payload.category=inventory și items=[]
-            msg = {
-                "type": "data_update",
-                "payload": {
-                    "category": "inventory",
-                    "items": inv_data.get("inventory", []) if isinstance(inv_data, dict) else [],
-                    "status": inv_data.get("status") if isinstance(inv_data, dict) else None
-                }
-            }
+            resp = requests.get(f"{INVENTORY_URL}/changes", params={"since": INVENTORY_VERSION}, timeout=5)
+            resp.raise_for_status()
+            data = resp.json()
 
-            global PENDING_UPDATES
-            PENDING_UPDATES.append(msg)
-            print(f"   [InventoryPoller] Inventory pus în coadă. Size = {len(PENDING_UPDATES)}")
+            if apply_inventory_changes(data):
+                enqueue_update(inventory_snapshot())
+                log.debug("inventory poller: inventory pus in coada", version=INVENTORY_VERSION,
+                          changes=len(data.get("changes", [])))
 
         except Exception as e:
-            print(f"❌ [InventoryPoller] Eroare la request inventory: {e}")
+            log.error("inventory poller: eroare la request inventory", error=str(e))
 
         time.sleep(10)  # așteaptă 10 secunde
 
@@ -67,56 +232,88 @@ def inventory_poller():
 # --- 1. PRIMIM DE LA REACT -> TRIMITEM LA ORCHESTRATOR ---
 @app.route('/api/chat', methods=['POST'])
 def handle_chat():
+    # Aici incepe trace-ul unui mesaj; id-ul merge mai departe prin header X-Trace-Id
+    trace_id = tracing.new_trace_id()
+    with tracing.use_trace(trace_id, service="proxy"), tracing.span("POST /api/chat", kind="server"):
+        return _handle_chat(trace_id)
+
+
+def _handle_chat(trace_id):
     try:
         data = request.json or {}
-        print("\n=================== /api/chat ===================")
-        print(f"1️⃣ [Proxy] Primit de la React: {json.dumps(data, ensure_ascii=False)}")
+        log.debug("/api/chat primit de la React", data=data)
 
         user_message = data.get("message", "")
         context = data.get("context", {}) or {}
 
         if not user_message:
-            print("⚠️ [Proxy] Nu exista campul 'message' sau este gol.")
+            log.warning("/api/chat fara camp 'message'")
             return jsonify({"error": "missing 'message' field"}), 400
 
         orchestrator_payload = {
             "msg": user_message,
-            "context": context
+            "context": context,
+            "trace_id": trace_id
         }
 
-        print(f"2️⃣ [Proxy] Forwarding catre Orchestrator ({TARGET_URL}) cu payload:")
-        print(f"   {json.dumps(orchestrator_payload, ensure_ascii=False)}")
+        log.info("forward catre orchestrator", url=TARGET_URL, session_id=context.get("session_id"),
+                 message_chars=len(user_message))
 
         try:
-            resp = requests.post(TARGET_URL, json=orchestrator_payload, timeout=15)
-            print(f"3️⃣ [Proxy] Raspuns HTTP de la Orchestrator: {resp.status_code}")
+            with tracing.span("POST orchestrator/text", kind="http"):
+                resp = requests.post(TARGET_URL, json=orchestrator_payload, timeout=ORCHESTRATOR_TIMEOUT,
+                                     headers=tracing.inject_headers())
             try:
-                print(f"   Body JSON: {resp.json()}")
+                body = resp.json()
             except Exception:
-                print(f"   Body (raw): {resp.text[:500]}")
+                body = {}
+                log.warning("orchestrator a raspuns non-JSON", status=resp.status_code, body=resp.text)
         except Exception as e:
-            print(f"❌ [Proxy] Eroare la POST catre Orchestrator ({TARGET_URL}): {e}")
+            log.error("eroare la POST catre orchestrator", url=TARGET_URL, error=str(e))
             return jsonify({"error": "orchestrator unreachable"}), 502
 
+        if resp.status_code == 503:
+            # coada orchestratorului e plina -> UI poate reincerca
+            return jsonify({"error": "orchestrator busy"}), 503, {"Retry-After": resp.headers.get("Retry-After", "2")}
+
         # ACK simplu către React; răspunsul real vine async prin /from_orchestrator sau /internal/receive
-        return jsonify({"status": "sent_to_orchestrator"})
+        return jsonify({"status": "sent_to_orchestrator", "job_id": body.get("job_id"), "trace_id": trace_id})
 
     except Exception as e:
-        print(f"❌ [Proxy] Eroare in handle_chat: {e}")
+        log.exception("eroare in handle_chat")
         return jsonify({"error": str(e)}), 500
 
 
+# --- 1b. STATUS JOB ORCHESTRATOR ---
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    try:
+        resp = requests.get(f"{ORCHESTRATOR_JOBS_URL}/{job_id}", timeout=ORCHESTRATOR_TIMEOUT)
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        log.error("eroare la GET job", job_id=job_id, error=str(e))
+        return jsonify({"error": "orchestrator unreachable"}), 502
+
+
+# --- 1c. WATERFALL PENTRU UN TRACE (acelasi db/traces.db ca orchestratorul) ---
+@app.route('/api/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    trace = tracing.waterfall(trace_id)
+    if trace is None:
+        return jsonify({"error": "unknown trace_id"}), 404
+    return jsonify(trace), 200
+
+
 # --- 2. PRIMIM DE LA ORCHESTRATOR (chatbox_response sau data_update) -> NORMALIZAM -> COADA ---
 @app.route('/from_orchestrator', methods=['POST'])
 def from_orchestrator():
-    global PENDING_UPDATES
     try:
         data = request.json or {}
-        print("\n=================== /from_orchestrator ===================")
-        print(f"3️⃣ [Proxy] Primit de la Orchestrator: {json.dumps(data, ensure_ascii=False)}")
+        log.debug("/from_orchestrator primit", type=data.get("type"), session_id=data.get("session_id"))
 
         msg_type = data.get("type")
         sender = data.get("sender", "ai")
+        session_id = data.get("session_id")
 
         if msg_type == "chatbox_response":
             text = data.get("text", "")
@@ -125,68 +322,59 @@ def from_orchestrator():
                 "type": "chat_message",
                 "payload": {
                     "text": text,
-                    "sender": sender
+                    "sender": sender,
+                    "session_id": session_id
                 }
             }
-            print(f"   🔄 Normalized to chat_message: {json.dumps(normalized, ensure_ascii=False)}")
-            PENDING_UPDATES.append(normalized)
+            enqueue_update(normalized, session_id)
+        elif msg_type == "chatbox_delta":
+            queue_chat_delta(data, sender)
         elif msg_type == "data_update":
             payload = data.get("payload", {})
             category = payload.get("category")
-            print(f"   🔄 Data update received. Category={category}")
-            PENDING_UPDATES.append({
+            log.debug("data_update primit", category=category)
+            enqueue_update({
                 "type": "data_update",
                 "payload": payload
-            })
+            }, session_id)
         else:
-            print("   ℹ️ Tip necunoscut, il punem brut in coada.")
-            PENDING_UPDATES.append(data)
+            log.info("tip necunoscut, il punem brut in coada", type=msg_type)
+            enqueue_update(data, session_id)
 
-        print(f"   [Proxy] PENDING_UPDATES size = {len(PENDING_UPDATES)}")
         return "", 204
 
     except Exception as e:
-        print(f"❌ [Proxy] Eroare in /from_orchestrator: {e}")
+        log.exception("eroare in /from_orchestrator")
         return jsonify({"error": str(e)}), 500
 
 
 # --- 3. ENDPOINT GENERIC (optional) ---
 @app.route('/internal/receive', methods=['POST'])
 def receive_internal():
-    global PENDING_UPDATES
     try:
         data = request.json or {}
-        print("\n=================== /internal/receive ===================")
-        print(f"📦 [Proxy] Primit generic async: {json.dumps(data, ensure_ascii=False)}")
+        log.debug("/internal/receive primit", type=data.get("type"))
 
-        PENDING_UPDATES.append(data)
-        print(f"   [Proxy] PENDING_UPDATES size = {len(PENDING_UPDATES)}")
+        enqueue_update(data, data.get("session_id"))
         return jsonify({"status": "queued"})
     except Exception as e:
-        print(f"❌ [Proxy] Eroare in /internal/receive: {e}")
+        log.exception("eroare in /internal/receive")
         return jsonify({"error": str(e)}), 500
 
 
 # --- 4. REACT CERE NOUTATI (POLLING) ---
 @app.route('/api/updates', methods=['GET'])
 def get_updates():
-    global PENDING_UPDATES
-    print("\n=================== /api/updates ===================")
-    if PENDING_UPDATES:
-        to_send = list(PENDING_UPDATES)
-        PENDING_UPDATES.clear()
-        print(f"4️⃣ [Proxy] Livrez {len(to_send)} mesaje catre React.")
-        print(f"   📦 {json.dumps(to_send, ensure_ascii=False)}")
-        return jsonify({"updates": to_send})
-
-    print("4️⃣ [Proxy] Niciun mesaj nou pentru React.")
-    return jsonify({"updates": []})
+    # fiecare tab trimite ?session_id=...; clientii vechi, fara el, sunt sesiunea "default"
+    session_id = request.args.get("session_id") or DEFAULT_SESSION_ID
+    to_send = drain_updates(session_id)
+    if to_send:
+        log.debug("livrez mesaje catre React", count=len(to_send), session_id=session_id)
+    return jsonify({"updates": to_send})
 
 
 if __name__ == '__main__':
-    print(f"🚀 PROXY pornit pe {PROXY_HOST}:{PROXY_PORT}")
-    print(f"🔗 Target setat la: {TARGET_URL}")
-    print(f"📦 Inventory URL: {INVENTORY_URL}")
+    log.info("proxy pornit", host=PROXY_HOST, port=PROXY_PORT, target=TARGET_URL, inventory_url=INVENTORY_URL)
 
     # Pornim poller-ul de inventory într-un thread separat
     t = threading.Thread(target=inventory_poller, daemon=True)
@@ -41,6 +41,25 @@ export const BusinessProvider = ({ children }) => {
 		}]);
 	};
 
+	// Helper pentru mesaje streamate (chat_message cu stream_id):
+	// lipim delta-urile in acelasi mesaj; la final textul complet il inlocuieste
+	const appendChatDelta = ({ stream_id, text = '', final_text, sender = 'ai' }) => {
+		setChatMessages(prev => {
+			const idx = prev.findIndex(m => m.streamId === stream_id);
+			if (idx === -1) {
+				return [...prev, {
+					id: Date.now() + Math.random(),
+					streamId: stream_id,
+					text: final_text ?? text,
+					sender
+				}];
+			}
+			const updated = [...prev];
+			updated[idx] = { ...updated[idx], text: final_text ?? (updated[idx].text + text) };
+			return updated;
+		});
+	};
+
 
 	// ==========================================
 	// 2. INITIALIZARI & EFECTE
@@ -113,7 +132,11 @@ export const BusinessProvider = ({ children }) => {
 						// CAZUL 2: Mesaj Chat
 						if (packet.type === 'chat_message') {
 							console.log("💬 [UI] Mesaj Chat:", packet.payload.text);
-							addChatMessage(packet.payload.text, 'ai');
+							if (packet.payload.stream_id) {
+								appendChatDelta(packet.payload);
+							} else {
+								addChatMessage(packet.payload.text, 'ai');
+							}
 						}
 
 						// CAZUL 3: NOTIFICARE (AICI E MODIFICAREA!)
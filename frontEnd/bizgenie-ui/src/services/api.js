@@ -15,6 +15,16 @@ const api = axios.create({
 
 const delay = (ms) => new Promise(resolve => setTimeout(resolve, ms));
 
+// Id de sesiune per tab: orchestratorul tine contextul conversatiei separat pe sesiune
+const getSessionId = () => {
+  let id = sessionStorage.getItem('bizgenie_session_id');
+  if (!id) {
+    id = (crypto.randomUUID && crypto.randomUUID()) || `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    sessionStorage.setItem('bizgenie_session_id', id);
+  }
+  return id;
+};
+
 export const BusinessService = {
   // 1. Date simulate pentru Dashboard (la încărcare)
   getBusinessData: async () => {
@@ -28,7 +38,7 @@ export const BusinessService = {
       // Trimitem la ruta /chat a proxy-ului
       const response = await api.post(`/chat`, {
         message: message,
-        context: contextData
+        context: { ...(contextData || {}), session_id: getSessionId() }
       });
       return response.data;
     } catch (error) {
@@ -40,8 +50,8 @@ export const BusinessService = {
   // 3. VERIFICARE ACTUALIZĂRI (Polling) - ASTA LIPSEA!
   checkUpdates: async () => {
     try {
-      // Cerem noutățile de la Proxy
-      const response = await api.get(`/updates`);
+      // Cerem noutățile de la Proxy (doar cele pentru sesiunea acestui tab + cele comune)
+      const response = await api.get(`/updates`, { params: { session_id: getSessionId() } });
       
       // Proxy-ul returnează { updates: [...] }
       // Trebuie să returnăm array-ul, sau array gol dacă nu e nimic
@@ -0,0 +1,111 @@
+# job_queue.py
+"""
+Bounded work queue with a fixed pool of worker threads.
+
+Used by the orchestrator so that /text only enqueues the message and
+returns a job id; throughput under bursts is then set by the number of
+workers, not by how long the HTTP caller is willing to wait.
+
+Job lifecycle: queued -> running -> done | failed. Finished jobs are kept
+(for /jobs/<id>) up to `keep_finished` entries, oldest dropped first.
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from log import get_logger
+
+log = get_logger("job_queue")
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when the backlog is at max_queue."""
+
+
+class JobQueue:
+    def __init__(self, name: str, workers: int = 4, max_queue: int = 100, keep_finished: int = 1000):
+        self.name = name
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.counters = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"{name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> str:
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+                self.counters["rejected"] += 1
+            raise QueueFull(f"{self.name}: {self.max_queue} jobs already queued")
+
+        with self._lock:
+            self.counters["submitted"] += 1
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            running = sum(1 for j in self._jobs.values() if j["status"] == "running")
+            out = dict(self.counters)
+        out["queued"] = self._queue.qsize()
+        out["running"] = running
+        out["workers"] = len(self._threads)
+        return out
+
+    def _worker(self):
+        while True:
+            job_id, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                job = self._jobs[job_id]
+                job["status"] = "running"
+                job["started_at"] = time.time()
+            try:
+                result = fn(*args, **kwargs)
+                status, error = "done", None
+            except Exception as e:
+                log.exception("job failed", queue=self.name, job_id=job_id)
+                result, status, error = None, "failed", str(e)
+
+            with self._lock:
+                job["status"] = status
+                job["result"] = result
+                job["error"] = error
+                job["finished_at"] = time.time()
+                self.counters[status] += 1
+
+                self._finished[job_id] = None
+                while len(self._finished) > self.keep_finished:
+                    old_id, _ = self._finished.popitem(last=False)
+                    self._jobs.pop(old_id, None)
+            self._queue.task_done()
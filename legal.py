@@ -2,14 +2,31 @@
 from comms import send_json_to_service
 from flask import Flask, request, jsonify
 import json
-import threading
+import os
 
 from ai_wrapper import generate_reply  # your wrapper: (system_prompt, user_prompt) -> str
+from dispatch_pool import BoundedExecutor
+import metrics
+import tracing
 
 app = Flask(__name__)
 SERVICE_NAME = "legal"
+tracing.instrument_flask(app, SERVICE_NAME)
+metrics.instrument_flask(app, SERVICE_NAME)
 DEEP_RESEARCH_MODEL = "openai/gpt-4.1"
 LEGAL_DEBUG_PATH = "legal_latest.json"
+# Research on the same subject/context is reused for a day (llm_cache)
+RESEARCH_CACHE_TTL = 24 * 60 * 60
+
+# Research jobs run on a small fixed pool; beyond the queue limit /input answers 503
+RESEARCH_POOL = BoundedExecutor(
+    "legal-research",
+    workers=int(os.getenv("LEGAL_RESEARCH_WORKERS", "2")),
+    max_queue=int(os.getenv("LEGAL_RESEARCH_QUEUE", "20")),
+    default_limit=2,
+)
+metrics.gauge("legal_research_jobs", "Legal research jobs by state", ["state"],
+              fn=lambda: {(k,): RESEARCH_POOL.stats()[k] for k in ("queued", "running")})
 
 TRUSTED_SOURCES = [
     "legislatie.just.ro",
@@ -135,7 +152,7 @@ def _persist_latest_result(payload: dict):
         print(f"[{SERVICE_NAME}] Failed to persist debug JSON: {e}")
 
 
-def _run_research(subject: str, context: dict):
+def _run_research(subject: str, context: dict, session_id: str = None):
     global LATEST_RESEARCH_RESULT
     try:
         user_prompt = _build_user_prompt(subject, context)
@@ -144,12 +161,17 @@ def _run_research(subject: str, context: dict):
             user_prompt,
             model=DEEP_RESEARCH_MODEL,
             temperature=0.3,
-            max_tokens=1500
+            max_tokens=1500,
+            cache_ttl=RESEARCH_CACHE_TTL,
         )
         parsed = _parse_or_fallback(research_text, subject, context)
         LATEST_RESEARCH_RESULT = parsed
         print(f"[{SERVICE_NAME}] Parsed research JSON:\n{json.dumps(parsed, ensure_ascii=False, indent=2)}")
         _persist_latest_result(parsed)
+        if tracing.current_trace_id():
+            parsed["trace_id"] = tracing.current_trace_id()
+        if session_id:
+            parsed["session_id"] = session_id  # the orchestrator routes the result to this tab
         send_json_to_service("orchestrator", "/legal_recieve", parsed)
     except Exception as e:
         print(f"[{SERVICE_NAME}] Deep research error: {e}")
@@ -157,7 +179,9 @@ def _run_research(subject: str, context: dict):
             "service": SERVICE_NAME,
             "subject": subject,
             "context": context,
-            "error": str(e)
+            "error": str(e),
+            "trace_id": tracing.current_trace_id(),
+            "session_id": session_id
         }
         LATEST_RESEARCH_RESULT = error_payload
         _persist_latest_result(error_payload)
@@ -172,9 +196,17 @@ def handle_input():
     legal_section = full_payload.get("legal", {})
     subject = legal_section.get("subject", "")
     context = legal_section.get("context", {})
+    session_id = full_payload.get("session_id")
 
-    t = threading.Thread(target=_run_research, args=(subject, context), daemon=True)
-    t.start()
+    if not RESEARCH_POOL.submit("research", tracing.bind(_run_research, "legal research"),
+                                subject, context, session_id):
+        busy = {
+            "service": SERVICE_NAME,
+            "subject": subject,
+            "status": "busy",
+            "error": "research queue is full, retry later"
+        }
+        return jsonify(busy), 503, {"Retry-After": "10"}
 
     ack = {
         "service": SERVICE_NAME,
@@ -196,7 +228,7 @@ def latest():
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"service": SERVICE_NAME, "status": "ok"}), 200
+    return jsonify({"service": SERVICE_NAME, "status": "ok", "research": RESEARCH_POOL.stats()}), 200
 
 
 if __name__ == "__main__":
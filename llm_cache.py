@@ -0,0 +1,232 @@
+# llm_cache.py
+"""
+Opt-in response cache for LLM calls.
+
+Two tiers:
+- in-memory LRU (per process, bounded by LLM_CACHE_MEMORY_ITEMS)
+- SQLite (shared by all local services, survives restarts,
+  bounded by LLM_CACHE_DISK_ITEMS, least recently used rows are evicted)
+
+Callers opt in per call by passing a TTL in seconds; there is no default TTL.
+Keys are built from model, system prompt, user prompt and temperature.
+Set LLM_CACHE_ENABLED=0 to bypass the cache everywhere.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import metrics
+from log import get_logger
+
+log = get_logger("llm_cache")
+
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", BASE_DIR / "db" / "llm_cache.db"))
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256"))
+DISK_ITEMS = int(os.getenv("LLM_CACHE_DISK_ITEMS", "5000"))
+
+# Prune the SQLite tier every N writes instead of on every insert
+PRUNE_EVERY = 50
+
+
+def make_key(model: str, system_prompt: Optional[str], user_prompt: str,
+             temperature: Optional[float], **extra) -> str:
+    parts = [model, system_prompt, user_prompt, temperature, sorted(extra.items())]
+    raw = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: Path = CACHE_PATH,
+                 memory_items: int = MEMORY_ITEMS, disk_items: int = DISK_ITEMS):
+        self.path = Path(path)
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+    # ---------- SQLite tier ----------
+
+    def _db(self) -> sqlite3.Connection:
+        # caller holds self._lock
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key          TEXT PRIMARY KEY,
+                    value        TEXT NOT NULL,
+                    expires_at   REAL NOT NULL,
+                    last_access  REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        cur = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        evicted = cur.rowcount
+        cur = conn.execute(
+            """
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.disk_items,),
+        )
+        evicted += cur.rowcount
+        self.stats["evictions"] += max(evicted, 0)
+
+    # ---------- memory tier ----------
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # ---------- public API ----------
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return hit[1]
+                del self._memory[key]
+
+            try:
+                conn = self._db()
+                row = conn.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+            except sqlite3.Error as e:
+                log.warning("sqlite read failed", error=str(e))
+                row = None
+
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            self.stats["disk_hits"] += 1
+            self._remember(key, row[1], row[0])
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        expires_at = now + ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self.stats["writes"] += 1
+            try:
+                conn = self._db()
+                conn.execute(
+                    """
+                    INSERT INTO llm_cache (key, value, expires_at, last_access)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        value = excluded.value,
+                        expires_at = excluded.expires_at,
+                        last_access = excluded.last_access
+                    """,
+                    (key, value, expires_at, now),
+                )
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    self._prune(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                log.warning("sqlite write failed", error=str(e))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            try:
+                conn = self._db()
+                conn.execute("DELETE FROM llm_cache")
+                conn.commit()
+            except sqlite3.Error as e:
+                log.warning("sqlite clear failed", error=str(e))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.stats)
+            out["memory_size"] = len(self._memory)
+        lookups = out["memory_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_rate"] = (out["memory_hits"] + out["disk_hits"]) / lookups if lookups else 0.0
+        return out
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def _cache_metrics() -> dict:
+    # read at scrape time; no cache object is created just for /metrics
+    if _cache is None:
+        return {}
+    stats = _cache.snapshot()
+    return {(event,): stats[event] for event in ("memory_hits", "disk_hits", "misses", "writes", "evictions")}
+
+
+metrics.counter("llm_cache_events_total", "LLM response cache lookups and writes", ["event"], fn=_cache_metrics)
+metrics.gauge("llm_cache_hit_ratio", "LLM response cache hit rate since start",
+              fn=lambda: _cache.snapshot()["hit_rate"] if _cache is not None else 0.0)
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
+
+
+def cache_get(key: str, ttl: Optional[float]) -> Optional[str]:
+    """Returns the cached value, or None when missing or when the caller did not opt in."""
+    if not CACHE_ENABLED or not ttl:
+        return None
+    return get_cache().get(key)
+
+
+def cache_set(key: str, value: str, ttl: Optional[float]) -> None:
+    if not CACHE_ENABLED or not ttl:
+        return
+    get_cache().set(key, value, ttl)
+
+
+def cache_stats() -> dict:
+    return get_cache().snapshot()
@@ -0,0 +1,297 @@
+# llm_gateway.py
+"""
+Shared OpenRouter client used by ai_wrapper, the finance LLM client and the
+inventory agent.
+
+- One keep-alive requests.Session per process (pooled connections, so TLS is
+  negotiated once instead of on every call).
+- Connect/read timeouts on every call.
+- Retries with jittered exponential backoff on 429 / 5xx and network errors.
+- Per-call model and temperature.
+- Optional token streaming (OpenRouter SSE) via stream_chat_completion().
+"""
+import os
+import random
+import threading
+import time
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+from log import get_logger
+
+log = get_logger("llm_gateway")
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+DEFAULT_MODEL = "openai/gpt-4.1-mini"
+
+# Read env vars once at import
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+BACKOFF_BASE = 0.5   # seconds
+BACKOFF_MAX = 8.0    # seconds
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+LLM_REQUESTS = metrics.counter("llm_requests_total", "LLM completions by outcome", ["model", "mode", "status"])
+LLM_LATENCY = metrics.histogram("llm_request_duration_seconds", "LLM completion latency (streams: until the last token)",
+                                ["model", "mode"])
+LLM_TOKENS = metrics.counter("llm_tokens_total", "Tokens reported in OpenRouter usage", ["model", "type"])
+LLM_RETRIES = metrics.counter("llm_retries_total", "Retried LLM requests", ["reason"])
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide pooled session, creating it on first use
+    (and again after a fork, since sockets must not be shared).
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def _backoff_delay(attempt: int, resp: Optional[requests.Response] = None) -> float:
+    """Full-jitter exponential backoff; honours a numeric Retry-After header."""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _build_request(
+    messages: List[Dict[str, str]],
+    model: Optional[str],
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    title: str,
+    referer: str,
+    stream: bool = False,
+):
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY not set or empty.")
+
+    headers = {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json",
+        # Optional for OpenRouter analytics
+        "HTTP-Referer": referer,
+        "X-Title": title,
+    }
+
+    payload: Dict[str, Any] = {
+        "model": model or DEFAULT_MODEL,
+        "messages": messages,
+    }
+    if temperature is not None:
+        payload["temperature"] = temperature
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    if stream:
+        payload["stream"] = True
+        # OpenRouter then sends token usage in the last chunk
+        payload["usage"] = {"include": True}
+
+    return headers, payload
+
+
+def _record_usage(model: str, usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.inc(tokens, model=model, type=kind)
+
+
+def _post_with_retries(
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    timeout: Optional[float],
+    stream: bool = False,
+) -> requests.Response:
+    """
+    POST to OpenRouter, retrying network errors and 429/5xx with jittered
+    backoff. Only the request itself is retried; a streamed body that
+    breaks half-way is not replayed.
+    """
+    req_timeout = (CONNECT_TIMEOUT, timeout or READ_TIMEOUT)
+    session = get_session()
+
+    attempt = 0
+    while True:
+        try:
+            resp = session.post(OPENROUTER_URL, json=payload, headers=headers,
+                                timeout=req_timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt)
+            LLM_RETRIES.inc(reason=type(e).__name__)
+            log.warning("llm request failed, retrying", error=type(e).__name__,
+                        attempt=attempt + 1, max_retries=MAX_RETRIES, delay=round(delay, 2))
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        if resp.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+            delay = _backoff_delay(attempt, resp)
+            LLM_RETRIES.inc(reason=str(resp.status_code))
+            log.warning("llm request failed, retrying", status=resp.status_code,
+                        attempt=attempt + 1, max_retries=MAX_RETRIES, delay=round(delay, 2))
+            resp.close()
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        if not resp.ok:
+            log.error("llm request failed", status=resp.status_code, body=resp.text)
+            resp.raise_for_status()
+
+        return resp
+
+
+def chat_completion(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    title: str = "BizzGenie",
+    referer: str = "http://localhost",
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Send a chat completion request and return the decoded JSON body.
+    Raises RuntimeError without an API key and requests.HTTPError once
+    retries are exhausted.
+    """
+    headers, payload = _build_request(messages, model, temperature, max_tokens, title, referer)
+    model = payload["model"]
+    start = time.perf_counter()
+    status = "error"
+    try:
+        with tracing.span("llm chat_completion", kind="llm", model=model, title=title) as sp:
+            resp = _post_with_retries(headers, payload, timeout)
+            data = resp.json()
+            if data.get("usage"):
+                sp.set(usage=data["usage"])
+        _record_usage(model, data.get("usage"))
+        status = "ok"
+        return data
+    finally:
+        LLM_REQUESTS.inc(model=model, mode="complete", status=status)
+        LLM_LATENCY.observe(time.perf_counter() - start, model=model, mode="complete")
+
+
+def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    title: str = "BizzGenie",
+    referer: str = "http://localhost",
+    timeout: Optional[float] = None,
+) -> Iterator[str]:
+    """
+    Same request as chat_completion with "stream": true. Yields content
+    deltas as OpenRouter sends them (server-sent events).
+    """
+    headers, payload = _build_request(messages, model, temperature, max_tokens, title, referer, stream=True)
+    model = payload["model"]
+    start = time.perf_counter()
+    status = "error"
+    usage: Dict[str, Any] = {}
+    try:
+        with tracing.span("llm stream_chat_completion", kind="llm", model=model, title=title) as sp:
+            yield from _iter_stream(_post_with_retries(headers, payload, timeout, stream=True), usage)
+            if usage:
+                sp.set(usage=usage)
+        _record_usage(model, usage)
+        status = "ok"
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    finally:
+        LLM_REQUESTS.inc(model=model, mode="stream", status=status)
+        LLM_LATENCY.observe(time.perf_counter() - start, model=model, mode="stream")
+
+
+def _iter_stream(resp: requests.Response, usage: Dict[str, Any]) -> Iterator[str]:
+    """Yields content deltas; fills `usage` from the final chunk when present."""
+    try:
+        for line in resp.iter_lines():
+            # SSE: "data: {...}" lines; ": comment" keep-alives; blank separators
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+
+            event = json.loads(data)
+            if "error" in event:
+                raise RuntimeError(f"OpenRouter stream error: {event['error']}")
+            if event.get("usage"):
+                usage.update(event["usage"])
+            for choice in event.get("choices", []):
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield text
+    finally:
+        resp.close()
+
+
+def complete(
+    system_prompt: Optional[str],
+    user_prompt: str,
+    **kwargs: Any,
+) -> str:
+    """
+    Convenience wrapper: system + user message in, first choice content out.
+    Accepts the same keyword arguments as chat_completion.
+    """
+    messages = []
+    if system_prompt is not None:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": user_prompt})
+
+    data = chat_completion(messages, **kwargs)
+    return data["choices"][0]["message"]["content"]
+
+
+def complete_stream(
+    system_prompt: Optional[str],
+    user_prompt: str,
+    **kwargs: Any,
+) -> Iterator[str]:
+    """Streaming counterpart of complete(); yields text deltas."""
+    messages = []
+    if system_prompt is not None:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": user_prompt})
+
+    yield from stream_chat_completion(messages, **kwargs)
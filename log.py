@@ -0,0 +1,177 @@
+# log.py
+"""
+Shared logging setup: leveled, structured, non-blocking.
+
+    from log import get_logger
+    log = get_logger("inventory")
+    log.info("actions applied", count=3, llm_used=False)
+    log.debug("final response", response=final)   # skipped cheaply unless LOG_LEVEL=DEBUG
+
+- records are put on a bounded in-memory queue by the calling thread and
+  written by one background listener, so request threads never wait on
+  terminal / file I/O (when the queue is full the record is dropped and
+  counted instead of blocking)
+- one JSON object per line (LOG_FORMAT=text for a human-readable line)
+- keyword fields are serialized in the listener and truncated to
+  LOG_MAX_FIELD chars; fields that look like secrets are masked
+- the active trace id (tracing.py) is attached to every record
+
+Env: LOG_LEVEL (INFO), LOG_FORMAT (json), LOG_MAX_FIELD (500), LOG_QUEUE_SIZE (10000).
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+MAX_FIELD = int(os.getenv("LOG_MAX_FIELD", "500"))
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "bizzgenie"
+SECRET_MARKERS = ("api_key", "apikey", "authorization", "password", "secret", "token")
+
+dropped = 0
+
+_setup_lock = threading.Lock()
+_listener = None
+
+
+def truncate(value: Any, limit: int = MAX_FIELD) -> Any:
+    """Scalars pass through; strings and containers are capped at `limit` chars."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) <= limit:
+        return value if isinstance(value, str) else json.loads(text)
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+
+def _is_secret(key: str) -> bool:
+    key = key.lower()
+    # token counts (prompt_tokens, ...) are not secrets
+    return any(m in key for m in SECRET_MARKERS) and not key.endswith("tokens")
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # keep the structured fields; only resolve what depends on the calling thread
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.trace_id = tracing.current_trace_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            out["trace_id"] = record.trace_id
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            out[key] = "***" if _is_secret(key) else truncate(value)
+        if record.exc_text:
+            out["exc"] = truncate(record.exc_text, 4 * MAX_FIELD)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        ts = datetime.datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        parts = [f"{ts} {record.levelname:<7} [{record.name}] {record.getMessage()}"]
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            value = "***" if _is_secret(key) else truncate(value)
+            parts.append(f"{key}={value}")
+        line = " ".join(parts)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None) -> None:
+    """Idempotent; get_logger() calls it on first use."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        sink = logging.StreamHandler(stream or sys.stdout)
+        sink.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+
+        q: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers[:] = [_NonBlockingQueueHandler(q)]
+        root.setLevel(level)
+        root.propagate = False
+
+        _listener = QueueListener(q, sink, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class StructLogger:
+    """Thin wrapper so call sites can pass fields as keyword arguments."""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def is_enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, msg: str, exc_info=None, **fields: Any) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg: str, **fields: Any) -> None:
+        self._log(logging.INFO, msg, **fields)
+
+    def warning(self, msg: str, **fields: Any) -> None:
+        self._log(logging.WARNING, msg, **fields)
+
+    def error(self, msg: str, **fields: Any) -> None:
+        self._log(logging.ERROR, msg, **fields)
+
+    def exception(self, msg: str, **fields: Any) -> None:
+        self._log(logging.ERROR, msg, exc_info=True, **fields)
+
+
+def get_logger(name: str, level: str = None) -> StructLogger:
+    """level overrides LOG_LEVEL for this logger only (e.g. a module's debug switch)."""
+    setup_logging()
+    logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+    if level:
+        logger.setLevel(level.upper())
+    return StructLogger(logger)
@@ -0,0 +1,261 @@
+# metrics.py
+"""
+Minimal Prometheus-style metrics shared by all services.
+
+    REQUESTS = metrics.counter("x_total", "help", ["route"])
+    REQUESTS.inc(route="/text")
+    LATENCY = metrics.histogram("x_seconds", "help", ["route"])
+    with LATENCY.time(route="/text"):
+        ...
+    metrics.gauge("queue_depth", "help", fn=lambda: len(QUEUE))
+
+Counters and gauges can also be backed by a callback (fn) that is read at
+scrape time, for numbers that already live somewhere else (queue sizes,
+cache stats). fn returns a number, or a dict {label values tuple: number}.
+
+instrument_flask / instrument_fastapi add per-route request counters and
+latency histograms, and serve everything at GET /metrics in the text
+exposition format. Registering the same name twice returns the existing
+metric, so modules can declare their metrics at import time.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# seconds; covers SQLite calls (ms) up to slow LLM completions (tens of s)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: Dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 fn: Optional[Callable] = None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[n] for n in self.labelnames)
+
+    def _samples(self) -> List[Tuple[Tuple, float]]:
+        if self.fn is not None:
+            value = self.fn()
+            if isinstance(value, dict):
+                return sorted(value.items())
+            return [((), value)]
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._data: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                data = self._data[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(self.buckets)] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._data.items())
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(data[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _register(cls, name: str, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"metric {name} already registered as {metric.kind}")
+        return metric
+
+
+def counter(name: str, help_text: str, labelnames: Iterable[str] = (), fn: Optional[Callable] = None) -> Counter:
+    return _register(Counter, name, help_text, labelnames, fn=fn)
+
+
+def gauge(name: str, help_text: str, labelnames: Iterable[str] = (), fn: Optional[Callable] = None) -> Gauge:
+    """With fn, an existing gauge keeps its first callback (first registration wins)."""
+    return _register(Gauge, name, help_text, labelnames, fn=fn)
+
+
+def histogram(name: str, help_text: str, labelnames: Iterable[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines: List[str] = []
+    for metric in metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            # a broken callback must not take the whole scrape down
+            lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- shared metrics ----------
+
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests handled",
+                        ["service", "method", "route", "status"])
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency",
+                         ["service", "method", "route"])
+DB_LATENCY = histogram("sqlite_query_duration_seconds", "Time spent in SQLite helper functions",
+                       ["db", "query"])
+
+
+def timed_query(db: str):
+    """Decorator for db/* helpers: records their duration in sqlite_query_duration_seconds."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with DB_LATENCY.time(db=db, query=fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------- web framework hooks ----------
+
+def instrument_flask(app, service: str) -> None:
+    """Per-route request count / latency, plus GET /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            # route template (/jobs/<job_id>), not the raw path, to keep label cardinality low
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - start,
+                                 service=service, method=request.method, route=route)
+            HTTP_REQUESTS.inc(service=service, method=request.method, route=route,
+                              status=str(response.status_code))
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+
+def instrument_fastapi(app, service: str) -> None:
+    from fastapi import Response
+
+    @app.middleware("http")
+    async def _metrics_middleware(request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_LATENCY.observe(time.perf_counter() - start,
+                             service=service, method=request.method, route=route)
+        HTTP_REQUESTS.inc(service=service, method=request.method, route=route,
+                          status=str(response.status_code))
+        return response
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return Response(render(), media_type=CONTENT_TYPE)
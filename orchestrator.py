@@ -1,17 +1,68 @@
 from flask import Flask, request, jsonify
-from threading import Thread
-from comms import send_json_to_service, SERVICE_URLS
+from comms import send_json_to_service, post_json, get_client, service_stats
 import time
-from ai_wrapper import generate_reply
+from ai_wrapper import generate_reply, generate_reply_stream
+from plan_stream import PlanStreamParser
+from session_store import SessionStore, DEFAULT_SESSION_ID
+from job_queue import JobQueue, QueueFull
+from dispatch_pool import BoundedExecutor
+from outbox import Outbox
+import metrics
+import tracing
+from log import get_logger
 import json
+import os
+import uuid
 import requests
 
 app = Flask(__name__)
+log = get_logger("orchestrator")
+tracing.instrument_flask(app, "orchestrator")
+metrics.instrument_flask(app, "orchestrator")
 
 LANGUAGE = "ROMANIAN"
 previous_answererd = True
 
-USER_RESPONSE_STACK = []
+# Conversation context per session_id (passed by the proxy in `context`)
+SESSIONS = SessionStore()
+
+# /text only enqueues; these workers run parse_main_request_data
+ORCH_WORKERS = int(os.getenv("ORCH_WORKERS", "4"))
+ORCH_QUEUE_SIZE = int(os.getenv("ORCH_QUEUE_SIZE", "100"))
+JOBS = JobQueue("orchestrator", workers=ORCH_WORKERS, max_queue=ORCH_QUEUE_SIZE)
+
+# Fire-and-forget sends to agents: fixed pool, per-agent concurrency limits
+DISPATCHER = BoundedExecutor(
+    "orchestrator-dispatch",
+    workers=int(os.getenv("ORCH_DISPATCH_WORKERS", "8")),
+    max_queue=int(os.getenv("ORCH_DISPATCH_QUEUE", "200")),
+    limits={"inventory": 4, "legal": 2, "finance": 2, "financial": 2},
+    overflow=os.getenv("ORCH_DISPATCH_OVERFLOW", "reject"),
+)
+
+# Inventory / finance commands: persisted first, delivered (batched, retried) in the background
+OUTBOX_SEND_TIMEOUT = 60
+
+
+def _outbox_send(service_name: str, endpoint: str, payload: dict, headers: dict):
+    return post_json(service_name, endpoint, payload, timeout=OUTBOX_SEND_TIMEOUT, headers=headers)
+
+
+OUTBOX = Outbox(sender=_outbox_send)
+
+# queue depths, read at scrape time
+metrics.gauge("orchestrator_jobs", "Orchestrator /text jobs by state", ["state"],
+              fn=lambda: {(k,): JOBS.stats()[k] for k in ("queued", "running")})
+metrics.gauge("dispatch_tasks", "Agent dispatches by destination and state", ["destination", "state"],
+              fn=lambda: {(dest, state): d[state]
+                          for dest, d in DISPATCHER.stats()["destinations"].items()
+                          for state in ("queued", "running")})
+metrics.counter("dispatch_tasks_total", "Agent dispatch outcomes", ["outcome"],
+                fn=lambda: {(k,): DISPATCHER.stats()[k] for k in ("completed", "failed", "rejected", "dropped")})
+metrics.gauge("outbox_commands", "Outbox commands by state", ["state"],
+              fn=lambda: {("pending",): OUTBOX.stats()["pending"], ("dead",): OUTBOX.stats()["dead_letter"]})
+metrics.gauge("orchestrator_sessions", "Conversation sessions held in memory",
+              fn=lambda: SESSIONS.stats()["sessions"])
 
 SERVICE_NAME = "orchestrator"
 
@@ -19,45 +70,184 @@ SERVICE_NAME = "orchestrator"
 PROXY_BASE_URL = "http://localhost:5000"
 PROXY_ORCHESTRATOR_ROUTE = "/from_orchestrator"
 
+# --- Streaming of immediate_response / question to the proxy ---
+STREAM_REPLIES = os.getenv("ORCH_STREAM_REPLIES", "1") == "1"
+STREAM_FLUSH_INTERVAL = 0.15   # seconds between chunk posts
+STREAM_FLUSH_CHARS = 40        # or flush earlier once this much text is buffered
+
+# Plan blocks handed to agents (as soon as each one has fully streamed)
+DISPATCH_KEYS = ("inventory", "legal", "finance")
 
-def dispatch_to_service_async(service_name: str, endpoint: str, payload: dict):
+# The plan puts immediate_response last, so a truncated completion would cut
+# the user-visible text first; ai_wrapper's default (256) is too small for it
+PLAN_MAX_TOKENS = int(os.getenv("ORCH_PLAN_MAX_TOKENS", "1500"))
+
+# keep-alive connection for the many small chunk posts
+_proxy_session = requests.Session()
+
+
+def post_to_proxy(payload: dict, timeout: float = 5):
+    """
+    POST către proxy (/from_orchestrator) pe conexiunea keep-alive.
+    Dacă rulăm într-un request urmărit, trimite și trace_id (payload + header).
+    """
+    trace_id = tracing.current_trace_id()
+    if trace_id:
+        payload["trace_id"] = trace_id
+    url = f"{PROXY_BASE_URL}{PROXY_ORCHESTRATOR_ROUTE}"
+    with tracing.span(f"POST proxy{PROXY_ORCHESTRATOR_ROUTE}", kind="http", type=payload.get("type")):
+        return _proxy_session.post(url, json=payload, timeout=timeout, headers=tracing.inject_headers())
+
+
+def dispatch_to_service_async(service_name: str, endpoint: str, payload: dict) -> bool:
     """
     Trimite payload-ul către un serviciu în fundal (fire-and-forget),
     fără să blocheze orchestratorul.
+    Returnează False dacă DISPATCHER a respins trimiterea (coadă plină).
     """
     def _worker():
         try:
-            print(f"[orchestrator] Async send to service={service_name}, endpoint={endpoint}")
             send_json_to_service(service_name, endpoint, payload)
-            print(f"[orchestrator] Async send to {service_name}{endpoint} DONE")
+            log.debug("async send done", service=service_name, endpoint=endpoint)
         except Exception as e:
-            print(f"[orchestrator] ERROR sending to {service_name}{endpoint}: {e}")
+            log.error("async send failed", service=service_name, endpoint=endpoint, error=str(e))
 
-    t = Thread(target=_worker, daemon=True)
-    t.start()
+    accepted = DISPATCHER.submit(service_name, tracing.bind(_worker))
+    if not accepted:
+        log.warning("dispatch rejected, queue full", service=service_name, endpoint=endpoint)
+    return accepted
 
 
-def send_chatbox_response_to_proxy(text: str):
+def send_chatbox_response_to_proxy(text: str, session_id: str = DEFAULT_SESSION_ID):
     """
     Trimite răspunsul rapid al orchestratorului direct către proxy.
     Proxy-ul îl va trimite în chatbox imediat.
     Format:
         {
             "type": "chatbox_response",
-            "text": "<text>"
+            "text": "<text>",
+            "session_id": "<session>"
         }
     """
     payload = {
         "type": "chatbox_response",
-        "text": text
+        "text": text,
+        "session_id": session_id
     }
     try:
-        url = f"{PROXY_BASE_URL}{PROXY_ORCHESTRATOR_ROUTE}"
-        print(f"[orchestrator] Sending chatbox_response to proxy: {payload}")
-        resp = requests.post(url, json=payload, timeout=5)
-        print(f"[orchestrator] Proxy responded with status {resp.status_code}")
+        resp = post_to_proxy(payload)
+        log.debug("chatbox_response sent to proxy", session_id=session_id, chars=len(text),
+                  status=resp.status_code)
     except Exception as e:
-        print(f"[orchestrator] Failed to send chatbox_response to proxy: {e}")
+        log.error("failed to send chatbox_response to proxy", session_id=session_id, error=str(e))
+
+
+class ChatStreamForwarder:
+    """
+    Forwards the user-visible text to the proxy while the model is still
+    generating it. Tokens are buffered and posted as "chatbox_delta"
+    packets at most every STREAM_FLUSH_INTERVAL seconds:
+        {
+            "type": "chatbox_delta",
+            "stream_id": "<id>",
+            "delta": "<new text>",
+            "done": false
+        }
+    The last packet has "done": true and the full final "text".
+    """
+
+    def __init__(self, session_id: str = DEFAULT_SESSION_ID):
+        self.stream_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.started = False
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+
+    def push(self, text: str):
+        self.started = True
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        if (self._buffered_chars >= STREAM_FLUSH_CHARS
+                or time.monotonic() - self._last_flush >= STREAM_FLUSH_INTERVAL):
+            self._flush()
+
+    def finish(self, final_text: str):
+        self._flush(done=True, final_text=final_text)
+
+    def _flush(self, done: bool = False, final_text: str | None = None):
+        if not self._buffer and not done:
+            return
+        payload = {
+            "type": "chatbox_delta",
+            "stream_id": self.stream_id,
+            "session_id": self.session_id,
+            "delta": "".join(self._buffer),
+            "done": done,
+        }
+        if final_text is not None:
+            payload["text"] = final_text
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+        try:
+            post_to_proxy(payload)
+        except Exception as e:
+            log.error("failed to send chatbox_delta to proxy", stream_id=self.stream_id, error=str(e))
+
+
+def call_orchestrator_model(user_prompt: str,
+                            forwarder: ChatStreamForwarder | None = None,
+                            dispatched: set | None = None) -> str:
+    """
+    Calls the model and returns the raw completion. With a forwarder, the
+    completion is streamed:
+      - immediate_response / question text is pushed to the proxy as it arrives
+      - each complete inventory / legal / finance block is dispatched right
+        away (recorded in `dispatched`), unless the model is asking a question
+    If the stream breaks before anything was dispatched, the model is asked
+    again without streaming. Once blocks were dispatched it is not: a second
+    answer could differ from the blocks already sent, so the plan is built
+    from what had streamed.
+    """
+    if forwarder is None:
+        return generate_reply(SYSTEM_PROMT_USER, user_prompt, max_tokens=PLAN_MAX_TOKENS)
+
+    if dispatched is None:
+        dispatched = set()
+
+    parser = PlanStreamParser(
+        stream_fields=("immediate_response", "question"),
+        member_fields=DISPATCH_KEYS,
+    )
+    chunks = []
+    members = {}
+    text = {}
+    try:
+        for chunk in generate_reply_stream(SYSTEM_PROMT_USER, user_prompt, max_tokens=PLAN_MAX_TOKENS):
+            chunks.append(chunk)
+            for kind, key, value in parser.feed(chunk):
+                if kind == "string_delta":
+                    forwarder.push(value)
+                    text[key] = text.get(key, "") + value
+                elif kind == "member" and "question" not in parser.seen_keys:
+                    log.debug("block complete mid-stream, dispatching early", block=key)
+                    members[key] = value
+                    dispatched.add(key)
+                    dispatch_plan_member(key, value, forwarder.session_id)
+    except Exception as e:
+        if not dispatched:
+            # nothing sent yet; the final "done" packet carries the full text, so a retry is safe
+            log.warning("streaming failed, retrying without streaming", error=str(e))
+            return generate_reply(SYSTEM_PROMT_USER, user_prompt, max_tokens=PLAN_MAX_TOKENS)
+        log.warning("streaming failed after dispatching, keeping the streamed plan",
+                    error=str(e), dispatched=sorted(dispatched))
+        plan = dict(members)
+        if text.get("immediate_response"):
+            plan["immediate_response"] = text["immediate_response"]
+        return json.dumps(plan, ensure_ascii=False)
+
+    return "".join(chunks)
 
 
 SYSTEM_PROMT_USER = """
@@ -92,9 +282,11 @@ to get their input.
             {
                 "action": "add stock" / "remove stock",
                 "details": {
-                    "item_id": "string identifying the item's name",
+                    "item_id": "singular, lowercase English name of the item (e.g. \"tomato\")",
                     "quantity": 10,
-                    "quantity_unit": "kg"
+                    "quantity_unit": "kg",
+                    "category": "optional, e.g. vegetable / dairy / meat (only for add stock)",
+                    "estimated_shelf_life_days": 7
                 }
             }
         ],
@@ -107,6 +299,11 @@ to get their input.
         "immediate_response": "string with a message acknowledging the user request and summarizing the actions taken"
     }
     
+    "category" and "estimated_shelf_life_days" are optional and only for add stock; "estimated_shelf_life_days" is a whole number of days (a JSON number, not a string).
+
+    Always write the "inventory", "legal" and "finance" members first and "immediate_response" last:
+    each agent is started as soon as its member is complete.
+
     2. If you need more information from the user to decide what actions to take, respond with:
     {
         "question": "string with a message asking the user for more information"
@@ -120,128 +317,151 @@ def list_to_string(lst, sep="\n"):
     return sep.join(str(x) for x in lst)
 
 
-def parse_main_request_data(text: str):
+def build_inventory_actions(inv_list):
+    """
+    Converts the model's inventory block into typed actions for the
+    inventory /inventory/actions endpoint.
+    """
+    actions = []
+    for inv in inv_list:
+        details = inv.get("details", {})
+        item = details.get("item_id")
+        qty = details.get("quantity")
+        action = inv.get("action", "")
+
+        # skip malformed entries
+        if not item or qty is None:
+            continue
+
+        entry = {
+            "action": "add" if "add" in action else "consume",
+            "name": item,
+            "quantity": qty,
+            "unit": details.get("quantity_unit", ""),
+        }
+        for key in ("category", "estimated_shelf_life_days", "expiration_date"):
+            if details.get(key) is not None:
+                entry[key] = details[key]
+        actions.append(entry)
+    return actions
+
+
+def dispatch_plan_member(key: str, block, session_id: str = DEFAULT_SESSION_ID):
+    """
+    Dispatches one top-level block of the model's plan (inventory / legal /
+    finance) to its agent. Called as soon as the block has streamed, or
+    after the whole plan was parsed. Agents that answer asynchronously
+    (legal) get the session_id and echo it back, so their result reaches
+    only the tab that asked.
+    """
+    # --- INVENTORY CALL (merged, async) ---
+    if key == "inventory":
+        # Allow both single-object and list-of-objects formats
+        if isinstance(block, dict):
+            inv_list = [block]
+        else:
+            inv_list = list(block)
+
+        inv_actions = build_inventory_actions(inv_list)
+
+        # one structured batch → inventory skips its own LLM parse;
+        # the outbox keeps it until the agent has acknowledged it
+        if inv_actions:
+            OUTBOX.dispatch(
+                "inventory",
+                "/inventory/actions",
+                {"actions": inv_actions}
+            )
+
+    # --- LEGAL CALL (legal only reads the "legal" section) ---
+    elif key == "legal":
+        dispatch_to_service_async("legal", "/input", {"legal": block, "session_id": session_id})
+
+    # --- FINANCE CALL (merged, async) ---
+    elif key == "finance":
+        mode = block.get("mode", "auto_check")
+        log.debug("finance block received", mode=mode)
+
+        if mode == "auto_check":
+            OUTBOX.dispatch(
+                "finance",
+                "/api/finance/auto_check",
+                {}
+            )
+        elif mode == "message":
+            question = block.get("question", "")
+            OUTBOX.dispatch(
+                "finance",
+                "/api/finance/message",
+                {"message": question}
+            )
+        else:
+            log.warning("unknown finance mode", mode=mode)
+
+
+def parse_main_request_data(text: str, session_id: str = DEFAULT_SESSION_ID):
     """
     Procesează mesajul utilizatorului, apelează modelul și:
       - trimite comenzi către agenții (legal, inventory, finance etc.) asincron
       - trimite un răspuns scurt către proxy prin send_chatbox_response_to_proxy(text)
     """
-    global USER_RESPONSE_STACK
+    # Build history string (this session only)
+    previous_messages = list_to_string(SESSIONS.get_history(session_id))
+    log.debug("session history", session_id=session_id, chars=len(previous_messages))
 
-    # Build history string
-    previous_messages = list_to_string(USER_RESPONSE_STACK)
-    print("previous messages:", previous_messages)
-
-    # Add current user message to stack
-    USER_RESPONSE_STACK.append(text)
+    # Add current user message to the session
+    SESSIONS.append(session_id, text)
 
     # Build user prompt
     user_prompt = previous_messages + "\nUSER: " + text if previous_messages else text
 
-    # Call the model
-    raw_response = generate_reply(
-        SYSTEM_PROMT_USER,
-        user_prompt
-    )
-    print("orchestrator raw response:", raw_response)
+    # Call the model (streams immediate_response to the proxy when enabled)
+    forwarder = ChatStreamForwarder(session_id) if STREAM_REPLIES else None
+    dispatched = set()
+    raw_response = call_orchestrator_model(user_prompt, forwarder, dispatched)
+    log.debug("model response", chars=len(raw_response))
 
     # Parse JSON
     try:
         response = json.loads(raw_response)
     except json.JSONDecodeError:
-        print("WARNING: Orchestrator returned non-JSON. Using raw text as immediate_response.")
+        log.warning("model returned non-JSON, using raw text as immediate_response")
         response = {"immediate_response": raw_response}
 
-    print("orchestrator parsed response:", response)
+    log.info("plan parsed", session_id=session_id, keys=sorted(response) if isinstance(response, dict) else None)
 
     text_for_user = None
 
     # CASE 1: MODEL ASKS A QUESTION → keep context, do NOT clear stack
     if "question" in response:
         question = response["question"]
-        USER_RESPONSE_STACK.append(question)
-        print("orchestrator question to user:", question)
+        SESSIONS.append(session_id, question)
         text_for_user = question
 
     else:
         # CASE 2: ACTIONS (INVENTORY / LEGAL / FINANCE) + IMMEDIATE RESPONSE
 
-        # --- INVENTORY CALL (merged, async) ---
-        if "inventory" in response:
-            inv_block = response["inventory"]
-
-            # Allow both single-object and list-of-objects formats
-            if isinstance(inv_block, dict):
-                inv_list = [inv_block]
-            else:
-                inv_list = list(inv_block)
-
-            for inv in inv_list:
-                details = inv.get("details", {})
-                item = details.get("item_id")
-                qty = details.get("quantity")
-                unit = details.get("quantity_unit", "")
-                action = inv.get("action", "")
-
-                # skip malformed entries
-                if not item or qty is None:
-                    continue
-
-                # You can localize this text if you want
-                if "add" in action:
-                    inv_text = f"I bought {qty}{unit} of {item}"
-                else:
-                    inv_text = f"I used {qty}{unit} of {item}"
-
-                # fire-and-forget towards inventory service
-                dispatch_to_service_async(
-                    "inventory",
-                    "/inventory/message",
-                    {"message": inv_text}
-                )
-
-        # --- LEGAL CALL (keep current behaviour) ---
-        if "legal" in response:
-            leg = response["legal"]
-            # here you keep the old contract; adjust if needed
-            dispatch_to_service_async("legal", "/input", response)
-
-        # --- FINANCE CALL (merged, async) ---
-        if "finance" in response:
-            fin_block = response["finance"]
-            mode = fin_block.get("mode", "auto_check")
-            print("[orchestrator] Finance block received:", fin_block)
-
-            if mode == "auto_check":
-                dispatch_to_service_async(
-                    "finance",
-                    "/api/finance/auto_check",
-                    {}
-                )
-            elif mode == "message":
-                question = fin_block.get("question", "")
-                dispatch_to_service_async(
-                    "finance",
-                    "/api/finance/message",
-                    {"message": question}
-                )
-            else:
-                print(f"[orchestrator] Unknown finance mode '{mode}'")
+        # Blocks already dispatched while streaming are not sent twice
+        for key in DISPATCH_KEYS:
+            if key in response and key not in dispatched:
+                dispatch_plan_member(key, response[key], session_id)
 
         # --- TEXT FOR USER ---
         if "immediate_response" in response:
-            print("orchestrator immediate response:", response["immediate_response"])
             text_for_user = response["immediate_response"]
 
         if not text_for_user:
             text_for_user = "Am procesat cererea ta."
 
         # Now that everything is resolved for this “thread”, clear context
-        print("Conversation for this request resolved, clearing USER_RESPONSE_STACK")
-        USER_RESPONSE_STACK.clear()
+        log.debug("conversation resolved, clearing session", session_id=session_id)
+        SESSIONS.clear(session_id)
 
     # Send the quick chatbox response to proxy
-    send_chatbox_response_to_proxy(text_for_user)
+    if forwarder is not None and forwarder.started:
+        forwarder.finish(text_for_user)
+    else:
+        send_chatbox_response_to_proxy(text_for_user, session_id)
 
     return response
 
@@ -250,29 +470,59 @@ def parse_main_request_data(text: str):
 def handle_text():
     """
     PRIMEȘTE JSON de la proxy.
-    Nu întoarce date reale pentru UI.
+    Nu procesează mesajul pe loc: îl pune în coada de joburi și întoarce
+    imediat 202 + job_id (status la GET /jobs/<job_id>).
     Tot ce este vizibil pentru user se trimite înapoi la proxy
     prin send_chatbox_response_to_proxy().
     """
     try:
         data = request.get_json(silent=False) or {}
     except Exception as e:
-        print("Error parsing JSON from proxy:", e)
+        log.warning("invalid JSON from proxy", error=str(e))
         return jsonify({"error": "Invalid JSON"}), 400
 
-    print("Received JSON from proxy on /text:", data)
-
     message = data.get("msg") or data.get("text") or ""
     context = data.get("context", {}) or {}
+    session_id = str(context.get("session_id") or data.get("session_id") or DEFAULT_SESSION_ID)
 
-    print("Processing message:", message)
-    print("Context:", context)
+    log.info("message received", session_id=session_id, chars=len(message))
 
-    # Trigger the logic; it will call send_chatbox_response_to_proxy() internally
-    parse_main_request_data(message)
+    # The worker will call send_chatbox_response_to_proxy() internally
+    try:
+        job_id = JOBS.submit(tracing.bind(parse_main_request_data, "parse_main_request_data"), message, session_id)
+    except QueueFull as e:
+        log.warning("rejecting message", session_id=session_id, error=str(e))
+        return jsonify({"error": "orchestrator busy, retry later"}), 503, {"Retry-After": "2"}
+
+    return jsonify({"job_id": job_id, "status": "queued", "trace_id": tracing.current_trace_id()}), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job_id"}), 404
+    return jsonify(job), 200
+
+
+@app.route("/jobs", methods=["GET"])
+def jobs_stats():
+    return jsonify(JOBS.stats()), 200
+
+
+@app.route("/dispatch", methods=["GET"])
+def dispatch_stats():
+    return jsonify(DISPATCHER.stats()), 200
 
-    # Minimal ACK; proxy ignores this content
-    return "", 204
+
+@app.route("/outbox", methods=["GET"])
+def outbox_stats():
+    return jsonify(OUTBOX.stats()), 200
+
+
+@app.route("/outbox/requeue", methods=["POST"])
+def outbox_requeue():
+    return jsonify({"requeued": OUTBOX.requeue_dead()}), 200
 
 
 def send_message(data):
@@ -282,11 +532,14 @@ def send_message(data):
 @app.route("/legal_recieve", methods=["POST"])
 def legal_recieve():
     data = request.json or {}
-    print("Received legal data:", data)
+    log.info("legal research received", subject=data.get("subject"))
     research = data.get("research", {})
+    # echoed by legal from the /input payload; older results without it are broadcast
+    session_id = str(data.get("session_id") or DEFAULT_SESSION_ID)
 
     payload = {
         "type": "data_update",
+        "session_id": session_id,
         "payload": {
             "category": "legal_research",
             "subject": data.get("subject"),
@@ -300,17 +553,15 @@ def legal_recieve():
 
     # forward structured update to proxy
     try:
-        url = f"{PROXY_BASE_URL}{PROXY_ORCHESTRATOR_ROUTE}"
-        print(f"[orchestrator] Forwarding legal update to proxy: {payload}")
-        resp = requests.post(url, json=payload, timeout=5)
-        print(f"[orchestrator] Proxy responded with status {resp.status_code}")
+        resp = post_to_proxy(payload)
+        log.debug("legal update forwarded to proxy", status=resp.status_code)
     except Exception as e:
-        print(f"[orchestrator] Failed to forward legal update to proxy: {e}")
+        log.error("failed to forward legal update to proxy", error=str(e))
 
     # optional chat surface
     if research.get("summary"):
         chat_text = f"[Legal] {research.get('summary')}"
-        send_chatbox_response_to_proxy(chat_text)
+        send_chatbox_response_to_proxy(chat_text, session_id)
 
     return jsonify({"status": "received", "data": data}), 200
 
@@ -319,7 +570,7 @@ def legal_recieve():
 def receive_inventory():
     # receive inventory data from inventory service (if used as callback)
     data = request.json
-    print("Received inventory data:", data)
+    log.debug("inventory data received", keys=sorted(data) if isinstance(data, dict) else None)
     return jsonify({"status": "received", "data": data}), 200
 
 
@@ -328,19 +579,28 @@ def proxy_get_inventory():
     """
     Simple proxy to Inventory /inventory GET
     """
-    base = SERVICE_URLS.get("inventory")
-    url = base + "/inventory"
-    print(f"[orchestrator] Proxying GET to inventory: {url}")
-
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        inv_data = resp.json()
+        inv_data = get_client("inventory").get("/inventory", timeout=10)
         return jsonify(inv_data), 200
     except Exception as e:
-        print("[orchestrator] Error fetching inventory:", e)
+        log.error("error fetching inventory", error=str(e))
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/traces/<trace_id>", methods=["GET"])
+def get_trace(trace_id):
+    """Waterfall-ul unui request (toate serviciile scriu în același db/traces.db)."""
+    trace = tracing.waterfall(trace_id)
+    if trace is None:
+        return jsonify({"error": "unknown trace_id"}), 404
+    return jsonify(trace), 200
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    # state of the agents as seen from here (circuit breaker, latency, errors)
+    return jsonify({"service": SERVICE_NAME, "status": "ok", "peers": service_stats()}), 200
+
+
 if __name__ == "__main__":
     app.run(port=5001, debug=True)
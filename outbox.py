@@ -0,0 +1,364 @@
+# outbox.py
+"""
+Durable outbox for orchestrator -> agent commands.
+
+dispatch() only writes the command to a local SQLite table; delivery
+happens in the background, so an agent that is down or restarting does
+not lose stock updates or finance requests.
+
+- one delivery lane (thread) per (service, endpoint); commands of a lane
+  are delivered in order and a failing head blocks the ones behind it
+- endpoints listed in BATCHABLE are drained in batches: up to `batch_size`
+  queued commands go out in one POST as
+      {"batches": [{"idempotency_key": ..., "trace_id": ..., <field>: [...]}, ...]}
+  other endpoints get one POST per command with an Idempotency-Key header
+- the batch response reports a status per idempotency key; only the
+  batches that failed are retried, the ones the agent rejected are
+  dead-lettered, the rest are done
+- failed deliveries are retried with jittered exponential backoff (capped
+  at BACKOFF_MAX) for as long as the agent is down, up to `max_age` seconds
+  after dispatch; then the command is moved to the dead-letter state.
+  Errors that a retry cannot fix (4xx other than 408 / 429) are
+  dead-lettered at once
+- LANE_LIMITS shortens both limits for lanes where a retry is expensive
+  (the LLM-backed finance endpoints)
+- while the agent's circuit breaker is open nothing is sent: the lane
+  waits for the breaker's reset timeout and no attempt is counted
+- delivered commands are deleted; stats() reports pending / dead counts
+- the trace id active at dispatch() is stored with the command, so the
+  delivery shows up in the same trace (batches use the first command's)
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import tracing
+from comms import CircuitOpen, RESET_TIMEOUT
+from log import get_logger
+
+log = get_logger("outbox")
+
+BASE_DIR = Path(__file__).resolve().parent
+OUTBOX_PATH = Path(os.getenv("ORCH_OUTBOX_PATH", BASE_DIR / "db" / "outbox.db"))
+BATCH_SIZE = int(os.getenv("ORCH_OUTBOX_BATCH", "50"))
+MAX_AGE = float(os.getenv("ORCH_OUTBOX_MAX_AGE", str(24 * 3600)))  # seconds
+BACKOFF_BASE = 0.5   # seconds
+BACKOFF_MAX = 60.0   # seconds
+POLL_INTERVAL = 1.0  # lanes also re-check the table this often
+
+# (service, endpoint) -> list field merged when several commands are batched
+BATCHABLE = {
+    ("inventory", "/inventory/actions"): "actions",
+}
+
+# Per-lane overrides of the retry limits. The finance endpoints run a paid LLM
+# call per request and answer 500 when the model's output cannot be parsed, so
+# a retry costs another call and the answer is stale soon anyway: they get a
+# short max_age, and are dead-lettered after max_attempts attempts when the
+# agent itself answered with an error (connection errors only count for age).
+LLM_MAX_ATTEMPTS = int(os.getenv("ORCH_OUTBOX_LLM_MAX_ATTEMPTS", "3"))
+LLM_MAX_AGE = float(os.getenv("ORCH_OUTBOX_LLM_MAX_AGE", str(30 * 60)))  # seconds
+LANE_LIMITS = {
+    ("finance", "/api/finance/auto_check"): {"max_age": LLM_MAX_AGE, "max_attempts": LLM_MAX_ATTEMPTS},
+    ("finance", "/api/finance/message"): {"max_age": LLM_MAX_AGE, "max_attempts": LLM_MAX_ATTEMPTS},
+}
+
+# sender(service, endpoint, payload, headers) must raise on failure and
+# return the parsed JSON response (batch endpoints report per-batch results)
+Sender = Callable[[str, str, dict, Dict[str, str]], object]
+
+RETRYABLE_STATUS = (408, 429)
+
+
+class Rejected(Exception):
+    """The receiver refused the command; retrying would not help."""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, Rejected):
+        return False
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return not (status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUS)
+
+
+def batch_outcomes(response) -> Dict[str, dict]:
+    """{idempotency_key: {"status", "error"}} from a batch response ({} if it has none)."""
+    if not isinstance(response, dict) or not isinstance(response.get("batches"), list):
+        return {}
+    return {b["idempotency_key"]: b for b in response["batches"]
+            if isinstance(b, dict) and b.get("idempotency_key")}
+
+
+def _backoff_delay(attempts: int) -> float:
+    """Full-jitter exponential backoff, same shape as llm_gateway."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** min(attempts, 16))))
+
+
+class Outbox:
+    def __init__(self, sender: Sender, path: Path = OUTBOX_PATH,
+                 batch_size: int = BATCH_SIZE, max_age: float = MAX_AGE,
+                 start: bool = True):
+        self.sender = sender
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lanes: Dict[Tuple[str, str], threading.Event] = {}
+        self._started = start
+
+        self.counters = {"enqueued": 0, "delivered": 0, "posts": 0, "retries": 0, "deferred": 0, "dead": 0}
+
+        if start:
+            # resume whatever was still queued when the process stopped
+            with self._lock:
+                rows = self._db().execute(
+                    "SELECT DISTINCT service, endpoint FROM outbox WHERE status = 'pending'"
+                ).fetchall()
+            for service, endpoint in rows:
+                self._wake(service, endpoint)
+
+    # ---------- storage ----------
+
+    def _db(self) -> sqlite3.Connection:
+        # caller holds self._lock
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+                    service          TEXT NOT NULL,
+                    endpoint         TEXT NOT NULL,
+                    payload          TEXT NOT NULL,
+                    idempotency_key  TEXT NOT NULL UNIQUE,
+                    status           TEXT NOT NULL DEFAULT 'pending',
+                    attempts         INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at  REAL NOT NULL,
+                    created_at       REAL NOT NULL,
+                    last_error       TEXT,
+                    trace_id         TEXT
+                )
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "trace_id" not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN trace_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_lane ON outbox(status, service, endpoint, id)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    # ---------- public API ----------
+
+    def dispatch(self, service: str, endpoint: str, payload: dict) -> str:
+        """Persist a command for delivery; returns its idempotency key."""
+        key = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT INTO outbox (service, endpoint, payload, idempotency_key, next_attempt_at, created_at, trace_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (service, endpoint, json.dumps(payload, ensure_ascii=False), key, now, now,
+                 tracing.current_trace_id()),
+            )
+            conn.commit()
+            self.counters["enqueued"] += 1
+        self._wake(service, endpoint)
+        return key
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT service, endpoint, status, COUNT(*) FROM outbox GROUP BY service, endpoint, status"
+            ).fetchall()
+            out = dict(self.counters)
+        out["pending"] = sum(n for _, _, status, n in rows if status == "pending")
+        out["dead_letter"] = sum(n for _, _, status, n in rows if status == "dead")
+        out["lanes"] = {
+            f"{service}{endpoint}": {status: n for s, e, status, n in rows if (s, e) == (service, endpoint)}
+            for service, endpoint, _, _ in rows
+        }
+        return out
+
+    def requeue_dead(self) -> int:
+        """Moves dead-lettered commands back to pending; returns how many."""
+        with self._lock:
+            conn = self._db()
+            lanes = conn.execute(
+                "SELECT DISTINCT service, endpoint FROM outbox WHERE status = 'dead'"
+            ).fetchall()
+            cur = conn.execute(
+                # the age limit restarts too
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, created_at = ? "
+                "WHERE status = 'dead'",
+                (time.time(), time.time()),
+            )
+            conn.commit()
+        for service, endpoint in lanes:
+            self._wake(service, endpoint)
+        return cur.rowcount
+
+    # ---------- delivery ----------
+
+    def _wake(self, service: str, endpoint: str) -> None:
+        if not self._started:
+            return
+        lane = (service, endpoint)
+        with self._lock:
+            event = self._lanes.get(lane)
+            if event is None:
+                event = self._lanes[lane] = threading.Event()
+                t = threading.Thread(target=self._lane_worker, args=(lane, event),
+                                     name=f"outbox-{service}{endpoint}", daemon=True)
+                t.start()
+        event.set()
+
+    def _lane_worker(self, lane: Tuple[str, str], event: threading.Event) -> None:
+        while True:
+            wait = self.deliver_due(*lane)
+            event.wait(POLL_INTERVAL if wait is None else min(wait, POLL_INTERVAL))
+            event.clear()
+
+    def _due_rows(self, service: str, endpoint: str) -> Tuple[List[tuple], Optional[float]]:
+        """
+        Head of the lane if it is due: the next `batch_size` rows for batchable
+        endpoints, one row otherwise. Second value: seconds until the head is
+        due (None when the lane is empty).
+        """
+        limit = self.batch_size if (service, endpoint) in BATCHABLE else 1
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT id, payload, idempotency_key, attempts, next_attempt_at, trace_id, created_at FROM outbox "
+                "WHERE status = 'pending' AND service = ? AND endpoint = ? ORDER BY id LIMIT ?",
+                (service, endpoint, limit),
+            ).fetchall()
+        if not rows:
+            return [], None
+        now = time.time()
+        if rows[0][4] > now:
+            return [], rows[0][4] - now
+        # rows behind a failed head share its retry time; only send the due prefix
+        due = []
+        for row in rows:
+            if row[4] > now:
+                break
+            due.append(row)
+        return due, 0.0
+
+    def deliver_due(self, service: str, endpoint: str) -> Optional[float]:
+        """
+        Sends the due head of one lane. Returns the seconds to wait before the
+        next attempt (0 when more rows may be due, None when the lane is empty).
+        """
+        rows, wait = self._due_rows(service, endpoint)
+        if not rows:
+            return wait
+
+        batch_field = BATCHABLE.get((service, endpoint))
+        if batch_field:
+            payload = {"batches": [
+                {"idempotency_key": key, "trace_id": trace_id, batch_field: json.loads(raw).get(batch_field, [])}
+                for _, raw, key, _, _, trace_id, _ in rows
+            ]}
+            headers = {}
+        else:
+            _, raw, key = rows[0][:3]
+            payload = json.loads(raw)
+            headers = {"Idempotency-Key": key}
+
+        try:
+            with tracing.use_trace(rows[0][5], service="orchestrator"):
+                with tracing.span(f"outbox deliver {service}{endpoint}", kind="job",
+                                  commands=len(rows), attempt=rows[0][3] + 1):
+                    response = self.sender(service, endpoint, payload, headers)
+        except Exception as e:
+            self._record_failure(service, endpoint, rows, e)
+            return 0.0
+        with self._lock:
+            self.counters["posts"] += 1
+
+        # batches the agent could not apply are retried / dead-lettered on their own
+        outcomes = batch_outcomes(response) if batch_field else {}
+        done, failed, rejected = [], [], []
+        for row in rows:
+            outcome = outcomes.get(row[2], {})
+            if outcome.get("status") == "failed":
+                failed.append(row)
+            elif outcome.get("status") == "rejected":
+                rejected.append((row, outcome.get("error")))
+            else:
+                done.append(row)
+
+        with self._lock:
+            conn = self._db()
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in done])
+            conn.commit()
+            self.counters["delivered"] += len(done)
+        if done:
+            log.debug("commands delivered", lane=f"{service}{endpoint}", commands=len(done))
+        for row, error in rejected:
+            self._record_failure(service, endpoint, [row], Rejected(error or "rejected"), count_post=False)
+        if failed:
+            error = outcomes[failed[0][2]].get("error") or "batch failed"
+            self._record_failure(service, endpoint, failed, RuntimeError(error), count_post=False)
+        return 0.0
+
+    def _record_failure(self, service: str, endpoint: str, rows: List[tuple], error: Exception,
+                        count_post: bool = True) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            if isinstance(error, CircuitOpen):
+                # nothing was sent (or the agent said 503 + Retry-After): wait, the attempt does not count
+                delay = getattr(error, "retry_after", RESET_TIMEOUT)
+                conn.executemany(
+                    "UPDATE outbox SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    [(now + delay, str(error), row[0]) for row in rows],
+                )
+                conn.commit()
+                self.counters["deferred"] += len(rows)
+                log.info("agent unavailable, lane waiting", lane=f"{service}{endpoint}", delay=round(delay, 2))
+                return
+            if count_post:
+                self.counters["posts"] += 1
+            retryable = is_retryable(error)
+            limits = LANE_LIMITS.get((service, endpoint), {})
+            max_age = limits.get("max_age", self.max_age)
+            # only requests the agent answered count against max_attempts (not connection errors)
+            answered = getattr(error, "response", None) is not None
+            max_attempts = limits.get("max_attempts") if answered else None
+            dead = [row for row in rows
+                    if not retryable or now - row[6] >= max_age
+                    or (max_attempts and row[3] + 1 >= max_attempts)]
+            retry = [row for row in rows if row not in dead]
+            if dead:
+                conn.executemany(
+                    "UPDATE outbox SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                    [(str(error), row[0]) for row in dead],
+                )
+                self.counters["dead"] += len(dead)
+                log.error("commands dead-lettered", lane=f"{service}{endpoint}", commands=len(dead),
+                          error=str(error))
+            if retry:
+                attempts = max(row[3] for row in retry) + 1
+                delay = _backoff_delay(attempts)
+                conn.executemany(
+                    "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    [(now + delay, str(error), row[0]) for row in retry],
+                )
+                self.counters["retries"] += len(retry)
+                log.warning("delivery failed, retrying", lane=f"{service}{endpoint}", error=str(error),
+                            attempt=attempts, delay=round(delay, 2))
+            conn.commit()
@@ -0,0 +1,177 @@
+# plan_stream.py
+"""
+Incremental scanner for the orchestrator's JSON plan while it is still
+being streamed by the model.
+
+Feed it text chunks as they arrive; it returns events for the top-level
+object only:
+    ("string_delta", key, text)  - decoded text of a watched top-level
+                                   string value (e.g. "immediate_response")
+    ("member", key, value)       - a top-level member whose value has fully
+                                   arrived, already json-decoded (e.g. the
+                                   "inventory" list while the model is still
+                                   writing later members)
+
+Anything before the first "{" (such as a ```json fence) is ignored.
+"""
+import json
+from typing import Iterable, List, Optional, Tuple
+
+_SIMPLE_ESCAPES = {
+    '"': '"', "\\": "\\", "/": "/",
+    "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+}
+
+
+class PlanStreamParser:
+    def __init__(self, stream_fields: Iterable[str] = ("immediate_response", "question"),
+                 member_fields: Optional[Iterable[str]] = None):
+        self.stream_fields = set(stream_fields)
+        # None -> report every top-level member
+        self.member_fields = set(member_fields) if member_fields is not None else None
+
+        self.depth = 0             # nesting depth of {} / [] (1 == inside the plan object)
+        self.started = False       # seen the opening "{"
+        self.finished = False      # seen the matching closing "}"
+        self.in_string = False
+        self.escape = None         # pending escape sequence (without the backslash)
+        self.pending_high = None   # high surrogate waiting for its pair
+
+        self.expect_key = True     # at depth 1: next string is a key
+        self.current_key = None    # last top-level key
+        self.key_buf: List[str] = []
+        self.string_is_key = False
+        self.streaming_value = False
+
+        self.capturing = False     # collecting the raw text of a top-level value
+        self.value_buf: List[str] = []
+        self.seen_keys: List[str] = []
+
+    # ---------- string decoding ----------
+
+    def _decode_escape(self) -> Tuple[str, bool]:
+        """Returns (decoded_text, complete) for the pending escape."""
+        esc = self.escape
+        if esc[0] in _SIMPLE_ESCAPES:
+            return _SIMPLE_ESCAPES[esc[0]], True
+        if esc[0] == "u":
+            if len(esc) < 5:
+                return "", False
+            code = int(esc[1:5], 16)
+            if 0xD800 <= code <= 0xDBFF:
+                self.pending_high = code
+                return "", True
+            if 0xDC00 <= code <= 0xDFFF and self.pending_high is not None:
+                code = 0x10000 + ((self.pending_high - 0xD800) << 10) + (code - 0xDC00)
+                self.pending_high = None
+            return chr(code), True
+        # invalid escape: keep it verbatim
+        return esc, True
+
+    # ---------- main loop ----------
+
+    def feed(self, chunk: str) -> List[Tuple]:
+        events: List[Tuple] = []
+        delta: List[str] = []
+
+        for ch in chunk:
+            if self.finished:
+                break
+
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                    self.expect_key = True
+                continue
+
+            if self.capturing:
+                self.value_buf.append(ch)
+
+            if self.in_string:
+                text = ""
+                if self.escape is not None:
+                    self.escape += ch
+                    text, complete = self._decode_escape()
+                    if complete:
+                        self.escape = None
+                elif ch == "\\":
+                    self.escape = ""
+                elif ch == '"':
+                    self._close_string(events, delta)
+                    continue
+                else:
+                    text = ch
+
+                if self.string_is_key:
+                    self.key_buf.append(text)
+                elif self.streaming_value and text:
+                    delta.append(text)
+                continue
+
+            if self.depth == 1 and not self.expect_key and not self.capturing and not ch.isspace() and ch not in ":,}":
+                # first char of a top-level value
+                self.capturing = True
+                self.value_buf = [ch]
+
+            if ch == '"':
+                self.in_string = True
+                self.string_is_key = self.depth == 1 and self.expect_key
+                self.streaming_value = (
+                    self.depth == 1 and not self.expect_key
+                    and self.current_key in self.stream_fields
+                )
+                if self.string_is_key:
+                    self.key_buf = []
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 1 and self.capturing:
+                    # scalar value closed by the end of the object
+                    self.value_buf.pop()
+                    self._close_value(events)
+                self.depth -= 1
+                if self.depth == 0:
+                    self.finished = True
+                elif self.depth == 1 and self.capturing:
+                    self._close_value(events)
+            elif ch == ":" and self.depth == 1:
+                self.expect_key = False
+            elif ch == "," and self.depth == 1:
+                if self.capturing:
+                    # scalar value closed by the next member
+                    self.value_buf.pop()
+                    self._close_value(events)
+                self.expect_key = True
+
+        if delta:
+            events.append(("string_delta", self.current_key, "".join(delta)))
+        return events
+
+    def _close_string(self, events: List[Tuple], delta: List[str]) -> None:
+        self.in_string = False
+        if self.string_is_key:
+            self.current_key = "".join(self.key_buf)
+            self.seen_keys.append(self.current_key)
+            self.string_is_key = False
+            return
+        if self.streaming_value:
+            self.streaming_value = False
+            if delta:
+                events.append(("string_delta", self.current_key, "".join(delta)))
+                delta.clear()
+        if self.depth == 1 and self.capturing:
+            self._close_value(events)
+
+    def _close_value(self, events: List[Tuple]) -> None:
+        self.capturing = False
+        raw = "".join(self.value_buf).strip()
+        self.value_buf = []
+        if self.member_fields is not None and self.current_key not in self.member_fields:
+            return
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            # malformed member: leave it to the final json.loads of the whole plan
+            return
+        events.append(("member", self.current_key, value))
@@ -0,0 +1,109 @@
+# session_store.py
+"""
+Per-session conversation history for the orchestrator.
+
+Replaces the old module-level USER_RESPONSE_STACK list, which every
+request shared. Each session (keyed by the session_id the proxy passes in
+`context`) keeps its own turns:
+- capped by number of turns and by an approximate token budget
+  (oldest turns are dropped first; the newest turn is always kept)
+- idle sessions expire after `idle_ttl` seconds, and the least recently
+  used session is evicted once `max_sessions` is reached
+All methods are thread-safe.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+DEFAULT_SESSION_ID = "default"
+
+MAX_SESSIONS = int(os.getenv("ORCH_MAX_SESSIONS", "1000"))
+MAX_TURNS = int(os.getenv("ORCH_SESSION_MAX_TURNS", "20"))
+MAX_TOKENS = int(os.getenv("ORCH_SESSION_MAX_TOKENS", "2000"))
+IDLE_TTL = float(os.getenv("ORCH_SESSION_IDLE_SECONDS", str(30 * 60)))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars per token); good enough for a budget."""
+    return len(text) // 4 + 1
+
+
+class _Session:
+    __slots__ = ("turns", "tokens", "last_seen")
+
+    def __init__(self):
+        self.turns: List[str] = []
+        self.tokens = 0
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_turns: int = MAX_TURNS,
+                 max_tokens: int = MAX_TOKENS, idle_ttl: float = IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _touch(self, session_id: str, create: bool) -> Optional[_Session]:
+        # caller holds self._lock
+        now = time.monotonic()
+        self._expire_idle(now)
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = _Session()
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+        session.last_seen = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _expire_idle(self, now: float) -> None:
+        # sessions are kept in last-used order, so stop at the first live one
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_seen < self.idle_ttl:
+                break
+            del self._sessions[oldest_id]
+            self.evicted += 1
+
+    def get_history(self, session_id: str) -> List[str]:
+        with self._lock:
+            session = self._touch(session_id, create=False)
+            return list(session.turns) if session else []
+
+    def append(self, session_id: str, text: str) -> None:
+        with self._lock:
+            session = self._touch(session_id, create=True)
+            session.turns.append(text)
+            session.tokens += estimate_tokens(text)
+
+            while len(session.turns) > 1 and (
+                len(session.turns) > self.max_turns or session.tokens > self.max_tokens
+            ):
+                dropped = session.turns.pop(0)
+                session.tokens -= estimate_tokens(dropped)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "turns": sum(len(s.turns) for s in self._sessions.values()),
+                "evicted": self.evicted,
+            }
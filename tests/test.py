@@ -160,6 +160,1288 @@ def test_detect_product_drivers_insight_returns_negative_drivers():
     assert any(d["profit_delta"] < 0 for d in ev["top_negative_products"])
 
 
+# -------------------------
+# Finance DB schema / upserts
+# -------------------------
+
+def test_finance_migration_dedupes_days_and_upserts(tmp_path, monkeypatch):
+    import sqlite3
+    from db import finance_db
+
+    path = tmp_path / "finance.db"
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE daily_financials (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, "
+                   "revenue REAL NOT NULL, cost REAL NOT NULL, profit REAL NOT NULL)")
+    legacy.execute("CREATE TABLE product_financials (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, "
+                   "product_id TEXT NOT NULL, product_name TEXT NOT NULL, revenue REAL NOT NULL, "
+                   "cost REAL NOT NULL, profit REAL NOT NULL)")
+    legacy.executemany("INSERT INTO daily_financials (date, revenue, cost, profit) VALUES (?, ?, ?, ?)",
+                       [("2025-11-10", 100, 60, 40), ("2025-11-10", 50, 10, 40), ("2025-11-11", 80, 70, 10)])
+    legacy.executemany("INSERT INTO product_financials (date, product_id, product_name, revenue, cost, profit) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       [("2025-11-10", "milk", "Milk", 0, 5, -5), ("2025-11-10", "milk", "Milk", 0, 7, -7)])
+    legacy.commit()
+    legacy.close()
+
+    monkeypatch.setattr(finance_db, "DB_PATH", path)
+    finance_db.init_db()
+    finance_db.init_db()  # idempotent
+
+    day = datetime.date(2025, 11, 10)
+    assert get_daily_profit(day, day) == [{"date": day, "revenue": 150.0, "cost": 70.0, "profit": 80.0}]
+
+    finance_db.upsert_daily_financial(day, revenue=200, cost=50)
+    assert finance_db.add_to_daily_financial(day, cost=25) == {"revenue": 200.0, "cost": 75.0, "profit": 125.0}
+    finance_db.add_product_financial(day, "milk", "Milk 1L", revenue=0, cost=3)
+
+    conn = finance_db.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM daily_financials WHERE date = ?", (day.isoformat(),)).fetchone()[0] == 1
+    milk = conn.execute("SELECT product_name, cost FROM product_financials").fetchall()
+    assert [tuple(r) for r in milk] == [("Milk 1L", 15.0)]
+    plan = " ".join(r[3] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT product_id, SUM(profit) FROM product_financials "
+        "WHERE date BETWEEN ? AND ? GROUP BY product_id", ("2025-11-01", "2025-11-30")))
+    assert "idx_product_financials_date_product" in plan
+    conn.close()
+
+
+def test_finance_first_write_upgrades_a_v0_database(tmp_path, monkeypatch):
+    import sqlite3
+    from db import finance_db
+
+    # the tracked db/finance.db layout: legacy tables, user_version 0, duplicate product-days
+    path = tmp_path / "finance.db"
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE daily_financials (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, "
+                   "revenue REAL NOT NULL, cost REAL NOT NULL, profit REAL NOT NULL)")
+    legacy.execute("CREATE TABLE product_financials (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, "
+                   "product_id TEXT NOT NULL, product_name TEXT NOT NULL, revenue REAL NOT NULL, "
+                   "cost REAL NOT NULL, profit REAL NOT NULL)")
+    legacy.executemany("INSERT INTO product_financials (date, product_id, product_name, revenue, cost, profit) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       [("2025-11-10", "milk", "Milk", 0, 5, -5), ("2025-11-10", "milk", "Milk", 0, 7, -7)])
+    legacy.commit()
+    legacy.close()
+    monkeypatch.setattr(finance_db, "DB_PATH", path)
+
+    # no init_db(): the Flask finance agent's write endpoint migrates before writing
+    resp = finance_agent.app.test_client().post("/api/finance/record_purchase", json={
+        "product_id": "milk", "product_name": "Milk", "total_cost": 3, "date": "2025-11-10"})
+    assert resp.status_code == 200 and resp.json["daily_cost"] == 3.0
+
+    conn = finance_db.get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == finance_db.MIGRATIONS[-1][0]
+    assert [tuple(r) for r in conn.execute("SELECT date, cost FROM product_financials")] == [("2025-11-10", 15.0)]
+    assert conn.execute("SELECT cost FROM product_rollup WHERE period = 'month'").fetchone()[0] == 15.0
+    conn.close()
+    assert finance_db.get_data_version() == 2  # product row + day total
+
+
+def test_profit_by_product_delta_single_pass_matches_two_period_sums(tmp_path, monkeypatch):
+    import random
+    from db import finance_db
+    from db.finance_functions import iter_profit_by_product_delta
+
+    monkeypatch.setattr(finance_db, "DB_PATH", tmp_path / "finance.db")
+    finance_db.init_db()
+    rng = random.Random(7)
+    start = datetime.date(2025, 10, 1)
+    expected = {}
+    p1 = (datetime.date(2025, 10, 1), datetime.date(2025, 10, 31))
+    p2 = (datetime.date(2025, 10, 31), datetime.date(2025, 11, 19))  # overlaps p1 on one day
+    for day in range(60):
+        date = start + datetime.timedelta(days=day)
+        for pid in rng.sample([f"p{i}" for i in range(30)], 10):
+            revenue, cost = rng.randint(0, 100), rng.randint(0, 100)
+            finance_db.add_product_financial(date, pid, pid.upper(), revenue, cost)
+            for period, (lo, hi) in enumerate((p1, p2)):
+                if lo <= date <= hi:
+                    expected.setdefault(pid, [0.0, 0.0])[period] += revenue - cost
+
+    rows = get_profit_by_product_delta(*p1, *p2, top_n=5)
+    deltas = sorted(p2_ - p1_ for p1_, p2_ in expected.values())
+    assert [r["profit_delta"] for r in rows] == deltas[:5]
+    assert all(r["product_name"] == r["product_id"].upper() for r in rows)
+
+    streamed = list(iter_profit_by_product_delta(*p1, *p2))
+    assert len(streamed) == len(expected)
+    assert {r["product_id"]: [r["profit_period1"], r["profit_period2"]] for r in streamed} == expected
+
+
+def test_finance_rollups_match_raw_sums(tmp_path, monkeypatch):
+    import random
+    from db import finance_db
+    from db.finance_functions import get_period_totals, get_profit_by_product
+
+    path = tmp_path / "finance.db"
+    monkeypatch.setattr(finance_db, "DB_PATH", path)
+    finance_db.init_db()
+    rng = random.Random(11)
+    start = datetime.date(2025, 8, 25)
+    rows = []
+    for day in range(120):
+        date = start + datetime.timedelta(days=day)
+        for pid in rng.sample([f"p{i}" for i in range(12)], 4):
+            rows.append((date, pid, pid.upper(), rng.randint(0, 50), rng.randint(0, 50)))
+        if day % 3:
+            finance_db.upsert_daily_financial(date, revenue=rng.randint(0, 90), cost=rng.randint(0, 90))
+        if day % 5 == 0:
+            finance_db.upsert_daily_financial(date, revenue=10, cost=4)  # replace: rollup gets the difference
+            finance_db.add_to_daily_financial(date, cost=rng.randint(1, 9))
+    assert finance_db.import_product_financials(rows[:200]) == 200
+    for row in rows[200:]:
+        finance_db.add_product_financial(*row)
+
+    raw = finance_db.get_connection()
+    ranges = [(datetime.date(2025, 9, 1), datetime.date(2025, 11, 30)),   # whole months
+              (datetime.date(2025, 9, 3), datetime.date(2025, 12, 9)),    # days + months + weeks + days
+              (datetime.date(2025, 10, 6), datetime.date(2025, 10, 19)),  # two weeks
+              (datetime.date(2025, 10, 8), datetime.date(2025, 10, 10))]  # days only
+    for lo, hi in ranges:
+        span = (lo.isoformat(), hi.isoformat())
+        expected = {r[0]: r[1] for r in raw.execute(
+            "SELECT product_id, SUM(profit) FROM product_financials WHERE date BETWEEN ? AND ? GROUP BY product_id",
+            span)}
+        got = get_profit_by_product(lo, hi, top_n=100)
+        assert {r["product_id"]: r["profit"] for r in got} == expected
+        assert [r["profit"] for r in got] == sorted(expected.values(), reverse=True)
+
+        day = raw.execute("SELECT SUM(revenue), SUM(cost), SUM(profit), COUNT(*) FROM daily_financials "
+                          "WHERE date BETWEEN ? AND ?", span).fetchone()
+        totals = get_period_totals(lo, hi)
+        assert (totals["revenue"], totals["cost"], totals["profit"], totals["days"]) == tuple(day)
+
+    # whole buckets are read from the rollup, not from the raw rows
+    assert raw.execute("SELECT COUNT(*) FROM product_rollup WHERE period = 'month'").fetchone()[0] > 0
+    raw.execute("DELETE FROM product_financials WHERE date BETWEEN '2025-10-01' AND '2025-10-31'")
+    raw.commit()
+    raw.close()
+    october = get_profit_by_product(datetime.date(2025, 10, 1), datetime.date(2025, 10, 31), top_n=100)
+    assert october and sum(r["profit"] for r in october) == sum(
+        revenue - cost for date, _, _, revenue, cost in rows if date.month == 10)
+
+
+def test_finance_insights_cached_until_data_version_changes(tmp_path, monkeypatch):
+    from db import finance_db
+
+    # the module finance_agent imported (agents/ is on its path as a top-level package)
+    finance_insights = sys.modules[finance_agent.collect_finance_insights.__module__]
+    monkeypatch.setattr(finance_db, "DB_PATH", tmp_path / "finance.db")
+    finance_db.init_db()
+    finance_insights.clear_insights_cache()
+    today = datetime.date(2025, 11, 19)
+    for day in range(30, 0, -1):
+        finance_db.upsert_daily_financial(today - datetime.timedelta(days=day), revenue=300, cost=200)
+    finance_db.upsert_daily_financial(today, revenue=300, cost=280)  # profit drop today
+
+    queries = []
+    real_daily = finance_insights.get_daily_profit
+    monkeypatch.setattr(finance_insights, "get_daily_profit", lambda *a: queries.append(a) or real_daily(*a))
+    llm_calls = []
+    monkeypatch.setattr(finance_agent, "call_llm", lambda **kw: llm_calls.append(kw) or {
+        "summary_markdown": "profit fell", "actions": ["raise prices"], "affected_metrics": ["profit"]})
+    versions = []
+    real_version = finance_db.get_data_version
+    monkeypatch.setattr(finance_db, "get_data_version", lambda: versions.append(1) or real_version())
+
+    first = finance_agent.auto_check_and_advise(today)
+    assert len(versions) == 1  # the cache key is computed once per auto-check
+    assert first["insights"][0]["type"] == "overall_profit_decline"
+    first["insights"].clear()  # callers get copies
+    second = finance_agent.auto_check_and_advise(today)
+    assert second["insights"][0]["type"] == "overall_profit_decline"
+    assert second["advice"] == first["advice"]
+    assert len(queries) == 1 and len(llm_calls) == 1
+
+    version = finance_db.get_data_version()
+    finance_db.add_to_daily_financial(today, revenue=200)  # any write bumps the version
+    assert finance_db.get_data_version() == version + 1
+    third = finance_agent.auto_check_and_advise(today)
+    assert third["insights"] == [] and len(queries) == 2
+    finance_agent.auto_check_and_advise(today + datetime.timedelta(days=1))  # another day: recomputed
+    assert len(queries) == 3
+
+
+def test_finance_trend_engine_flags_products_in_one_pass(tmp_path, monkeypatch):
+    import random
+    import numpy as np
+    from db import finance_db
+    from agents import finance_trends
+
+    monkeypatch.setattr(finance_db, "DB_PATH", tmp_path / "finance.db")
+    finance_db.init_db()
+    rng = random.Random(3)
+    today = datetime.date(2025, 11, 22)  # a Saturday
+    start = today - datetime.timedelta(days=finance_trends.LOOKBACK_DAYS)
+    rows = []
+    for day in range(finance_trends.LOOKBACK_DAYS + 1):
+        date = start + datetime.timedelta(days=day)
+        weekend = 3.0 if date.weekday() == 5 else 1.0
+        for i in range(200):
+            profit = 50 * weekend + rng.gauss(0, 2)
+            if i == 0 and date == today:
+                profit = 10            # drop on its busiest weekday
+            if i == 1:
+                profit = 100 - 1.5 * day + rng.gauss(0, 2)   # steady decline
+            if i == 2 and day % 4:
+                continue               # sparse: not scored
+            rows.append((date, f"p{i:03d}", f"Product {i}", profit, 0.0))
+    finance_db.import_product_financials(rows)
+
+    insights = {i["type"]: i for i in finance_trends.trend_insights(today)}
+    drops = insights["product_profit_anomalies"]["evidence"]["drops"]
+    # weekend peaks of the others are expected; only noise-level outliers may join p000
+    assert drops[0]["product_id"] == "p000" and drops[0]["z_score"] < -20 and drops[0]["expected"] > 100
+    assert all(d["z_score"] > -5 for d in drops[1:])
+    assert insights["product_profit_anomalies"]["evidence"]["products_scored"] == 199
+    declining = insights["product_profit_trends"]["evidence"]["declining_products"]
+    assert [d["product_id"] for d in declining] == ["p001"]
+
+    # vectorized slope / matrix match a per-series fit
+    series = finance_db.get_connection().execute(
+        "SELECT date, product_id, profit FROM product_financials").fetchall()
+    ids, matrix = finance_trends.to_matrix(start, finance_trends.LOOKBACK_DAYS + 1,
+                                           [r[0] for r in series], [r[1] for r in series], [r[2] for r in series])
+    stats = finance_trends.series_stats(matrix, start)
+    for i in (1, 5):  # no flagged days; p000's drop is left out of its fit
+        assert np.isclose(stats["slope"][i], np.polyfit(np.arange(matrix.shape[1]), matrix[i], 1)[0])
+    assert stats["z"].shape == (200, finance_trends.LOOKBACK_DAYS + 1 - finance_trends.Z_WINDOW)
+
+    monkeypatch.setattr(finance_trends, "np", None)  # numpy missing: engine off, detectors unaffected
+    assert finance_trends.trend_insights(today) == []
+
+
+# -------------------------
+# Inventory structured actions (no LLM when details are complete)
+# -------------------------
+
+def test_inventory_actions_endpoint_skips_llm(tmp_path, monkeypatch):
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+
+    def _no_llm(*args, **kwargs):
+        raise AssertionError("LLM must not be called for complete actions")
+
+    monkeypatch.setattr(inventory_agent, "query_llm_enrich", _no_llm)
+
+    client = inventory_agent.app.test_client()
+    resp = client.post("/inventory/actions", json={"actions": [
+        {"action": "add", "name": "Tomato", "quantity": 10, "unit": "kg",
+         "category": "vegetable", "estimated_shelf_life_days": 5},
+        {"action": "remove stock", "name": "tomatoes", "quantity": 4, "unit": "kg"},
+        {"action": "add", "name": "milk"},
+    ]})
+    assert resp.status_code == 200
+    data = resp.json
+    assert data["llm_used"] is False
+    assert [r["name"] for r in data["results"]] == ["tomato", "tomato"]
+    assert data["errors"][0]["index"] == 2
+
+    stock = inventory_functions.get_all_inventory()
+    assert len(stock) == 1
+    assert stock[0]["quantity"] == 6
+
+    # shelf life given as a string is converted; a non-numeric one fails only its own item
+    resp = client.post("/inventory/actions", json={"actions": [
+        {"action": "add", "name": "onion", "quantity": 3, "unit": "kg", "category": "vegetable",
+         "estimated_shelf_life_days": "7"},
+        {"action": "add", "name": "garlic", "quantity": 1, "unit": "kg", "category": "vegetable",
+         "estimated_shelf_life_days": "soon"},
+    ]})
+    assert resp.status_code == 200
+    assert [r["name"] for r in resp.json["results"]] == ["onion"]
+    assert resp.json["errors"] == [{"index": 1, "error": "invalid estimated_shelf_life_days 'soon'"}]
+    onion = [lot for lot in inventory_functions.get_all_inventory() if lot["product_name"] == "onion"]
+    assert onion[0]["expiration_date"] == (datetime.date.today() + datetime.timedelta(days=7)).isoformat()
+
+    # out-of-range numbers are per-item errors too, never a 500 or a silent stock change
+    bad = [{"action": "add", "name": "leek", "quantity": 1, "estimated_shelf_life_days": days}
+           for days in ("1e999", "Infinity", 5000000)]
+    bad += [{"action": action, "name": "onion", "quantity": qty}
+            for action, qty in (("add", "NaN"), ("add", -2), ("consume", -1), ("consume", 0))]
+    resp = client.post("/inventory/actions", json={"actions": bad})
+    assert resp.status_code == 200
+    assert resp.json["results"] == [] and [e["index"] for e in resp.json["errors"]] == list(range(7))
+    assert [lot["quantity"] for lot in inventory_functions.get_all_inventory()
+            if lot["product_name"] == "onion"] == [3]
+
+
+def test_outbox_batches_retries_and_dedups(tmp_path, monkeypatch):
+    import outbox
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    monkeypatch.setattr(outbox, "_backoff_delay", lambda attempts: 0.0)
+
+    client = inventory_agent.app.test_client()
+    posts = []
+
+    def sender(service, endpoint, payload, headers):
+        posts.append(payload)
+        if len(posts) == 1:
+            raise ConnectionError("inventory agent restarting")
+        resp = client.post(endpoint, json=payload, headers=headers)
+        assert resp.status_code == 200
+        return resp.json
+
+    box = outbox.Outbox(sender, path=tmp_path / "outbox.db", start=False)
+    for qty in (3, 2):
+        box.dispatch("inventory", "/inventory/actions", {"actions": [
+            {"action": "add", "name": "rice", "quantity": qty, "unit": "kg",
+             "category": "grain", "expiration_date": "2030-01-01"},
+        ]})
+
+    box.deliver_due("inventory", "/inventory/actions")      # fails, kept for retry
+    assert box.stats()["pending"] == 2
+    box.deliver_due("inventory", "/inventory/actions")      # both commands in one POST
+    assert len(posts[1]["batches"]) == 2
+    assert box.stats()["pending"] == 0
+    assert box.deliver_due("inventory", "/inventory/actions") is None
+
+    # a replay of the same batch (e.g. the ack was lost) is not applied twice
+    dup = client.post("/inventory/actions", json=posts[1]).json
+    assert len(dup["duplicates"]) == 2
+    assert inventory_functions.get_all_inventory()[0]["quantity"] == 5
+
+
+def test_outbox_bad_batch_does_not_block_the_others(tmp_path, monkeypatch):
+    import outbox
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    client = inventory_agent.app.test_client()
+
+    def sender(service, endpoint, payload, headers):
+        resp = client.post(endpoint, json=payload, headers=headers)
+        assert resp.status_code == 200
+        return resp.json
+
+    box = outbox.Outbox(sender, path=tmp_path / "outbox.db", start=False)
+    box.dispatch("inventory", "/inventory/actions", {"actions": []})
+    box.dispatch("inventory", "/inventory/actions", {"actions": [
+        {"action": "add", "name": "rice", "quantity": 3, "unit": "kg",
+         "category": "grain", "expiration_date": "2030-01-01"},
+    ]})
+    box.deliver_due("inventory", "/inventory/actions")
+
+    # the good batch is applied and acked, the bad one goes straight to dead letter
+    stats = box.stats()
+    assert stats["pending"] == 0 and stats["dead_letter"] == 1
+    assert inventory_functions.get_all_inventory()[0]["quantity"] == 3
+
+    # deterministic errors are rejected (dead letter), transient ones failed (retried);
+    # a batch that breaks preparation only fails itself
+    import sqlite3
+    real_apply, real_prepare = inventory_agent.apply_items, inventory_agent.prepare_structured_actions
+
+    def apply_items(pairs, keys=()):
+        if "k-integrity" in keys:
+            raise sqlite3.IntegrityError("CHECK constraint failed")
+        if "k-locked" in keys:
+            raise sqlite3.OperationalError("database is locked")
+        return real_apply(pairs, keys)
+
+    def prepare(actions):
+        if any(a.get("name") == "boom" for a in actions):
+            raise ValueError("cannot prepare 'boom'")
+        return real_prepare(actions)
+
+    monkeypatch.setattr(inventory_agent, "apply_items", apply_items)
+    monkeypatch.setattr(inventory_agent, "prepare_structured_actions", prepare)
+    rice = [{"action": "add", "name": "rice", "quantity": 1, "unit": "kg", "expiration_date": "2030-01-01"}]
+    resp = client.post("/inventory/actions", json={"batches": [
+        {"idempotency_key": "k-integrity", "actions": rice},
+        {"idempotency_key": "k-locked", "actions": rice},
+        {"idempotency_key": "k-boom", "actions": [{"action": "add", "name": "boom", "quantity": 1}]},
+        {"idempotency_key": "k-ok", "actions": rice},
+    ]})
+    assert resp.status_code == 200
+    assert [b["status"] for b in resp.json["batches"]] == ["rejected", "failed", "rejected", "applied"]
+    assert inventory_functions.get_all_inventory()[0]["quantity"] == 4
+
+    # a 4xx is not retried either
+    def rejecting(service, endpoint, payload, headers):
+        resp = requests.Response()
+        resp.status_code = 400
+        raise requests.HTTPError("400 Client Error", response=resp)
+
+    box = outbox.Outbox(rejecting, path=tmp_path / "outbox2.db", start=False)
+    box.dispatch("legal", "/legal/notify", {"text": "x"})
+    box.deliver_due("legal", "/legal/notify")
+    assert box.stats()["dead_letter"] == 1
+
+
+def test_outbox_outage_does_not_exhaust_retries(tmp_path, monkeypatch):
+    import outbox
+    from comms import CircuitOpen
+
+    monkeypatch.setattr(outbox, "_backoff_delay", lambda attempts: 0.0)
+    monkeypatch.setattr(outbox, "RESET_TIMEOUT", 0.0)
+    errors = [CircuitOpen("inventory is unavailable (circuit open)")] * 20 + [ConnectionError("refused")] * 20
+
+    def sender(service, endpoint, payload, headers):
+        if errors:
+            raise errors.pop(0)
+        return {}
+
+    box = outbox.Outbox(sender, path=tmp_path / "outbox.db", start=False)
+    box.dispatch("finance", "/finance/record", {"amount": 1})
+    for _ in range(40):
+        box.deliver_due("finance", "/finance/record")
+    stats = box.stats()
+    assert stats["pending"] == 1 and stats["dead_letter"] == 0
+    assert stats["deferred"] == 20 and stats["retries"] == 20  # circuit-open skips are not attempts
+    box.deliver_due("finance", "/finance/record")
+    assert box.stats()["pending"] == 0 and box.stats()["delivered"] == 1
+
+    # the LLM-backed finance lanes give up after a few answered 500s
+    def failing(service, endpoint, payload, headers):
+        calls.append(endpoint)
+        resp = requests.Response()
+        resp.status_code = 500
+        raise requests.HTTPError("500 Server Error", response=resp)
+
+    calls = []
+    llm = outbox.Outbox(failing, path=tmp_path / "llm.db", start=False)
+    llm.dispatch("finance", "/api/finance/auto_check", {})
+    for _ in range(10):
+        llm.deliver_due("finance", "/api/finance/auto_check")
+    assert len(calls) == outbox.LLM_MAX_ATTEMPTS and llm.stats()["dead_letter"] == 1
+
+    # past max_age a failing command is dead-lettered
+    old = outbox.Outbox(sender, path=tmp_path / "old.db", max_age=0, start=False)
+    old.dispatch("finance", "/finance/record", {"amount": 1})
+    errors.append(ConnectionError("refused"))
+    old.deliver_due("finance", "/finance/record")
+    assert old.stats()["dead_letter"] == 1
+
+
+# -------------------------
+# LLM gateway (no network)
+# -------------------------
+
+def test_llm_gateway_retries_on_429(monkeypatch):
+    import io
+    import json
+    import llm_gateway
+
+    def _response(status, body):
+        resp = requests.Response()
+        resp.status_code = status
+        resp._content = json.dumps(body).encode()
+        resp.raw = io.BytesIO(resp._content)
+        return resp
+
+    replies = [
+        _response(429, {"error": "rate limited"}),
+        _response(200, {"choices": [{"message": {"content": "ok"}}]}),
+    ]
+    calls = []
+
+    class FakeSession:
+        def post(self, url, json=None, headers=None, timeout=None, stream=False):
+            calls.append(json)
+            return replies.pop(0)
+
+    monkeypatch.setattr(llm_gateway, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(llm_gateway, "get_session", lambda: FakeSession())
+    monkeypatch.setattr(llm_gateway.time, "sleep", lambda s: None)
+
+    text = llm_gateway.complete("sys", "hi", model="m", temperature=0.1)
+    assert text == "ok"
+    assert len(calls) == 2
+    assert calls[0]["model"] == "m"
+    assert calls[0]["temperature"] == 0.1
+
+
+# -------------------------
+# LLM response cache (no network)
+# -------------------------
+
+def test_llm_cache_tiers_ttl_and_eviction(tmp_path, monkeypatch):
+    import llm_cache
+
+    path = tmp_path / "llm_cache.db"
+    cache = llm_cache.LLMCache(path, memory_items=2, disk_items=10)
+    key = llm_cache.make_key("m", "sys", "hello", 0.1)
+    assert key != llm_cache.make_key("m", "sys", "hello", 0.2)
+
+    assert cache.get(key) is None
+    cache.set(key, "answer", ttl=60)
+    assert cache.get(key) == "answer"
+    assert cache.stats["memory_hits"] == 1
+
+    # a fresh process only has the SQLite tier
+    restarted = llm_cache.LLMCache(path, memory_items=2, disk_items=10)
+    assert restarted.get(key) == "answer"
+    assert restarted.stats["disk_hits"] == 1
+
+    # memory tier is LRU-bounded
+    for i in range(3):
+        restarted.set(f"k{i}", str(i), ttl=60)
+    assert len(restarted._memory) == 2
+
+    # expired entries are misses
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 120)
+    assert restarted.get(key) is None
+    assert restarted.snapshot()["misses"] == 1
+
+
+# -------------------------
+# Streaming (no network)
+# -------------------------
+
+def test_plan_stream_parser_any_chunking():
+    import json
+    from plan_stream import PlanStreamParser
+
+    plan = {
+        "inventory": [{"action": "add stock", "details": {"item_id": "tomato \"roma\"", "quantity": 2}}],
+        "immediate_response": "Am adăugat \"roșii\"\nși gata 😀",
+        "legal": {"subject": "immediate_response"},
+    }
+    raw = "```json\n" + json.dumps(plan) + "\n```"
+
+    for size in (1, 3, 16, len(raw)):
+        parser = PlanStreamParser(member_fields=("inventory", "legal"))
+        streamed = ""
+        members = {}
+        for i in range(0, len(raw), size):
+            for kind, key, value in parser.feed(raw[i:i + size]):
+                if kind == "member":
+                    members[key] = value
+                else:
+                    assert kind == "string_delta" and key == "immediate_response"
+                    streamed += value
+        assert streamed == plan["immediate_response"]
+        assert members == {"inventory": plan["inventory"], "legal": plan["legal"]}
+
+
+def test_plan_stream_parser_reports_member_before_plan_ends():
+    from plan_stream import PlanStreamParser
+
+    parser = PlanStreamParser(member_fields=("inventory", "legal", "finance"))
+    events = parser.feed('{"legal": {"subject": "HACCP"}, "finance": {"mode": "auto_check"}, "immediate_re')
+    assert ("member", "legal", {"subject": "HACCP"}) in events
+    assert ("member", "finance", {"mode": "auto_check"}) in events
+    assert not parser.finished
+
+
+def test_llm_gateway_stream_yields_sse_deltas(monkeypatch):
+    import llm_gateway
+
+    class FakeStreamResponse:
+        status_code = 200
+        ok = True
+
+        def iter_lines(self):
+            yield b": OPENROUTER PROCESSING"
+            yield b""
+            yield b'data: {"choices": [{"delta": {"content": "Sa"}}]}'
+            yield b'data: {"choices": [{"delta": {"content": "lut"}}]}'
+            yield b"data: [DONE]"
+
+        def close(self):
+            pass
+
+    class FakeSession:
+        def post(self, url, json=None, headers=None, timeout=None, stream=False):
+            assert stream and json["stream"] is True
+            return FakeStreamResponse()
+
+    monkeypatch.setattr(llm_gateway, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(llm_gateway, "get_session", lambda: FakeSession())
+
+    assert list(llm_gateway.complete_stream("sys", "hi")) == ["Sa", "lut"]
+
+
+# -------------------------
+# Orchestrator session store
+# -------------------------
+
+def test_session_store_isolates_and_caps_sessions(monkeypatch):
+    import session_store
+
+    store = session_store.SessionStore(max_sessions=2, max_turns=3, max_tokens=50, idle_ttl=60)
+    store.append("a", "salut")
+    store.append("b", "alt tab")
+    assert store.get_history("a") == ["salut"]
+    assert store.get_history("b") == ["alt tab"]
+
+    for i in range(5):
+        store.append("a", f"turn {i}")
+    assert store.get_history("a") == ["turn 2", "turn 3", "turn 4"]
+
+    # token budget: one long turn pushes the older ones out
+    store.append("a", "x" * 200)
+    assert store.get_history("a") == ["x" * 200]
+
+    # LRU: "b" was used least recently
+    store.append("c", "new session")
+    assert store.get_history("b") == []
+    assert store.stats()["sessions"] == 2
+
+    now = session_store.time.monotonic()
+    monkeypatch.setattr(session_store.time, "monotonic", lambda: now + 120)
+    assert store.get_history("a") == []
+
+
+def test_proxy_routes_updates_by_session():
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("proxy_sessions_under_test", ROOT / "frontEnd" / "backend" / "proxy.py")
+    proxy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(proxy)
+    client = proxy.app.test_client()
+
+    def poll(session_id=None):
+        query = f"?session_id={session_id}" if session_id else ""
+        return client.get(f"/api/updates{query}").get_json()["updates"]
+
+    assert poll("a") == [] and poll("b") == []
+    client.post("/from_orchestrator", json={"type": "chatbox_response", "text": "for a", "session_id": "a"})
+    for delta, done in (("Sa", False), ("lut", True)):
+        client.post("/from_orchestrator", json={"type": "chatbox_delta", "stream_id": "s1", "delta": delta,
+                                                "done": done, "session_id": "b"})
+    client.post("/from_orchestrator", json={"type": "data_update", "payload": {"category": "legal"}})
+
+    updates_b = poll("b")
+    assert [u["payload"].get("text") for u in updates_b] == ["Salut", None]  # deltas merged, then broadcast
+    updates_a = poll("a")
+    assert [u["payload"].get("text") for u in updates_a] == ["for a", None]
+    assert poll("a") == [] and poll("b") == []
+    assert [u["type"] for u in poll()] == ["data_update"]  # clients without a session get broadcasts only
+
+    # a tab that connects after the last inventory change still gets the inventory
+    lot = {"id": 1, "product_name": "rice", "category": "grain", "quantity": 2}
+    assert proxy.apply_inventory_changes({"full": True, "changes": [lot], "version": 3, "status": "ok"})
+    first = poll("c")
+    assert [u["payload"] for u in first] == [{"category": "inventory", "items": [lot], "status": "ok"}]
+    assert poll("c") == [] and poll("a") == []
+
+
+# -------------------------
+# Orchestrator job queue (no LLM)
+# -------------------------
+
+def test_orchestrator_text_returns_job_id(monkeypatch):
+    import time
+    import orchestrator
+
+    seen = []
+
+    def fake_parse(message, session_id):
+        seen.append((message, session_id))
+        return {"immediate_response": "ok"}
+
+    monkeypatch.setattr(orchestrator, "parse_main_request_data", fake_parse)
+    client = orchestrator.app.test_client()
+
+    resp = client.post("/text", json={"msg": "salut", "context": {"session_id": "tab-1"}})
+    assert resp.status_code == 202
+    job_id = resp.json["job_id"]
+
+    for _ in range(50):
+        job = client.get(f"/jobs/{job_id}").json
+        if job["status"] == "done":
+            break
+        time.sleep(0.02)
+    assert job["status"] == "done"
+    assert job["result"] == {"immediate_response": "ok"}
+    assert seen == [("salut", "tab-1")]
+    assert client.get("/jobs/nope").status_code == 404
+
+
+def test_orchestrator_stream_failure_does_not_mix_two_plans(monkeypatch):
+    import json
+    import orchestrator
+
+    def broken_stream(system, user, max_tokens=None):
+        assert max_tokens == orchestrator.PLAN_MAX_TOKENS
+        yield '{"inventory": [{"action": "add", "item": "rice"}], "immediate_response": "Am adau'
+        raise ConnectionError("stream reset")
+
+    asked, sent = [], []
+    monkeypatch.setattr(orchestrator, "generate_reply_stream", broken_stream)
+    monkeypatch.setattr(orchestrator, "generate_reply", lambda *a, **kw: asked.append(kw) or '{"legal": {}}')
+    monkeypatch.setattr(orchestrator, "dispatch_plan_member", lambda key, block, sid: sent.append(key))
+    monkeypatch.setattr(orchestrator, "post_to_proxy", lambda payload: requests.Response())
+
+    dispatched = set()
+    raw = orchestrator.call_orchestrator_model("x", orchestrator.ChatStreamForwarder("tab-1"), dispatched)
+    # inventory was already sent: the model is not asked again, the plan is what had streamed
+    assert asked == [] and sent == ["inventory"] and dispatched == {"inventory"}
+    assert json.loads(raw) == {"inventory": [{"action": "add", "item": "rice"}], "immediate_response": "Am adau"}
+
+    def empty_stream(system, user, max_tokens=None):
+        yield '{"immediate_response": "Sa'
+        raise ConnectionError("stream reset")
+
+    monkeypatch.setattr(orchestrator, "generate_reply_stream", empty_stream)
+    raw = orchestrator.call_orchestrator_model("x", orchestrator.ChatStreamForwarder("tab-1"), set())
+    assert raw == '{"legal": {}}' and asked == [{"max_tokens": orchestrator.PLAN_MAX_TOKENS}]
+
+
+def test_legal_research_goes_back_to_the_asking_session(tmp_path, monkeypatch):
+    import json
+    import legal
+    import orchestrator
+
+    sent = []
+    monkeypatch.setattr(orchestrator, "dispatch_to_service_async",
+                        lambda service, endpoint, payload: sent.append(payload) or True)
+    orchestrator.dispatch_plan_member("legal", {"subject": "HACCP"}, "tab-1")
+    assert sent == [{"legal": {"subject": "HACCP"}, "session_id": "tab-1"}]
+
+    # legal echoes the session in its callback
+    callbacks = []
+    monkeypatch.setattr(legal, "LEGAL_DEBUG_PATH", str(tmp_path / "legal_latest.json"))
+    monkeypatch.setattr(legal, "generate_reply", lambda *a, **kw: json.dumps({"research": {"summary": "ok"}}))
+    monkeypatch.setattr(legal, "send_json_to_service", lambda service, path, payload: callbacks.append(payload))
+    legal._run_research("HACCP", {}, "tab-1")
+    assert callbacks[0]["session_id"] == "tab-1"
+
+    # and the orchestrator forwards the result to that session only
+    to_proxy = []
+    monkeypatch.setattr(orchestrator, "post_to_proxy", lambda payload: to_proxy.append(payload) or requests.Response())
+    resp = orchestrator.app.test_client().post("/legal_recieve", json=callbacks[0])
+    assert resp.status_code == 200
+    assert [(p["type"], p["session_id"]) for p in to_proxy] == [("data_update", "tab-1"), ("chatbox_response", "tab-1")]
+
+
+def test_job_queue_rejects_when_full():
+    import threading
+    import time
+    from job_queue import JobQueue, QueueFull
+
+    gate = threading.Event()
+    jobs = JobQueue("test", workers=1, max_queue=1)
+    jobs.submit(gate.wait)          # occupies the only worker
+    for _ in range(50):
+        if jobs.stats()["running"] == 1:
+            break
+        time.sleep(0.01)
+    jobs.submit(gate.wait)          # fills the queue
+    try:
+        jobs.submit(gate.wait)
+        assert False, "expected QueueFull"
+    except QueueFull:
+        pass
+    assert jobs.stats()["rejected"] == 1
+    gate.set()
+
+
+def test_dispatch_pool_limits_per_destination_and_rejects():
+    import threading
+    import time
+    from dispatch_pool import BoundedExecutor
+
+    gate = threading.Event()
+    pool = BoundedExecutor("test", workers=4, max_queue=2, limits={"slow": 1})
+    assert pool.submit("slow", gate.wait)
+    for _ in range(50):
+        if pool.stats()["running"] == 1:
+            break
+        time.sleep(0.01)
+    assert pool.submit("slow", gate.wait)   # stays queued: "slow" is capped at 1 running
+
+    done = threading.Event()
+    assert pool.submit("fast", done.set)     # other destinations still get workers
+    assert done.wait(2)
+
+    assert pool.submit("slow", gate.wait)   # queue now holds 2 -> full
+    assert not pool.submit("slow", gate.wait)
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["destinations"]["slow"] == {"queued": 2, "running": 1, "limit": 1}
+
+    gate.set()
+    for _ in range(100):
+        if pool.stats()["completed"] == 4:
+            break
+        time.sleep(0.01)
+    assert pool.stats()["completed"] == 4
+
+
+# -------------------------
+# Inter-service client (no network)
+# -------------------------
+
+def test_service_client_circuit_breaker_fails_fast():
+    import time
+    import requests
+    from comms import ServiceClient, CircuitOpen, resolve_service
+
+    assert resolve_service("financial") == "finance"
+
+    client = ServiceClient("inventory", "http://agent.invalid", failure_threshold=2, reset_timeout=0.05)
+    calls = []
+
+    class _Resp:
+        status_code = 200
+        url = "http://agent.invalid/inventory"
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"ok": True}
+
+    def _down(method, url, **kwargs):
+        calls.append(url)
+        raise requests.ConnectionError("connection refused")
+
+    client.session.request = _down
+    for _ in range(2):
+        try:
+            client.get("/inventory")
+            assert False, "expected ConnectionError"
+        except requests.ConnectionError:
+            pass
+    try:
+        client.get("/inventory")
+        assert False, "expected CircuitOpen"
+    except CircuitOpen:
+        pass
+    assert len(calls) == 2                  # third call never hit the network
+
+    time.sleep(0.06)
+    client.session.request = lambda method, url, **kwargs: _Resp()
+    assert client.get("/inventory") == {"ok": True}   # half-open trial succeeds
+    stats = client.stats()
+    assert stats["state"] == "closed"
+    assert (stats["calls"], stats["errors"], stats["rejected"]) == (3, 2, 1)
+
+
+def test_service_client_busy_503_is_backpressure_not_failure(tmp_path):
+    import time
+    from comms import ServiceClient, Busy, parse_retry_after
+    import outbox
+
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-5") == 0.0
+    assert parse_retry_after("nonsense", 7) == 7
+
+    client = ServiceClient("legal", "http://agent.invalid", failure_threshold=2, reset_timeout=5)
+    calls = []
+
+    class _Busy:
+        status_code = 503
+        url = "http://agent.invalid/input"
+        headers = {"Retry-After": "0.05"}
+
+    def _queue_full(method, url, **kwargs):
+        calls.append(url)
+        return _Busy()
+
+    client.session.request = _queue_full
+    for _ in range(3):
+        try:
+            client.post("/input", {"legal": "x"})
+            assert False, "expected Busy"
+        except Busy as e:
+            assert 0 < e.retry_after <= 0.05
+        time.sleep(0.06)
+    # the Retry-After window is honoured: no request goes out until it passes
+    try:
+        client.post("/input", {"legal": "x"})
+        assert False, "expected Busy"
+    except Busy:
+        pass
+    assert len(calls) == 4
+    stats = client.stats()
+    assert stats["state"] == "closed"            # backpressure never opens the breaker
+    assert (stats["errors"], stats["busy"]) == (0, 4)
+
+    # the outbox waits for Retry-After without spending an attempt
+    def busy(service, endpoint, payload, headers):
+        calls.append(endpoint)
+        raise Busy("legal is busy", 30)
+
+    box = outbox.Outbox(busy, path=tmp_path / "outbox.db", start=False)
+    box.dispatch("legal", "/input", {"legal": "x"})
+    assert box.deliver_due("legal", "/input") is not None
+    box.deliver_due("legal", "/input")              # still inside the 30s window: not sent again
+    assert len(calls) == 5
+    stats = box.stats()
+    assert stats["deferred"] == 1 and stats["retries"] == 0 and stats["pending"] == 1
+
+
+# -------------------------
+# Request tracing
+# -------------------------
+
+def test_trace_spans_follow_threads_and_http_hops(tmp_path, monkeypatch):
+    import threading
+    import tracing
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(tracing, "_STORE", tracing.TraceStore(tmp_path / "traces.db"))
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    client = inventory_agent.app.test_client()
+
+    trace_id = tracing.new_trace_id()
+    with tracing.use_trace(trace_id, service="orchestrator"):
+        with tracing.span("parse_main_request_data", kind="job"):
+            def _hop():
+                with tracing.span("GET inventory/inventory", kind="http"):
+                    client.get("/inventory", headers=tracing.inject_headers())
+
+            t = threading.Thread(target=tracing.bind(_hop))
+            t.start()
+            t.join()
+
+    trace = tracing.waterfall(trace_id)
+    spans = {s["name"]: s for s in trace["spans"]}
+    assert [(n, spans[n]["service"], spans[n]["depth"]) for n in (
+        "parse_main_request_data", "GET inventory/inventory", "GET /inventory", "db get_all_inventory",
+    )] == [
+        ("parse_main_request_data", "orchestrator", 0),
+        ("GET inventory/inventory", "orchestrator", 1),
+        ("GET /inventory", "inventory", 2),
+        ("db get_all_inventory", "inventory", 3),
+    ]
+    assert tracing.waterfall("unknown") is None
+
+
+# -------------------------
+# Inventory connection manager
+# -------------------------
+
+def test_inventory_db_reads_do_not_wait_for_writer(tmp_path, monkeypatch):
+    from db import inventory_functions
+    from db.inventory_db import get_manager
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    inventory_functions.add_product("apple", "fruit", 3, "kg", "2030-01-01", False)
+    manager = get_manager(inventory_functions.DB_PATH)
+
+    with manager.read() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+    with manager.write() as conn:
+        conn.execute("UPDATE inventory SET quantity = 99")
+        # uncommitted write: readers still see the last committed state, without blocking
+        assert inventory_functions.get_all_inventory()[0]["quantity"] == 3
+    assert inventory_functions.get_all_inventory()[0]["quantity"] == 99
+
+    try:
+        with manager.write() as conn:
+            conn.execute("UPDATE inventory SET quantity = 0")
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert inventory_functions.get_all_inventory()[0]["quantity"] == 99
+    assert manager.stats()["read_connections_opened"] == 1
+    manager.close()
+
+
+def test_inventory_migrations_dedupe_lots_and_index_lookups(tmp_path, monkeypatch):
+    import sqlite3
+    from db import inventory_functions
+    from db.inventory_db import get_manager
+    from db.inventory_migrations import MIGRATIONS, current_version
+
+    # pre-migration database: no indexes, duplicate lot rows
+    path = tmp_path / "inventory.db"
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, product_name TEXT NOT NULL, "
+                   "category TEXT DEFAULT 'general', quantity REAL DEFAULT 0, unit TEXT DEFAULT 'pcs', "
+                   "expiration_date DATE, auto_buy BOOLEAN DEFAULT 0, min_threshold REAL DEFAULT 2)")
+    legacy.executemany("INSERT INTO inventory (product_name, quantity, expiration_date) VALUES (?, ?, ?)",
+                       [("milk", 2, "2030-01-01"), ("milk", 3, "2030-01-01"), ("milk", 1, "2030-02-01")])
+    legacy.execute("INSERT INTO inventory (product_name, category, quantity) VALUES ('salt', NULL, 1)")
+    legacy.commit()
+    legacy.close()
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(path))
+    inventory_functions.init_db()
+    inventory_functions.init_db()  # idempotent
+    inventory_functions.add_product("milk", "dairy", 4, "l", "2030-01-01", False)
+
+    lots = {row["expiration_date"]: row["quantity"] for row in inventory_functions.get_all_inventory()
+            if row["product_name"] == "milk"}
+    assert lots == {"2030-01-01": 9, "2030-02-01": 1}
+    assert [lot["category"] for lot in inventory_functions.query_inventory(name_prefix="salt")[0]] == [""]
+
+    with get_manager(path).read() as conn:
+        assert current_version(conn) == MIGRATIONS[-1][0]
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM inventory WHERE product_name = ? AND quantity > 0 "
+            "ORDER BY expiration_date", ("milk",)))
+        assert "idx_inventory_lot" in plan
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM inventory WHERE quantity > 0 ORDER BY category, product_name"))
+        assert "idx_inventory_in_stock" in plan and "TEMP B-TREE" not in plan
+    get_manager(path).close()
+
+
+def test_inventory_apply_batch_is_one_atomic_transaction(tmp_path, monkeypatch):
+    import pytest
+    from db import inventory_functions
+    from db.inventory_db import get_manager
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    manager = get_manager(inventory_functions.DB_PATH)
+    writes = manager.stats()["writes"]
+
+    results = inventory_functions.apply_batch([
+        {"action": "add", "name": "rice", "quantity": 2, "unit": "kg", "expiry": "2030-01-01"},
+        {"action": "add", "name": "rice", "quantity": 3, "unit": "kg", "expiry": "2030-06-01"},
+        {"action": "consume", "name": "rice", "quantity": 4},
+        {"action": "consume", "name": "beans", "quantity": 1},
+    ], idempotency_keys=["k1"])
+    assert results[2] == "Consumed rice: 2.0kg (Exp: 2030-01-01), 2.0kg (Exp: 2030-06-01)"
+    assert results[3] == "Error: 'beans' not found."
+    assert manager.stats()["writes"] == writes + 1  # one commit for the whole batch
+    assert [r["quantity"] for r in inventory_functions.get_all_inventory()] == [1]
+    assert inventory_functions.get_processed_requests(["k1"]) == {"k1"}
+
+    # a failing op rolls the whole batch back, keys included
+    with pytest.raises(KeyError):
+        inventory_functions.apply_batch([
+            {"action": "add", "name": "rice", "quantity": 10, "unit": "kg", "expiry": "2030-06-01"},
+            {"action": "consume", "name": "rice"},
+        ], idempotency_keys=["k2"])
+    assert [r["quantity"] for r in inventory_functions.get_all_inventory()] == [1]
+    assert inventory_functions.get_processed_requests(["k2"]) == set()
+
+    # the key is claimed inside the write transaction: of two concurrent
+    # deliveries of the same batch exactly one applies it
+    import threading
+    add = [{"action": "add", "name": "rice", "quantity": 1, "unit": "kg", "expiry": "2030-06-01"}]
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(
+        inventory_functions.apply_batch(add, idempotency_keys=["k3"]))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(r is None for r in replies) == [False, True, True, True]
+    assert [r["quantity"] for r in inventory_functions.get_all_inventory()] == [2]  # merged into the 2030-06-01 lot, once
+    manager.close()
+
+
+def test_inventory_ledger_and_daily_consumption(tmp_path, monkeypatch):
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    inventory_functions.apply_batch([
+        {"action": "add", "name": "flour", "quantity": 5, "unit": "kg", "expiry": "2030-01-01"},
+        {"action": "add", "name": "flour", "quantity": 5, "unit": "kg", "expiry": "2030-02-01"},
+        {"action": "consume", "name": "flour", "quantity": 7},
+    ])
+    inventory_functions.consume_product("flour", 1)
+
+    moves = inventory_functions.get_movements("flour")
+    assert [(m["kind"], m["quantity"]) for m in moves] == [
+        ("consume", -1), ("consume", -2), ("consume", -5), ("add", 5), ("add", 5)]
+    assert sum(m["quantity"] for m in moves) == sum(r["quantity"] for r in inventory_functions.get_all_inventory())
+
+    client = inventory_agent.app.test_client()
+    usage = client.get("/inventory/consumption?days=7&product=Flour").get_json()["consumption"]
+    assert usage["flour"]["quantity"] == 8 and usage["flour"]["days_active"] == 1
+    assert client.get("/inventory/consumption?days=0").status_code == 400
+
+
+def test_inventory_alerts_update_incrementally(tmp_path, monkeypatch):
+    import datetime
+    import pytest
+    from db import inventory_functions
+    from db.inventory_db import get_manager
+    from db.inventory_alerts import get_engine
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    soon = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+    inventory_functions.apply_batch([
+        {"action": "add", "name": "eggs", "quantity": 12, "unit": "pcs", "expiry": "2030-01-01", "auto_buy": 1},
+        {"action": "add", "name": "cream", "quantity": 1, "unit": "l", "expiry": soon},
+    ])
+    engine = get_engine(get_manager(inventory_functions.DB_PATH))
+
+    alerts = inventory_agent.app.test_client().get("/inventory/alerts").get_json()["alerts"]
+    assert alerts["restock_needed"] == []
+    assert [p["name"] for p in alerts["low_stock"]] == ["cream"]  # 1 < default min_threshold 2
+    assert [(l["name"], l["days_left"]) for l in alerts["expiring_soon"]] == [("cream", 1)]
+
+    inventory_functions.consume_product("eggs", 11)
+    inventory_functions.consume_product("cream", 1)
+    alerts = inventory_functions.get_alerts()
+    assert alerts["restock_needed"] == ["eggs"]
+    assert alerts["expiring_soon"] == []
+    assert engine.counters["full_loads"] == 1 and engine.counters["incremental_updates"] == 2
+
+    # rolled back writes leave the cache alone
+    with pytest.raises(KeyError):
+        inventory_functions.apply_batch([{"action": "add", "name": "eggs", "quantity": 50, "expiry": "2030-01-01"},
+                                         {"action": "consume", "name": "eggs"}])
+    assert inventory_functions.get_alerts()["restock_needed"] == ["eggs"]
+    get_manager(inventory_functions.DB_PATH).close()
+
+
+def test_inventory_change_feed_etag_and_proxy_mirror(tmp_path, monkeypatch):
+    import importlib.util
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    inventory_functions.apply_batch([
+        {"action": "add", "name": "oil", "quantity": 3, "unit": "l", "expiry": "2030-01-01"},
+        {"action": "add", "name": "salt", "quantity": 1, "unit": "kg", "expiry": "2031-01-01"},
+    ])
+    client = inventory_agent.app.test_client()
+
+    first = client.get("/inventory")
+    etag = first.headers["ETag"]
+    assert client.get("/inventory", headers={"If-None-Match": etag}).status_code == 304
+
+    full = client.get("/inventory/changes?since=0").get_json()
+    assert full["full"] and len(full["changes"]) == 2
+    assert client.get(f"/inventory/changes?since={full['version']}").get_json()["changes"] == []
+
+    inventory_functions.consume_product("salt", 1)
+    assert client.get("/inventory", headers={"If-None-Match": etag}).status_code == 200
+    delta = client.get(f"/inventory/changes?since={full['version']}").get_json()
+    assert not delta["full"] and [(c["product_name"], c["quantity"]) for c in delta["changes"]] == [("salt", 0)]
+
+    spec = importlib.util.spec_from_file_location("proxy_under_test", ROOT / "frontEnd" / "backend" / "proxy.py")
+    proxy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(proxy)
+    assert proxy.apply_inventory_changes(full) is True
+    assert proxy.apply_inventory_changes({"version": full["version"], "full": False, "changes": []}) is False
+    assert proxy.apply_inventory_changes(delta) is True
+    assert [lot["product_name"] for lot in proxy.inventory_items()] == ["oil"]
+    assert proxy.INVENTORY_VERSION == delta["version"]
+
+
+def test_inventory_filters_keyset_pages_and_product_totals(tmp_path, monkeypatch):
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    ops = [{"action": "add", "name": f"veg{i:02d}", "category": "vegetable", "quantity": 1, "unit": "kg",
+            "expiry": f"2030-01-{i + 1:02d}"} for i in range(7)]
+    ops += [{"action": "add", "name": "veg00", "category": "vegetable", "quantity": 2, "unit": "kg",
+             "expiry": "2030-03-01"},
+            {"action": "add", "name": "tea", "category": "drinks", "quantity": 1, "unit": "box",
+             "expiry": "2030-01-02", "auto_buy": 1},
+            {"action": "add", "name": "salt", "category": None, "quantity": 1, "unit": "kg", "expiry": None}]
+    inventory_functions.apply_batch(ops)
+    client = inventory_agent.app.test_client()
+
+    # an uncategorized lot sorts first and does not end pagination of the rest
+    names, after = [], None
+    while True:
+        lots, after = inventory_functions.query_inventory(fields=["product_name"], limit=2, after=after)
+        names += [lot["product_name"] for lot in lots]
+        if after is None:
+            break
+    assert names[:2] == ["salt", "tea"] and len(names) == 10
+    lots, _ = inventory_functions.query_inventory(fields=["product_name"], after=(None, "salt", 10 ** 9))
+    assert [lot["product_name"] for lot in lots][:1] == ["tea"]   # old cursor with a NULL category
+
+    seen, cursor = [], None
+    while True:
+        url = "/inventory?category=vegetable&limit=3&fields=product_name,quantity"
+        page = client.get(url + (f"&cursor={cursor}" if cursor else "")).get_json()
+        assert all(set(lot) == {"product_name", "quantity"} for lot in page["inventory"])
+        seen += [lot["product_name"] for lot in page["inventory"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == ["veg00", "veg00"] + [f"veg{i:02d}" for i in range(1, 7)]
+
+    expiring = client.get("/inventory?expiring_before=2030-01-02&fields=product_name").get_json()["inventory"]
+    assert sorted(lot["product_name"] for lot in expiring) == ["tea", "veg00", "veg01"]
+    assert [l["product_name"] for l in client.get("/inventory?auto_buy=true").get_json()["inventory"]] == ["tea"]
+    assert client.get("/inventory?fields=password").status_code == 400
+    assert client.get("/inventory?cursor=garbage").status_code == 400
+
+    totals = client.get("/inventory/products?name=veg0").get_json()["products"]
+    assert totals[0] == {"product_name": "veg00", "category": "vegetable", "quantity": 3, "unit": "kg",
+                         "lots": 2, "next_expiration": "2030-01-01", "auto_buy": 0}
+    assert len(totals) == 7
+
+
+# -------------------------
+# Metrics
+# -------------------------
+
+def test_metrics_endpoint_exposes_routes_db_and_histograms(tmp_path, monkeypatch):
+    import metrics
+    from db import inventory_functions
+    from agents import inventory_agent
+
+    monkeypatch.setattr(inventory_functions, "DB_PATH", str(tmp_path / "inventory.db"))
+    inventory_functions.init_db()
+    client = inventory_agent.app.test_client()
+    assert client.get("/inventory").status_code == 200
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'http_requests_total{service="inventory",method="GET",route="/inventory",status="200"}' in body
+    assert 'sqlite_query_duration_seconds_count{db="inventory",query="get_all_inventory"}' in body
+
+    # the Flask finance agent (python agents/finance_agent.py) serves it too
+    finance = finance_agent.app.test_client()
+    assert finance.post("/api/finance/record_purchase", json={}).status_code == 400
+    body = finance.get("/metrics").get_data(as_text=True)
+    assert ('http_requests_total{service="finance",method="POST",route="/api/finance/record_purchase",'
+            'status="400"}') in body
+
+    hist = metrics.histogram("test_latency_seconds", "test", ["op"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        hist.observe(value, op="x")
+    lines = hist.render()
+    assert 'test_latency_seconds_bucket{op="x",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{op="x",le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{op="x",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_sum{op="x"} 5.55' in lines
+
+
+# -------------------------
+# Structured logging
+# -------------------------
+
+def test_log_formatter_truncates_masks_and_drops_when_full(monkeypatch):
+    import json
+    import logging
+    import queue
+    import log
+
+    record = logging.LogRecord("bizzgenie.test", logging.INFO, __file__, 1, "llm call", None, None)
+    record.fields = {"prompt": "x" * 2000, "api_key": "sk-secret", "prompt_tokens": 12}
+    record.trace_id = "t1"
+    out = json.loads(log.JsonFormatter().format(record))
+    assert out["msg"] == "llm call" and out["trace_id"] == "t1"
+    assert out["api_key"] == "***" and out["prompt_tokens"] == 12
+    assert len(out["prompt"]) < log.MAX_FIELD + 30 and out["prompt"].endswith("(+1500 chars)")
+
+    handler = log._NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    monkeypatch.setattr(log, "dropped", 0)
+    handler.emit(record)
+    handler.emit(record)  # queue full: dropped, not blocked
+    assert log.dropped == 1
+
+
 # -------------------------
 # Full orchestrator + inventory + legal flow
 # -------------------------
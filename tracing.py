@@ -0,0 +1,337 @@
+# tracing.py
+"""
+Request tracing across proxy -> orchestrator -> agents.
+
+A trace id is created by the proxy at /api/chat and travels as the
+X-Trace-Id header (plus "trace_id" in payloads that are queued or
+called back later: orchestrator jobs, outbox rows, legal results).
+Every hop records timed spans (HTTP server / client, LLM calls, DB work)
+into a local SQLite store shared by all services on the machine, and
+waterfall(trace_id) rebuilds the timeline of one request.
+
+Spans are only recorded while a trace is active, so code paths that are
+not part of a traced request pay almost nothing. Writes go through a
+background thread in batches; set TRACING_ENABLED=0 to turn it all off.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+TRACE_DB_PATH = Path(os.getenv("TRACE_DB_PATH", BASE_DIR / "db" / "traces.db"))
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+RETENTION_SECONDS = float(os.getenv("TRACE_RETENTION_SECONDS", str(24 * 60 * 60)))
+
+TRACE_HEADER = "X-Trace-Id"
+PARENT_HEADER = "X-Parent-Span-Id"
+
+# (trace_id, current span id, service name) of the code that is running now
+_current: ContextVar[Optional[tuple]] = ContextVar("trace", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_trace_id() -> Optional[str]:
+    ctx = _current.get()
+    return ctx[0] if ctx else None
+
+
+@contextmanager
+def use_trace(trace_id: Optional[str], parent_span_id: Optional[str] = None, service: Optional[str] = None):
+    """Makes trace_id the active trace for the block (no-op when it is empty)."""
+    if not trace_id or not TRACING_ENABLED:
+        yield
+        return
+    prev = _current.get()
+    token = _current.set((trace_id, parent_span_id, service or (prev[2] if prev else None)))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "service", "name", "kind", "start", "attrs")
+
+    def __init__(self, trace_id, parent_id, service, name, kind, attrs):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.service = service
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.attrs = attrs
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", service: Optional[str] = None, **attrs: Any):
+    """
+    Times the block as a child of the current span. kind is one of
+    "server", "http", "llm", "db", "job" or "internal".
+    """
+    ctx = _current.get()
+    if ctx is None:
+        yield _NOOP
+        return
+
+    trace_id, parent_id, ctx_service = ctx
+    sp = Span(trace_id, parent_id, service or ctx_service or "unknown", name, kind, attrs)
+    token = _current.set((trace_id, sp.span_id, sp.service))
+    status = "ok"
+    try:
+        yield sp
+    except GeneratorExit:
+        # a streaming consumer stopped early; not an error
+        raise
+    except BaseException as e:
+        status = "error"
+        sp.attrs["error"] = str(e)[:200]
+        raise
+    finally:
+        _current.reset(token)
+        _STORE.record(sp, time.time(), status)
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Adds the trace headers of the current span (for outgoing HTTP calls)."""
+    headers = dict(headers or {})
+    ctx = _current.get()
+    if ctx is not None:
+        headers[TRACE_HEADER] = ctx[0]
+        if ctx[1]:
+            headers[PARENT_HEADER] = ctx[1]
+    return headers
+
+
+def bind(fn: Callable, name: Optional[str] = None, kind: str = "job") -> Callable:
+    """
+    Wraps fn so it runs in the caller's trace when executed on another
+    thread (job queue, executor, outbox); with a name, the call is a span.
+    """
+    ctx = _current.get()
+    if ctx is None:
+        return fn
+
+    def _traced(*args, **kwargs):
+        token = _current.set(ctx)
+        try:
+            if name is None:
+                return fn(*args, **kwargs)
+            with span(name, kind=kind):
+                return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return _traced
+
+
+# ---------- web framework hooks ----------
+
+def _trace_from(headers, body) -> Optional[str]:
+    trace_id = headers.get(TRACE_HEADER)
+    if not trace_id and isinstance(body, dict):
+        trace_id = body.get("trace_id")
+    return trace_id
+
+
+def instrument_flask(app, service: str) -> None:
+    """Records a "server" span for every request that carries a trace id."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        trace_id = _trace_from(request.headers, request.get_json(silent=True))
+        if not trace_id or not TRACING_ENABLED:
+            return
+        g._trace_token = _current.set((trace_id, request.headers.get(PARENT_HEADER), service))
+        g._trace_span = span(f"{request.method} {request.path}", kind="server", service=service)
+        g._trace_span.__enter__()
+
+    @app.teardown_request
+    def _end_trace(error=None):
+        cm = g.pop("_trace_span", None)
+        if cm is None:
+            return
+        if error is not None:
+            cm.__exit__(type(error), error, error.__traceback__)
+        else:
+            cm.__exit__(None, None, None)
+        _current.reset(g.pop("_trace_token"))
+
+
+def instrument_fastapi(app, service: str) -> None:
+    """FastAPI counterpart of instrument_flask (header only, the body is not read)."""
+
+    @app.middleware("http")
+    async def _trace_middleware(request, call_next):
+        trace_id = request.headers.get(TRACE_HEADER)
+        if not trace_id or not TRACING_ENABLED:
+            return await call_next(request)
+        with use_trace(trace_id, request.headers.get(PARENT_HEADER), service):
+            with span(f"{request.method} {request.url.path}", kind="server") as sp:
+                response = await call_next(request)
+                sp.set(status_code=response.status_code)
+                return response
+
+
+# ---------- storage ----------
+
+class TraceStore:
+    def __init__(self, path: Path = TRACE_DB_PATH):
+        self.path = Path(path)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        # caller holds self._lock
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS spans (
+                    trace_id   TEXT NOT NULL,
+                    span_id    TEXT NOT NULL,
+                    parent_id  TEXT,
+                    service    TEXT NOT NULL,
+                    name       TEXT NOT NULL,
+                    kind       TEXT NOT NULL,
+                    start      REAL NOT NULL,
+                    end        REAL NOT NULL,
+                    status     TEXT NOT NULL,
+                    attrs      TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans(trace_id, start)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_spans_start ON spans(start)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def record(self, sp: Span, end: float, status: str) -> None:
+        self._queue.put((
+            sp.trace_id, sp.span_id, sp.parent_id, sp.service, sp.name, sp.kind,
+            sp.start, end, status, json.dumps(sp.attrs, ensure_ascii=False, default=str) if sp.attrs else None,
+        ))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            rows = [self._queue.get()]
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    conn = self._db()
+                    conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    now = time.time()
+                    if now - self._last_prune > 60:
+                        conn.execute("DELETE FROM spans WHERE start < ?", (now - RETENTION_SECONDS,))
+                        self._last_prune = now
+                    conn.commit()
+            except Exception as e:
+                from log import get_logger  # log imports tracing
+                get_logger("tracing").error("failed to write spans", spans=len(rows), error=str(e))
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        """Blocks until every recorded span is written."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def get(self, trace_id: str) -> List[Dict[str, Any]]:
+        self.flush()
+        with self._lock:
+            conn = self._db()
+            rows = conn.execute(
+                "SELECT span_id, parent_id, service, name, kind, start, end, status, attrs "
+                "FROM spans WHERE trace_id = ? ORDER BY start",
+                (trace_id,),
+            ).fetchall()
+        keys = ("span_id", "parent_id", "service", "name", "kind", "start", "end", "status", "attrs")
+        out = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            item["attrs"] = json.loads(item["attrs"]) if item["attrs"] else {}
+            out.append(item)
+        return out
+
+
+_STORE = TraceStore()
+
+
+def waterfall(trace_id: str, width: int = 40) -> Optional[Dict[str, Any]]:
+    """
+    Timeline of one trace: spans ordered by start time, with offsets and
+    durations in ms relative to the first span, nesting depth, and a text
+    bar for a quick look. None when the trace is unknown.
+    """
+    spans = _STORE.get(trace_id)
+    if not spans:
+        return None
+
+    t0 = min(s["start"] for s in spans)
+    total = max(s["end"] for s in spans) - t0
+    by_id = {s["span_id"]: s for s in spans}
+
+    def depth(s, seen=0):
+        parent = by_id.get(s["parent_id"])
+        return 0 if parent is None or seen > len(spans) else 1 + depth(parent, seen + 1)
+
+    items = []
+    for s in spans:
+        offset, duration = s["start"] - t0, s["end"] - s["start"]
+        col = int(width * offset / total) if total else 0
+        bar_len = max(1, int(width * duration / total)) if total else 1
+        items.append({
+            "name": s["name"],
+            "service": s["service"],
+            "kind": s["kind"],
+            "status": s["status"],
+            "start_ms": round(offset * 1000, 1),
+            "duration_ms": round(duration * 1000, 1),
+            "depth": depth(s),
+            "span_id": s["span_id"],
+            "parent_id": s["parent_id"],
+            "attrs": s["attrs"],
+            "bar": " " * col + "█" * bar_len,
+        })
+
+    return {"trace_id": trace_id, "duration_ms": round(total * 1000, 1), "spans": items}